@@ -0,0 +1,104 @@
+# rag/batch.py
+#
+# Bulk question answering for permit reviews: a list of standard questions goes
+# through retrieval in chunks, using the searchers' batched search_many (one
+# encoder pass and one matrix-matrix top-k for the vector index, one sparse
+# product for TF-IDF). Results are written as each chunk finishes.
+#
+#   python -m rag.batch questions.csv --out answers.jsonl --mode hybrid -k 6
+#   python -m rag.batch questions.txt --out answers.csv
+#
+# Input: a CSV with a "question" column (and optionally "id"), or a text file
+# with one question per line. Output: JSONL (one object per question) or CSV
+# (one row per citation), chosen by the --out suffix; JSONL to stdout by default.
+
+import argparse
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from .config import HYBRID_FUSION
+from .hybrid import MODES, Hit, search_many
+
+CSV_FIELDS = ["id", "question", "rank", "title", "source", "page", "section", "offset", "score", "backends"]
+
+
+def read_questions(path: Path) -> List[Dict[str, str]]:
+    """[{id, question}] from a CSV with a "question" column or a plain text file."""
+    path = Path(path)
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            rows = list(csv.DictReader(f))
+            if rows and "question" not in rows[0]:
+                raise ValueError(f"{path} has no 'question' column")
+        else:
+            rows = [{"question": line} for line in f]
+    out = []
+    for i, row in enumerate(rows, start=1):
+        q = (row.get("question") or "").strip()
+        if q:
+            out.append({"id": (row.get("id") or "").strip() or str(i), "question": q})
+    return out
+
+
+def run_batch(questions: List[Dict[str, str]], k: int = 6, mode: str = "hybrid", fusion: str = HYBRID_FUSION,
+              chunk: int = 256, **searchers) -> Iterator[Tuple[Dict[str, str], List[Hit]]]:
+    """(question, hits) pairs in input order, retrieved `chunk` questions at a time."""
+    for s in range(0, len(questions), chunk):
+        part = questions[s:s + chunk]
+        results = search_many([q["question"] for q in part], k, mode, fusion, **searchers)
+        yield from zip(part, results)
+
+
+def write_jsonl(results, out, context: bool = False) -> int:
+    n = 0
+    for q, hits in results:
+        row = {**q, "citations": [h.citation() for h in hits]}
+        if context:
+            row["context"] = "\n\n".join(h.record.get("text", "") for h in hits)
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        n += 1
+    return n
+
+
+def write_csv(results, out) -> int:
+    w = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    w.writeheader()
+    n = 0
+    for q, hits in results:
+        for rank, h in enumerate(hits, start=1):
+            c = h.citation()
+            w.writerow({**q, "rank": rank, **{f: c.get(f) for f in CSV_FIELDS[3:-1]},
+                        "backends": "+".join(c["backends"])})
+        n += 1
+    return n
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("questions", type=Path, help="CSV with a 'question' column, or one question per line")
+    ap.add_argument("--out", type=Path, help=".jsonl or .csv (default: JSONL to stdout)")
+    ap.add_argument("-k", type=int, default=6)
+    ap.add_argument("--mode", choices=MODES, default="hybrid")
+    ap.add_argument("--fusion", choices=["rrf", "weighted"], default=HYBRID_FUSION)
+    ap.add_argument("--chunk", type=int, default=256, help="Questions per batched search")
+    ap.add_argument("--context", action="store_true", help="Include the stitched chunk text (JSONL only)")
+    args = ap.parse_args()
+
+    questions = read_questions(args.questions)
+    t0 = time.perf_counter()
+    results = run_batch(questions, args.k, args.mode, args.fusion, args.chunk)
+    out = args.out.open("w", encoding="utf-8", newline="") if args.out else sys.stdout
+    try:
+        if args.out and args.out.suffix.lower() == ".csv":
+            n = write_csv(results, out)
+        else:
+            n = write_jsonl(results, out, args.context)
+    finally:
+        if args.out:
+            out.close()
+    dt = time.perf_counter() - t0
+    print(f"{n} questions in {dt:.1f}s ({n / dt if dt else 0:.1f} questions/s)", file=sys.stderr)
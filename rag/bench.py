@@ -0,0 +1,1546 @@
+# rag/bench.py
+#
+# Offline benchmarks for the pipeline stages. Every benchmark runs against local
+# stand-ins (HTTP servers, temp dirs) so the numbers are comparable between runs.
+#
+#   python -m rag.bench crawl --sites 4 --pages 20 --latency 0.05
+#   python -m rag.bench html              # tests/fixtures/html, or --fixtures DIR
+#   python -m rag.bench chunk --docs 50
+#   python -m rag.bench search --docs 200
+#   python -m rag.bench bm25 --docs 300
+#   python -m rag.bench append --docs 300 --adds 20
+#   python -m rag.bench vector --docs 200 --model hash
+#   python -m rag.bench embcache --docs 200 --changed 0.01
+#   python -m rag.bench encode --docs 200 --workers 1 2 4
+#   python -m rag.bench ann --docs 1000 -k 10
+#   python -m rag.bench meta --docs 100 400 1600
+#   python -m rag.bench hybrid --docs 300
+#   python -m rag.bench batch --docs 300 --queries 500
+#   python -m rag.bench server --concurrency 1 4 16 64  [--url http://127.0.0.1:8765]
+#   python -m rag.bench llm --requests 200 --questions 40 --ttft 0.2
+#   python -m rag.bench context --docs 200 --budgets 300 600 1200
+#   python -m rag.bench trace --docs 300 --queries 300
+#   python -m rag.bench swap --docs 200 --rebuilds 6
+#   python -m rag.bench importtime [--baseline importtime.json] [--save importtime.json]
+#   python -m rag.bench suite --chunks 10000 100000 1000000 --out results.json
+
+import argparse
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+# --------------------------------------------------------------------------------------
+# Stand-in HTTP site
+# --------------------------------------------------------------------------------------
+def _stand_in_page(n: int, pages: int, site: int = 0) -> str:
+    para = "".join(
+        f"<p>Section {n}.{j}. The permit holder shall comply with the applicable requirements in "
+        f'<a href="/{(n + j) % pages}.html">rule {(n + j) % pages}</a> and keep records on site.</p>'
+        for j in range(1, 21)
+    )
+    nav = "".join(f'<li><a href="/{k}.html">Nav {k}</a></li>' for k in range(10))
+    return (f"<html><head><title>Site {site} page {n}</title><script>var x = 1;</script></head>"
+            f"<body><nav><ul>{nav}</ul></nav><article>{para}</article><footer>Contact us</footer></body></html>")
+
+
+def _site_handler(pages: int, latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            try:
+                n = int(self.path.strip("/").split(".")[0] or 0)
+            except ValueError:
+                n = -1
+            if not 0 <= n < pages:
+                self.send_error(404)
+                return
+            data = _stand_in_page(n, pages, site=self.server.server_address[1]).encode()
+            etag = f'"p{n}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def serve_sites(n_sites: int, pages: int, latency: float) -> list[ThreadingHTTPServer]:
+    """Start `n_sites` local servers; each port is a separate host to the crawler."""
+    servers = []
+    for _ in range(n_sites):
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), _site_handler(pages, latency))
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+    return servers
+
+
+# --------------------------------------------------------------------------------------
+# Synthetic regulation-like corpus
+# --------------------------------------------------------------------------------------
+_UNITS = ["boiler", "stationary combustion turbine", "storage tank", "flare", "reciprocating engine",
+          "glycol dehydrator", "cooling tower", "loading rack", "process heater", "thermal oxidizer"]
+_REPORTS = ["semiannual monitoring report", "deviation report", "annual compliance certification",
+            "emissions inventory", "performance test report", "compliance assurance monitoring plan"]
+_EVENTS = ["the end of each reporting period", "initial startup", "the performance test",
+           "discovery of a deviation", "permit issuance", "a change in method of operation"]
+_POLLUTANTS = ["NOx", "VOC", "CO", "SO2", "PM10", "total HAP"]
+_FILLER = [
+    "Records required by this section shall be kept on site for at least five years.",
+    "The executive director may approve an alternative method upon request.",
+    "Each monitoring system shall be operated in accordance with the manufacturer's specifications.",
+    "Data recorded during periods of malfunction shall not be used in compliance calculations.",
+    "The permit holder shall maintain a copy of the permit at the site.",
+    "An applicant shall provide any additional information requested in writing.",
+    "Emission calculations shall use the most representative data available.",
+]
+
+
+_COUNTIES = ["Harris", "Jefferson", "Brazoria", "Galveston", "Nueces", "Ector", "Midland", "Reeves", "Webb",
+             "Dallas", "Tarrant", "Travis", "Bexar", "Orange", "Victoria", "Calhoun", "Matagorda", "Gregg",
+             "Smith", "Potter", "Randall", "Lubbock", "Howard", "Ward", "Pecos", "Hidalgo", "Cameron",
+             "Montgomery", "Chambers", "Liberty", "Hardin", "Wharton", "Fort Bend", "Collin", "Denton",
+             "Ellis", "Johnson", "McLennan", "Bell", "Williamson"]
+
+
+def synthetic_corpus(n_docs: int = 50, sections: int = 8, seed: int = 0, max_questions: int | None = None):
+    """
+    Regulation-like documents with § sections and (a)(1) subsections. Each section
+    holds one requirement sentence with a distinct (unit, report, pollutant, county)
+    combination, so the matching question has exactly one answer sentence.
+    Returns (docs, questions): docs are {"title", "pages"}, questions {"question", "answer"}.
+    """
+    import itertools
+    import random
+
+    rnd = random.Random(seed)
+    combos = list(itertools.product(_UNITS, _REPORTS, _POLLUTANTS, _COUNTIES))
+    rnd.shuffle(combos)
+    docs, questions = [], []
+    for d in range(n_docs):
+        pages = []
+        for s in range(sections):
+            i = d * sections + s
+            unit, report, pol, county = combos[i % len(combos)]
+            event, days = rnd.choice(_EVENTS), rnd.choice([10, 15, 30, 45, 60, 90, 180])
+            fact = (f"The owner or operator of each {unit} in {county} County shall submit the {report} "
+                    f"for {pol} within {days} days after {event}.")
+            body = [f"§ {100 + d}.{s + 1}. Requirements for {unit.title()} Units."]
+            for sub in "abcd":
+                body.append(f"({sub}) " + " ".join(rnd.sample(_FILLER, 3)))
+                for n in (1, 2):
+                    body.append(f"({n}) " + " ".join(rnd.sample(_FILLER, 2)))
+            body.insert(rnd.randint(2, len(body)), fact)
+            pages.append([s + 1, " ".join(body)])
+            if i < len(combos) and (max_questions is None or len(questions) < max_questions):
+                questions.append({"question": f"Within how many days must the owner of a {unit} in {county} County "
+                                              f"submit the {report} for {pol}?", "answer": fact})
+        docs.append({"title": f"Synthetic Chapter {100 + d}", "pages": pages})
+    return docs, questions
+
+
+def synthetic_chunks(path: Path, n_chunks: int, n_questions: int = 200, seed: int = 0) -> list[dict]:
+    """
+    Stream `n_chunks` chunk records straight to docs.jsonl (no chunker pass, so 1M
+    chunks stay cheap). Every chunk is one § section with a requirement sentence
+    naming a unique site (RN number), so each sampled question has one answer chunk.
+    Returns the sampled questions.
+    """
+    import json
+    import random
+
+    rnd = random.Random(seed)
+    picked = set(rnd.sample(range(n_chunks), min(n_questions, n_chunks)))
+    questions = []
+    with path.open("w", encoding="utf-8") as f:
+        for i in range(n_chunks):
+            unit, report, pol, county = (rnd.choice(_UNITS), rnd.choice(_REPORTS), rnd.choice(_POLLUTANTS),
+                                         rnd.choice(_COUNTIES))
+            site = f"RN{100000000 + i}"
+            fact = (f"The owner or operator of each {unit} at site {site} in {county} County shall submit the "
+                    f"{report} for {pol} within {rnd.choice([10, 15, 30, 45, 60, 90, 180])} days after "
+                    f"{rnd.choice(_EVENTS)}.")
+            d, s = divmod(i, 8)
+            body = [f"§ {100 + d}.{s + 1}. Requirements for {unit.title()} Units."]
+            for sub in "ab":
+                body.append(f"({sub}) " + " ".join(rnd.sample(_FILLER, 2)))
+            body.insert(rnd.randint(1, len(body)), fact)
+            rec = {"title": f"Synthetic Chapter {100 + d}", "source": f"https://example.gov/{d}",
+                   "path": f"synthetic/{d}.pdf", "offset": s * 1000, "page": s + 1, "section": f"{100 + d}.{s + 1}",
+                   "text": " ".join(body)}
+            f.write(json.dumps(rec) + "\n")
+            if i in picked:
+                questions.append({"set": "synthetic", "answer": fact,
+                                  "question": f"Within how many days must the owner of a {unit} at site {site} in "
+                                              f"{county} County submit the {report} for {pol}?"})
+    return questions
+
+
+# The shipped Title V guide, and questions whose answer is a verbatim span of it
+GUIDE_DOCX = Path(__file__).resolve().parent.parent / "Texas_Title_V_Compliance_Guide.docx"
+TITLEV_QUESTIONS = [
+    ("How is potential to emit calculated?", "PTE = Maximum Rate × Hours of Operation × Conversion Factor"),
+    ("What is the major source threshold for a single hazardous air pollutant?", "10 tpy of any single HAP"),
+    ("What is the major source threshold for combined HAPs?", "25 tpy of total HAPs"),
+    ("What VOC or NOx threshold makes a source major in a severe ozone nonattainment area?",
+     "Ozone (Severe): 25 tpy VOC or NOx"),
+    ("What order of data sources should emissions calculations use?",
+     "CEMS, source tests, material balance, AP-42 factors, manufacturer data"),
+    ("How should storage tank emissions be estimated?", "Use AP-42 Chapter 7 methods or approved software"),
+    ("Which rule allows a synthetic minor source?", "Synthetic Minor Source (30 TAC 122.120)"),
+    ("Which Texas chapter covers visible emissions?", "Chapter 111 (Visible emissions)"),
+    ("Which TAC chapter regulates NOx?", "Chapter 117 (NOx)"),
+    ("What goes in Attachment C of the application?", "Attachment C – Site layout/plot plan with EPN coordinates"),
+    ("How long must Title V records be retained?", "minimum 5-year retention (Title V)"),
+    ("What contemporaneous window applies to a netting analysis?",
+     "Netting analysis for modifications (5-year contemporaneous window)"),
+    ("How many days does administrative completeness review take?", "Administrative Completeness (45 days)"),
+    ("How soon must a Title V permit be issued after a complete application?",
+     "issued within 18 months of a complete application"),
+    ("How long is the public notice period for a Title V permit?", "30-day public notice in local paper and online"),
+    ("How long does EPA have to review a Title V permit?", "EPA 45-day review"),
+    ("When may the public petition EPA to object to a permit?",
+     "Petition to object within 60 days of close of public comment"),
+    ("How early must a renewal application be filed?", "apply for renewal at least 6 months before expiration"),
+    ("What is the maximum term of a Title V permit?", "Term: up to 5 years"),
+    ("How long is the window to request a contested case hearing?",
+     "Contested case hearing request window (typically 30 days)"),
+    ("When is the final performance test report due?", "Final test report within typical 60 days"),
+    ("When are semiannual monitoring reports due?", "commonly due Jan 30 and Jul 30"),
+    ("When is the annual emissions inventory due in STEERS?",
+     "Annual Emissions Inventory via STEERS, typically due March 31"),
+    ("What counts as a minor permit revision?", "Minor revision: does not add or violate applicable requirements"),
+    ("What must be prepared for a unit when CAM applies?",
+     "prepare indicator ranges, QA/QC, frequency, excursion response"),
+    ("What are the NOx emissions of the example natural gas boiler?", "NOx Emissions = 43.8 tpy"),
+    ("Who signs the annual compliance certification?", "Annual Compliance Certification (ACC) signed by RO"),
+    ("What is the preferred way to submit the application?", "Electronic submittal via TCEQ ePermits (preferred)"),
+]
+
+
+def guide_records(docx: Path = GUIDE_DOCX) -> list[dict]:
+    """The guide's paragraphs (read from the .docx XML, no python-docx needed), chunked like build_docs."""
+    import html
+    import re
+    import zipfile
+    from .chunking import chunk_pages
+
+    xml = zipfile.ZipFile(docx).read("word/document.xml").decode("utf-8")
+    paras = [html.unescape(re.sub(r"<[^>]+>", "", p)) for p in re.findall(r"<w:p[ >].*?</w:p>", xml, flags=re.S)]
+    text = " ".join(" ".join(paras).split())
+    return [{"title": "Texas Title V Air Quality Compliance Guide", "source": docx.name, "path": str(docx),
+             "offset": offset, "page": page, "section": section, "text": chunk}
+            for offset, page, section, chunk in chunk_pages([(None, text)])]
+
+
+# --------------------------------------------------------------------------------------
+# Benchmarks
+# --------------------------------------------------------------------------------------
+def bench_crawl(sites: int = 4, pages: int = 20, latency: float = 0.05, delay: float = 0.1,
+                workers: int = 8, per_domain: int = 2) -> dict:
+    from .fetch import crawl, crawl_serial
+
+    servers = serve_sites(sites, pages, latency)
+    seeds = [f"http://127.0.0.1:{s.server_address[1]}/0.html" for s in servers]
+    allow = ("127.0.0.1",)
+    out = {}
+    try:
+        for name, fn, kw in [
+            ("serial", crawl_serial, {}),
+            ("concurrent", crawl, {"workers": workers, "per_domain": per_domain}),
+        ]:
+            with tempfile.TemporaryDirectory() as tmp:
+                t0 = time.perf_counter()
+                fn(seeds, max_per_site=pages, delay=delay, outdir=Path(tmp), allow=allow, **kw)
+                dt = time.perf_counter() - t0
+                n = len(list(Path(tmp).glob("*.html")))
+                out[name] = {"pages": n, "seconds": round(dt, 3), "pages_per_s": round(n / dt, 2) if dt else 0.0}
+                if fn is crawl:
+                    # second pass sends conditional GETs from the manifest
+                    t0 = time.perf_counter()
+                    changed = fn(seeds, max_per_site=pages, delay=delay, outdir=Path(tmp), allow=allow, **kw)
+                    dt = time.perf_counter() - t0
+                    out["recrawl"] = {"pages": n, "changed": len(changed), "seconds": round(dt, 3)}
+    finally:
+        for s in servers:
+            s.shutdown()
+    return out
+
+
+def _html_before(html: str, url: str):
+    # what crawl + parse did per page before rag.readable: Readability and a
+    # BeautifulSoup tree twice, with the page read back from disk in between
+    from bs4 import BeautifulSoup
+    from readability import Document as ReadabilityDoc
+    from urllib.parse import urljoin
+
+    main_html = ReadabilityDoc(html).summary(html_partial=True)
+    links = [urljoin(url, a["href"]) for a in BeautifulSoup(main_html, "lxml").find_all("a", href=True)
+             if not a["href"].startswith("#")]
+    soup = BeautifulSoup(ReadabilityDoc(html).summary(), "lxml")
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    return links, soup.get_text(" ")
+
+
+# Saved TCEQ and eCFR-style pages (nav, breadcrumbs, sidebars, footers around the rule text)
+HTML_FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures" / "html"
+
+
+def bench_html(fixtures: Path = HTML_FIXTURES, repeat: int = 3) -> dict:
+    """Per-page CPU time of the old double Readability/BeautifulSoup path vs rag.readable."""
+    from .readable import readable, resolve_links
+
+    files = sorted(fixtures.glob("**/*.html"))
+    pages = [f.read_text(errors="ignore") for f in files]
+    if not pages:
+        # no saved pages: fall back to the stand-in site's markup
+        pages = [_stand_in_page(n, 40) for n in range(40)]
+    out = {}
+    for name, fn in [("before", lambda h: _html_before(h, "https://example.gov/")),
+                     ("after", lambda h: resolve_links(readable(h), "https://example.gov/"))]:
+        t0 = time.process_time()
+        for _ in range(repeat):
+            for h in pages:
+                fn(h)
+        dt = time.process_time() - t0
+        out[name] = {"pages": len(pages), "cpu_ms_per_page": round(1000 * dt / (repeat * len(pages)), 2)}
+    return out
+
+
+def _hit_rate(chunks: list[str], questions: list[dict], k: int) -> float:
+    """Share of questions whose whole answer sentence is inside one of the top-k TF-IDF chunks."""
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vec = TfidfVectorizer(ngram_range=(1, 2), max_df=0.85, min_df=2)
+    X = vec.fit_transform(chunks)
+    Q = vec.transform([q["question"] for q in questions])
+    sims = (Q @ X.T).toarray()
+    top = np.argsort(-sims, axis=1)[:, :k]
+    hits = sum(any(q["answer"] in chunks[i] for i in row) for q, row in zip(questions, top))
+    return hits / len(questions) if questions else 0.0
+
+
+def bench_chunk(n_docs: int = 50, k: int = 3) -> dict:
+    """Fixed 1200/200 windows vs section-aware chunks: count, bytes and answer hit rate."""
+    from .parse import _chunk_pages
+    from .chunking import chunk_pages
+
+    docs, questions = synthetic_corpus(n_docs)
+    out = {}
+    for name, fn in [("fixed", lambda p: [c for _, _, c in _chunk_pages(p)]),
+                     ("sections", lambda p: [c for _, _, _, c in chunk_pages(p)])]:
+        t0 = time.perf_counter()
+        chunks = [c for d in docs for c in fn(d["pages"])]
+        dt = time.perf_counter() - t0
+        out[name] = {"chunks": len(chunks), "bytes": sum(len(c.encode()) for c in chunks),
+                     "chunk_ms": round(1000 * dt, 1), f"hit@{k}": round(_hit_rate(chunks, questions, k), 3)}
+    return out
+
+
+def write_docs_jsonl(docs: list[dict], path: Path) -> int:
+    """Chunk synthetic docs the way build_docs does and write them as docs.jsonl records."""
+    import json
+    from .chunking import chunk_pages
+
+    n = 0
+    with path.open("w", encoding="utf-8") as f:
+        for i, d in enumerate(docs):
+            for offset, page, section, chunk in chunk_pages(d["pages"]):
+                rec = {"title": d["title"], "source": f"https://example.gov/{i}", "path": f"synthetic/{i}.pdf",
+                       "offset": offset, "page": page, "section": section, "text": chunk}
+                f.write(json.dumps(rec) + "\n")
+                n += 1
+    return n
+
+
+def latency_stats(seconds: list[float]) -> dict:
+    import numpy as np
+
+    ms = np.array(seconds) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(ms, p)), 2) for p in (50, 95, 99)}
+
+
+def bench_search(n_docs: int = 200, n_queries: int = 50) -> dict:
+    """Per-query latency of joblib.load-per-query search vs the resident Searcher."""
+    from .index import build_index, search_uncached, Searcher
+
+    docs, questions = synthetic_corpus(n_docs)
+    queries = [q["question"] for q in questions[:n_queries]]
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path, index_path = Path(tmp) / "docs.jsonl", Path(tmp) / "tfidf_index.joblib"
+        n = write_docs_jsonl(docs, docs_path)
+        build_index(docs_path, index_path)
+        searcher = Searcher(index_path)
+        for name, fn in [("joblib.load", lambda q: search_uncached(q, 6, index_path)),
+                         ("Searcher", lambda q: searcher.search(q, 6))]:
+            fn(queries[0])  # first call loads the Searcher; cold start is not what we measure here
+            lat = []
+            for q in queries:
+                t0 = time.perf_counter()
+                fn(q)
+                lat.append(time.perf_counter() - t0)
+            out[name] = {"chunks": n, **latency_stats(lat)}
+    return out
+
+
+def _run_queries(fn, questions: list[dict], k: int) -> dict:
+    """Latency percentiles and answer hit rate of `fn(question, k) -> [(rec, score)]`."""
+    fn(questions[0]["question"], k)
+    lat, hits = [], 0
+    for q in questions:
+        t0 = time.perf_counter()
+        res = fn(q["question"], k)
+        lat.append(time.perf_counter() - t0)
+        hits += any(q["answer"] in rec["text"] for rec, _ in res)
+    return {**latency_stats(lat), f"hit@{k}": round(hits / len(questions), 3)}
+
+
+def bench_bm25(n_docs: int = 300, n_queries: int = 200, k: int = 5) -> dict:
+    """TF-IDF Searcher vs BM25F with and without MaxScore pruning."""
+    from .index import build_index, Searcher
+    from . import bm25
+
+    docs, questions = synthetic_corpus(n_docs)
+    questions = questions[:n_queries]
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path = Path(tmp) / "docs.jsonl"
+        n = write_docs_jsonl(docs, docs_path)
+        for name, build, searcher in [
+            ("tfidf", build_index, Searcher),
+            ("bm25", bm25.build_index, bm25.Bm25Searcher),
+        ]:
+            path = Path(tmp) / name
+            t0 = time.perf_counter()
+            build(docs_path, path)
+            built = round(time.perf_counter() - t0, 2)
+            s = searcher(path)
+            size = {"chunks": n, "build_s": built, "index_mb": _size_mb(path)}
+            if name == "bm25":
+                out["bm25-exhaustive"] = {**size, **_run_queries(lambda q, k: s.search(q, k, prune=False), questions, k)}
+                out["bm25-maxscore"] = {**size, **_run_queries(lambda q, k: s.search(q, k), questions, k)}
+            else:
+                out[name] = {**size, **_run_queries(s.search, questions, k)}
+    return out
+
+
+def _size_mb(path: Path) -> float:
+    files = [p for p in path.rglob("*") if p.is_file()] if path.is_dir() else [path]
+    return round(sum(p.stat().st_size for p in files) / 2**20, 1)
+
+
+def bench_append(n_docs: int = 300, n_adds: int = 20, k: int = 5) -> dict:
+    """
+    Adding documents one at a time to the segmented BM25 index vs a full rebuild
+    per upload. Half of the adds re-add an indexed document (tombstone + replace).
+    Checks that the appended index ranks exactly like a rebuild of the same corpus.
+    """
+    import json
+    from . import bm25
+
+    docs, questions = synthetic_corpus(n_docs)
+    questions = questions[:200]
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path = Path(tmp) / "docs.jsonl"
+        write_docs_jsonl(docs, docs_path)
+        recs = [json.loads(line) for line in docs_path.open(encoding="utf-8")]
+        by_src: dict = {}
+        for r in recs:
+            by_src.setdefault(r["source"], []).append(r)
+        srcs = list(by_src)
+        new, again = srcs[len(srcs) - n_adds // 2:], srcs[:n_adds - n_adds // 2]
+
+        base_path = Path(tmp) / "base.jsonl"
+        with base_path.open("w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r) + "\n" for s in srcs if s not in new for r in by_src[s])
+        seg_dir = Path(tmp) / "segments"
+        bm25.build_index(base_path, seg_dir)
+
+        add_s, rebuild_s = [], []
+        for s in [x for pair in zip(new, again) for x in pair]:
+            t0 = time.perf_counter()
+            bm25.add_docs(by_src[s], seg_dir, merge=False)
+            add_s.append(time.perf_counter() - t0)
+            bm25.maybe_merge(seg_dir, background=False)
+        for _ in range(3):
+            t0 = time.perf_counter()
+            bm25.build_index(docs_path, Path(tmp) / "full")
+            rebuild_s.append(time.perf_counter() - t0)
+
+        inc, full = bm25.load_index(seg_dir), bm25.load_index(Path(tmp) / "full")
+        same = 0
+        for q in questions:
+            # equal scores may tie-break differently: global ids follow segment order
+            a = sorted(round(sc, 4) for _, sc in inc.search(q["question"], k))
+            b = sorted(round(sc, 4) for _, sc in full.search(q["question"], k))
+            same += a == b
+        m = bm25.read_manifest(seg_dir)
+        return {
+            "append": {"adds": len(add_s), **latency_stats(add_s), "segments": len(m["segments"]),
+                       "deleted": sum(len(e["deleted"]) for e in m["segments"]),
+                       "same_scores": round(same / len(questions), 3)},
+            "full-rebuild": {"chunks": len(recs), **latency_stats(rebuild_s)},
+        }
+
+
+def bench_vector(n_docs: int = 200, n_queries: int = 100, model: str = "hash", per_call: int = 10) -> dict:
+    """
+    Vector search latency: the old per-call path (encoder, metadata and index loaded
+    for every question) vs VectorSearcher cold start, warm distinct questions and
+    warm repeated questions (query-embedding cache hits). `model` defaults to the
+    offline stand-in encoder; pass a sentence-transformers id to time a real one.
+    """
+    import json
+    import numpy as np
+    from . import encoders
+    from .index_vector import build_vector_index
+    from .vector_query import VectorSearcher, _load_index
+
+    docs, questions = synthetic_corpus(n_docs)
+    queries = [q["question"] for q in questions[:n_queries]]
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path, vdir = Path(tmp) / "docs.jsonl", Path(tmp) / "vector"
+        n = write_docs_jsonl(docs, docs_path)
+        t0 = time.perf_counter()
+        build_vector_index(docs_path=docs_path, vector_dir=vdir, model_name=model, cache_dir=Path(tmp) / "cache")
+        built = round(time.perf_counter() - t0, 2)
+
+        lat = []
+        for q in queries[:per_call]:
+            t0 = time.perf_counter()
+            enc = encoders.load_encoder(model)
+            metas = [json.loads(line) for line in docs_path.open(encoding="utf-8")]  # the old meta.jsonl parse
+            index, kind = _load_index(vdir / "faiss.index")
+            vec = enc.encode([q], normalize_embeddings=True)[0].astype("float32")
+            if kind == "faiss":
+                ids = index.search(vec.reshape(1, -1), 6)[1][0]
+            else:
+                ids = np.argsort(-index.scores(vec))[:6]  # the old full sort
+            hits = [metas[i] for i in ids if 0 <= i < len(metas)]  # records returned from the parsed list
+            lat.append(time.perf_counter() - t0)
+            assert len(hits) == min(6, n)
+        out["per-call"] = {"chunks": n, "build_s": built, **latency_stats(lat)}
+
+        encoders._encoders.pop(model, None)  # cold: nothing loaded in this process yet
+        s = VectorSearcher(vdir)
+        t0 = time.perf_counter()
+        s.search(queries[0], 6)
+        out["cold-start"] = {"first_query_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+        for name in ("warm-distinct", "warm-repeat"):
+            lat = []
+            for q in queries:
+                t0 = time.perf_counter()
+                s.search(q.upper() if name == "warm-repeat" else q, 6)  # normalization makes case irrelevant
+                lat.append(time.perf_counter() - t0)
+            out[name] = {**latency_stats(lat), "cache_hits": s.hits}
+    return out
+
+
+def bench_embcache(n_docs: int = 200, changed: float = 0.01, model: str = "hash") -> dict:
+    """Vector index build with an empty embedding cache vs a rebuild after `changed` of the chunks were edited."""
+    import json
+    from .index_vector import build_vector_index
+
+    docs, _ = synthetic_corpus(n_docs)
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path, vdir, cdir = Path(tmp) / "docs.jsonl", Path(tmp) / "vector", Path(tmp) / "cache"
+        write_docs_jsonl(docs, docs_path)
+        for name in ("cold", "unchanged", "edited"):
+            if name == "edited":
+                lines = docs_path.read_text(encoding="utf-8").splitlines()
+                step = max(1, round(1 / changed)) if changed else len(lines) + 1
+                recs = [json.loads(l) for l in lines]
+                for r in recs[::step]:
+                    r["text"] += " Amended."
+                docs_path.write_text("".join(json.dumps(r) + "\n" for r in recs), encoding="utf-8")
+            stats = {}
+            t0 = time.perf_counter()
+            build_vector_index(docs_path=docs_path, vector_dir=vdir, model_name=model, cache_dir=cdir, stats=stats)
+            out[name] = {"build_s": round(time.perf_counter() - t0, 2), **stats}
+    return out
+
+
+def bench_encode(n_docs: int = 200, workers=(1, 2, 4), model: str = "hash", batch_size: int = 64) -> dict:
+    """Encoding throughput (chunks/s, empty embedding cache) by worker count, file order vs length buckets."""
+    from .index_vector import encode_into_cache
+    from .embcache import EmbeddingCache, text_hash
+    import json
+
+    docs, _ = synthetic_corpus(n_docs)
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path = Path(tmp) / "docs.jsonl"
+        write_docs_jsonl(docs, docs_path)
+        texts = [json.loads(line)["text"] for line in docs_path.open(encoding="utf-8")]
+        todo = {text_hash(t): t for t in texts}
+        runs = [(w, True) for w in workers] + [(1, False)]
+        for i, (w, bucket) in enumerate(runs):
+            cache = EmbeddingCache(model, Path(tmp) / f"cache{i}")
+            t0 = time.perf_counter()
+            used = encode_into_cache(cache, todo, model, batch_size, w, bucket)
+            dt = time.perf_counter() - t0
+            name = f"workers={w}" + ("" if bucket else " unsorted")
+            out[name] = {"chunks": len(todo), "processes": used, "seconds": round(dt, 2),
+                         "chunks_per_s": round(len(todo) / dt, 1)}
+    return out
+
+
+ANN_CONFIGS = [
+    # (name, VECTOR_INDEX kind, numpy dtype, nprobe, efSearch)
+    ("numpy-float32", "numpy", "float32", 0, 0),
+    ("numpy-float16", "numpy", "float16", 0, 0),
+    ("numpy-int8", "numpy", "int8", 0, 0),
+    ("flat", "flat", None, 0, 0),
+    ("ivf-nprobe4", "ivf", None, 4, 0),
+    ("ivf-nprobe16", "ivf", None, 16, 0),
+    ("ivf-nprobe64", "ivf", None, 64, 0),
+    ("hnsw-ef16", "hnsw", None, 0, 16),
+    ("hnsw-ef64", "hnsw", None, 0, 64),
+    ("hnsw-ef256", "hnsw", None, 0, 256),
+    ("ivfpq-nprobe16", "ivfpq", None, 16, 0),
+    ("ivfpq-nprobe64", "ivfpq", None, 64, 0),
+]
+
+
+def bench_ann(n_docs: int = 1000, n_queries: int = 200, k: int = 10, model: str = "hash") -> dict:
+    """
+    recall@k (against exact float32 search), query latency, index size and build
+    time for each vector index configuration in ANN_CONFIGS.
+    """
+    import json
+    import numpy as np
+    from .embcache import EmbeddingCache, text_hash
+    from .encoders import get_encoder
+    from .index_vector import encode_into_cache, _write_index, get_faiss
+    from .vector_query import _load_index
+
+    docs, questions = synthetic_corpus(n_docs)
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path = Path(tmp) / "docs.jsonl"
+        write_docs_jsonl(docs, docs_path)
+        hashes, todo = [], {}
+        for line in docs_path.open(encoding="utf-8"):
+            text = json.loads(line)["text"]
+            hashes.append(text_hash(text))
+            todo[hashes[-1]] = text
+        cache = EmbeddingCache(model, Path(tmp) / "cache")
+        encode_into_cache(cache, todo, model, workers=1)
+        rows = cache.lookup(hashes)
+        Q = get_encoder(model).encode([q["question"] for q in questions[:n_queries]], normalize_embeddings=True)
+
+        truth = None
+        for name, kind, dtype, nprobe, ef in ANN_CONFIGS:
+            if kind != "numpy" and get_faiss() is None:
+                continue
+            path = Path(tmp) / name / "faiss.index"
+            path.parent.mkdir()
+            t0 = time.perf_counter()
+            spec = _write_index(cache, rows, path, kind, dtype or "float32")
+            built = round(time.perf_counter() - t0, 2)
+            index, typ = _load_index(path, nprobe, ef)
+            lat, found = [], []
+            for q in Q:
+                t0 = time.perf_counter()
+                ids = index.search(q.reshape(1, -1), k)[1][0] if typ == "faiss" else index.search(q, k)[0]
+                lat.append(time.perf_counter() - t0)
+                found.append(set(int(i) for i in ids))
+            if truth is None:  # the first config is exact float32
+                truth = found
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            # numpy: the matrix searches read, held in memory (float16 is widened to float32 on load)
+            matrix_mb = round(index.X.nbytes / 2 ** 20, 1) if typ == "numpy" else None
+            out[name] = {"index": spec, "build_s": built, "index_mb": _size_mb(path.parent), "matrix_mb": matrix_mb,
+                         f"recall@{k}": round(float(recall), 3), **latency_stats(lat)}
+    return out
+
+
+def bench_meta(sizes=(100, 400, 1600), fetches: int = 200, k: int = 6) -> dict:
+    """
+    Chunk metadata: parsing meta.jsonl into a list (the old per-load path) vs the
+    memory-mapped MetaStore. Load time, Python heap held after loading, and the
+    time to fetch the k records of one query, by corpus size.
+    """
+    import json
+    import random
+    import tracemalloc
+    from .metastore import MetaStore, write_store
+
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_docs in sizes:
+            docs, _ = synthetic_corpus(n_docs)
+            docs_path, store_path = Path(tmp) / f"{n_docs}.jsonl", Path(tmp) / f"{n_docs}.store"
+            n = write_docs_jsonl(docs, docs_path)
+            write_store(store_path, (json.loads(line) for line in docs_path.open(encoding="utf-8")))
+            rng = random.Random(0)
+            queries = [[rng.randrange(n) for _ in range(k)] for _ in range(fetches)]
+            for name, load in [
+                ("jsonl", lambda: [json.loads(line) for line in docs_path.open(encoding="utf-8")]),
+                ("store", lambda: MetaStore(store_path)),
+            ]:
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                metas = load()
+                load_ms = (time.perf_counter() - t0) * 1000
+                held = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                lat = []
+                for ids in queries:
+                    t0 = time.perf_counter()
+                    [metas[i] for i in ids]
+                    lat.append(time.perf_counter() - t0)
+                out[f"{name}-{n}"] = {"load_ms": round(load_ms, 1), "heap_mb": round(held / 2**20, 2),
+                                      "file_mb": _size_mb(docs_path if name == "jsonl" else store_path),
+                                      **latency_stats(lat)}
+                del metas
+    return out
+
+
+def bench_hybrid(n_docs: int = 300, n_queries: int = 200, k: int = 5, model: str = "hash") -> dict:
+    """
+    Keyword, vector and hybrid (RRF / weighted) retrieval: latency and hit@k.
+    "sequential" runs both backends one after the other, for comparison with the
+    concurrent hybrid path.
+    """
+    from . import bm25, hybrid
+    from .index_vector import build_vector_index
+    from .vector_query import VectorSearcher
+
+    docs, questions = synthetic_corpus(n_docs)
+    questions = questions[:n_queries]
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path = Path(tmp) / "docs.jsonl"
+        write_docs_jsonl(docs, docs_path)
+        bm25.build_index(docs_path, Path(tmp) / "bm25")
+        build_vector_index(docs_path=docs_path, vector_dir=Path(tmp) / "vector", model_name=model,
+                           cache_dir=Path(tmp) / "cache")
+        kw, vec = bm25.Bm25Searcher(Path(tmp) / "bm25"), VectorSearcher(Path(tmp) / "vector", cache_size=0)
+        runs = {
+            "keyword": lambda q, k: hybrid.search(q, k, "keyword", keyword=kw, vector=vec),
+            "vector": lambda q, k: hybrid.search(q, k, "vector", keyword=kw, vector=vec),
+            "sequential": lambda q, k: hybrid.fuse({"keyword": kw.search(q, hybrid.HYBRID_DEPTH * k),
+                                                    "vector": vec.search(q, hybrid.HYBRID_DEPTH * k)}, k),
+            "hybrid-rrf": lambda q, k: hybrid.search(q, k, "hybrid", "rrf", keyword=kw, vector=vec),
+            "hybrid-weighted": lambda q, k: hybrid.search(q, k, "hybrid", "weighted", keyword=kw, vector=vec),
+        }
+        for name, fn in runs.items():
+            fn(questions[0]["question"], k)  # load indexes and encoder
+            out[name] = _run_queries(lambda q, k: [(h.record, h.score) for h in fn(q, k)], questions, k)
+    return out
+
+
+def bench_batch(n_docs: int = 300, n_queries: int = 500, k: int = 6, model: str = "hash") -> dict:
+    """
+    Questions per second: the per-question loop (search() for each) vs the batched
+    search_many of each backend and of hybrid retrieval. "same" is the share of
+    questions whose top-k scores match the loop.
+    """
+    import numpy as np
+    from . import bm25, hybrid, index
+    from .index_vector import build_vector_index
+    from .vector_query import VectorSearcher
+
+    docs, questions = synthetic_corpus(n_docs)
+    queries = [q["question"] for q in questions]
+    queries = (queries * (n_queries // len(queries) + 1))[:n_queries]
+    queries = [f"{q} ({i})" for i, q in enumerate(queries)]  # distinct, so the embedding cache never hits
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path = Path(tmp) / "docs.jsonl"
+        write_docs_jsonl(docs, docs_path)
+        index.build_index(docs_path, Path(tmp) / "tfidf.joblib")
+        bm25.build_index(docs_path, Path(tmp) / "bm25")
+        build_vector_index(docs_path=docs_path, vector_dir=Path(tmp) / "vector", model_name=model,
+                           cache_dir=Path(tmp) / "cache")
+        tfidf, kw = index.Searcher(Path(tmp) / "tfidf.joblib"), bm25.Bm25Searcher(Path(tmp) / "bm25")
+        vec = VectorSearcher(Path(tmp) / "vector", cache_size=0)
+
+        def hybrid_one(q, k):
+            return [(h.record, h.score) for h in hybrid.search(q, k, keyword=kw, vector=vec)]
+
+        def hybrid_many(qs, k):
+            return [[(h.record, h.score) for h in hits] for hits in hybrid.search_many(qs, k, keyword=kw, vector=vec)]
+
+        for name, one, many in (("tfidf", tfidf.search, tfidf.search_many), ("bm25", kw.search, kw.search_many),
+                                ("vector", vec.search, vec.search_many), ("hybrid", hybrid_one, hybrid_many)):
+            one(queries[0], k), many(queries[:2], k)  # load indexes and encoder
+            t0 = time.perf_counter()
+            looped = [one(q, k) for q in queries]
+            t_loop = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            batched = many(queries, k)
+            t_batch = time.perf_counter() - t0
+            same = sum(np.allclose(sorted(s for _, s in a), sorted(s for _, s in b), atol=1e-5)
+                       for a, b in zip(looped, batched))
+            out[name] = {"loop_qps": round(len(queries) / t_loop, 1), "batch_qps": round(len(queries) / t_batch, 1),
+                         "speedup": round(t_loop / t_batch, 2), "same": round(same / len(queries), 3)}
+    return out
+
+
+def _load(client, queries: list[str], concurrency: int, requests: int, mode: str) -> dict:
+    """`requests` searches from `concurrency` threads, each with its own keep-alive connection."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    per = max(1, requests // concurrency)
+
+    def worker(w):
+        lat = []
+        for i in range(per):
+            t0 = time.perf_counter()
+            client.search(queries[(w * per + i) % len(queries)], k=6, mode=mode)
+            lat.append(time.perf_counter() - t0)
+        return lat
+
+    before = client.request("GET", "/stats")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        lat = [x for part in pool.map(worker, range(concurrency)) for x in part]
+    wall = time.perf_counter() - t0
+    after = client.request("GET", "/stats")
+    batches = after["batches"] - before["batches"]
+    return {"qps": round(len(lat) / wall, 1), **latency_stats(lat),
+            "mean_batch": round((after["queries"] - before["queries"]) / batches, 2) if batches else 0.0}
+
+
+def bench_server(n_docs: int = 300, concurrency=(1, 4, 16, 64), requests: int = 800, mode: str = "hybrid",
+                 model: str = "hash", url: str | None = None) -> dict:
+    """
+    Load test for rag.server: throughput and tail latency as concurrency rises,
+    with micro-batching (max batch 32) and without (max batch 1). With `url`,
+    an already running server is measured instead of temp stand-in indexes.
+    """
+    from . import bm25
+    from .index_vector import build_vector_index
+    from .server import QueryClient, QueryServer
+    from .vector_query import VectorSearcher
+
+    docs, questions = synthetic_corpus(n_docs)
+    queries = [f"{q['question']} ({i})" for i, q in enumerate(questions * 4)]  # distinct: no embedding cache hits
+    out = {}
+    if url:
+        client = QueryClient(url)
+        for c in concurrency:
+            out[f"c={c}"] = _load(client, queries, c, requests, mode)
+        return out
+    with tempfile.TemporaryDirectory() as tmp:
+        docs_path = Path(tmp) / "docs.jsonl"
+        write_docs_jsonl(docs, docs_path)
+        bm25.build_index(docs_path, Path(tmp) / "bm25")
+        build_vector_index(docs_path=docs_path, vector_dir=Path(tmp) / "vector", model_name=model,
+                           cache_dir=Path(tmp) / "cache")
+        for max_batch in (1, 32):
+            server = QueryServer(bm25.Bm25Searcher(Path(tmp) / "bm25"),
+                                 VectorSearcher(Path(tmp) / "vector", cache_size=0), max_batch=max_batch)
+            client = QueryClient(f"http://127.0.0.1:{server.start_background('127.0.0.1', 0)}")
+            for c in concurrency:
+                out[f"batch={max_batch} c={c}"] = _load(client, queries, c, requests, mode)
+            server.stop()
+    return out
+
+
+# --------------------------------------------------------------------------------------
+# Stand-in chat-completions endpoint (OpenAI wire format, streaming and not)
+# --------------------------------------------------------------------------------------
+def _chat_handler(ttft: float, per_token: float, tokens: int, counters: dict, prefill: float = 0.0):
+    import json
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so client connection reuse is visible
+
+        def setup(self):
+            super().setup()
+            counters["connections"] += 1
+
+        def _send(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        def do_POST(self):
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            counters["completions"] += 1
+            prompt = req["messages"][-1]["content"]
+            question = prompt.split("\n")[1]
+            words = (f"Stand-in answer to: {question} " * 8).split()[:tokens]
+            base = {"id": "cmpl-standin", "created": int(time.time()), "model": req["model"]}
+            time.sleep(ttft + prefill * len(prompt) / 4)  # prompt processing grows with its length
+            if not req.get("stream"):
+                time.sleep(per_token * len(words))
+                body = json.dumps({**base, "object": "chat.completion", "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                     "finish_reason": "stop"}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, w in enumerate(words):
+                if i:
+                    time.sleep(per_token)
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [
+                    {"index": 0, "delta": {"content": (" " if i else "") + w}, "finish_reason": None}]}
+                self._send(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self._send(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def bench_llm(n_requests: int = 200, n_questions: int = 40, ttft: float = 0.2, per_token: float = 0.005,
+              tokens: int = 40, calls: int = 20) -> dict:
+    """
+    rag.llm against a local stand-in chat-completions server: a new client per call
+    (the old path) vs the pooled client, time to first token when streaming, and
+    the answer cache hit rate over a workload of repeated questions (Zipf-like).
+    """
+    import os
+    import numpy as np
+    from openai import OpenAI
+    from . import llm
+
+    counters = {"connections": 0, "completions": 0}
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _chat_handler(ttft, per_token, tokens, counters))
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{srv.server_address[1]}/v1"
+    saved_env = {k: os.environ.get(k) for k in ("OPENAI_API_KEY", "OPENAI_BASE_URL")}
+    os.environ.update(OPENAI_API_KEY="stand-in", OPENAI_BASE_URL=base_url)
+    saved_cache = llm._cache
+    out = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            ctx = "Section 122.146. The permit holder shall submit the annual compliance certification."
+            msgs = llm._messages("warm up", ctx)
+
+            def timed(fn):
+                c0, lat = counters["connections"], []
+                for i in range(calls):
+                    t0 = time.perf_counter()
+                    fn(i)
+                    lat.append(time.perf_counter() - t0)
+                return {**latency_stats(lat), "connections": counters["connections"] - c0}
+
+            out["new-client"] = timed(lambda i: OpenAI(api_key="stand-in", base_url=base_url).chat.completions.create(
+                model="stand-in", messages=msgs))
+            llm._cache = llm.AnswerCache(Path(tmp) / "off.sqlite", ttl=0)
+            out["pooled"] = timed(lambda i: llm.synthesize_with_openai(f"q{i}", ctx))
+
+            first, total = [], []
+            for i in range(calls):
+                t0 = time.perf_counter()
+                for j, _ in enumerate(llm.stream_openai(f"s{i}", ctx)):
+                    if j == 0:
+                        first.append(time.perf_counter() - t0)
+                total.append(time.perf_counter() - t0)
+            out["stream"] = {"ttft_ms": latency_stats(first)["p50_ms"], "total_ms": latency_stats(total)["p50_ms"]}
+
+            llm._cache = llm.AnswerCache(Path(tmp) / "answers.sqlite", max_entries=n_questions // 2)
+            rng = np.random.default_rng(0)
+            picks = np.minimum(rng.zipf(1.3, n_requests), n_questions) - 1
+            hit_lat, miss_lat = [], []
+            for q in picks:
+                h0 = llm._cache.hits
+                t0 = time.perf_counter()
+                llm.answer_with_fallback(f"Question {q}: when is the certification due?", ctx)
+                (hit_lat if llm._cache.hits > h0 else miss_lat).append(time.perf_counter() - t0)
+            out["cache"] = {"requests": n_requests, "distinct": int(len(set(picks.tolist()))),
+                            "hit_rate": round(len(hit_lat) / n_requests, 3), "entries": len(llm._cache),
+                            "hit_p50_ms": latency_stats(hit_lat)["p50_ms"] if hit_lat else None,
+                            "miss_p50_ms": latency_stats(miss_lat)["p50_ms"] if miss_lat else None}
+    finally:
+        llm._cache = saved_cache
+        llm._client = None
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        srv.shutdown()
+    return out
+
+
+def bench_context(n_docs: int = 200, n_questions: int = 100, k: int = 6, budgets=(300, 600, 1200),
+                  llm_calls: int = 20, prefill: float = 0.0005) -> dict:
+    """
+    Prompt size, LLM latency and answer recall (the labeled answer sentence is in
+    the prompt) for the stitched top-k chunks, the old 1,500-character cut and
+    rag.context packing at several token budgets. The LLM is a stand-in whose
+    prompt processing costs `prefill` seconds per token.
+    """
+    import os
+    from . import bm25, llm
+    from .context import count_tokens, pack
+    from .query import citation
+
+    docs, questions = synthetic_corpus(n_docs)
+    questions = questions[:n_questions]
+    counters = {"connections": 0, "completions": 0}
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _chat_handler(0.05, 0.0, 20, counters, prefill))
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    saved_env = {k: os.environ.get(k) for k in ("OPENAI_API_KEY", "OPENAI_BASE_URL")}
+    os.environ.update(OPENAI_API_KEY="stand-in", OPENAI_BASE_URL=f"http://127.0.0.1:{srv.server_address[1]}/v1")
+    out = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            docs_path = Path(tmp) / "docs.jsonl"
+            write_docs_jsonl(docs, docs_path)
+            bm25.build_index(docs_path, Path(tmp) / "bm25")
+            searcher = bm25.Bm25Searcher(Path(tmp) / "bm25")
+            retrieved = [searcher.search(q["question"], k) for q in questions]
+
+            variants = {"stitched": lambda q, res: "\n\n".join(r["text"] for r, _ in res),
+                        "cut-1500": lambda q, res: llm.compress_extractive("\n\n".join(r["text"] for r, _ in res))}
+            for b in budgets:
+                variants[f"packed-{b}"] = lambda q, res, b=b: pack(
+                    q, [r for r, _ in res], [citation(r, s) for r, s in res], b).text
+            for name, build in variants.items():
+                build_s, contexts = [], []
+                for q, res in zip(questions, retrieved):
+                    t0 = time.perf_counter()
+                    contexts.append(build(q["question"], res))
+                    build_s.append(time.perf_counter() - t0)
+                tokens = [count_tokens(llm._messages(q["question"], c)[1]["content"]) for q, c in zip(questions, contexts)]
+                lat = []
+                for q, c in list(zip(questions, contexts))[:llm_calls]:
+                    t0 = time.perf_counter()
+                    llm.synthesize_with_openai(q["question"], c, use_cache=False)
+                    lat.append(time.perf_counter() - t0)
+                out[name] = {"prompt_tokens": int(sum(tokens) / len(tokens)),
+                             "build_ms": latency_stats(build_s)["p50_ms"],
+                             "llm_p50_ms": latency_stats(lat)["p50_ms"],
+                             "answer_recall": round(sum(q["answer"] in c for q, c in zip(questions, contexts))
+                                                    / len(questions), 3)}
+    finally:
+        llm._client = None
+        for key, v in saved_env.items():
+            if v is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = v
+        srv.shutdown()
+    return out
+
+
+def bench_trace(n_docs: int = 300, n_queries: int = 300, k: int = 6, n_spans: int = 200_000,
+                model: str = "hash") -> dict:
+    """
+    rag.trace overhead: the cost of one span (and of a @traced call) with tracing
+    off and on, and hybrid retrieval latency with tracing off and on (one run,
+    i.e. one trace-log line, per question).
+    """
+    from . import bm25, hybrid, trace
+    from .index_vector import build_vector_index
+    from .vector_query import VectorSearcher
+
+    def per_call_ns(fn):
+        t0 = time.perf_counter()
+        for _ in range(n_spans):
+            fn()
+        return round((time.perf_counter() - t0) / n_spans * 1e9, 1)
+
+    @trace.traced("bench.fn")
+    def traced_fn():
+        pass
+
+    def span():
+        with trace.span("bench.span"):
+            pass
+
+    docs, questions = synthetic_corpus(n_docs)
+    questions = questions[:n_queries]
+    saved_log, saved_on = trace.TRACE_LOG, trace.enabled()
+    out = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            trace.TRACE_LOG = Path(tmp) / "trace.jsonl"
+            baseline = per_call_ns(lambda: None)
+            for on in (False, True):
+                trace.enable(on)
+                with trace.span("bench"):  # spans nest under one run instead of logging one run each
+                    out["on" if on else "off"] = {"span_ns": round(per_call_ns(span) - baseline, 1),
+                                                  "traced_ns": round(per_call_ns(traced_fn) - baseline, 1)}
+
+            docs_path = Path(tmp) / "docs.jsonl"
+            write_docs_jsonl(docs, docs_path)
+            trace.enable(False)
+            bm25.build_index(docs_path, Path(tmp) / "bm25")
+            build_vector_index(docs_path=docs_path, vector_dir=Path(tmp) / "vector", model_name=model,
+                               cache_dir=Path(tmp) / "cache")
+            kw, vec = bm25.Bm25Searcher(Path(tmp) / "bm25"), VectorSearcher(Path(tmp) / "vector", cache_size=0)
+            fn = lambda q, k: [(h.record, h.score) for h in hybrid.search(q, k, "hybrid", keyword=kw, vector=vec)]
+            for on in (False, True, False):  # off again last: the first pass also warms caches
+                trace.enable(on)
+                out["on" if on else "off"].update(_run_queries(fn, questions, k))
+            out["on"]["log_kb"] = round(trace.TRACE_LOG.stat().st_size / 1024, 1)
+    finally:
+        trace.TRACE_LOG = saved_log
+        trace.enable(saved_on)
+    return out
+
+
+# --------------------------------------------------------------------------------------
+# Retrieval suite: every backend over scaled corpora, build and query in subprocesses
+# --------------------------------------------------------------------------------------
+SUITE_BACKENDS = ["tfidf", "bm25", "vector", "hybrid"]
+
+
+def _suite_build(backend: str, docs_path: Path, work: Path, model: str, vector_index: str) -> dict:
+    from . import bm25, index
+    from .index_vector import build_vector_index
+
+    t0 = time.perf_counter()
+    if backend == "tfidf":
+        index.build_index(docs_path, work / "tfidf.joblib")
+        files = [work / "tfidf.joblib", index.meta_path(work / "tfidf.joblib")]
+    elif backend == "bm25":
+        bm25.build_index(docs_path, work / "bm25")
+        files = [work / "bm25"]
+    elif backend == "vector":
+        build_vector_index(docs_path=docs_path, vector_dir=work / "vector", model_name=model,
+                           cache_dir=work / "embcache", workers=1, kind=vector_index)
+        files = [work / "vector"]
+    else:
+        return {}  # hybrid reuses the bm25 and vector indexes
+    return {"build_s": round(time.perf_counter() - t0, 2), "size_mb": round(sum(_size_mb(p) for p in files), 2)}
+
+
+def _suite_searcher(backend: str, work: Path):
+    from . import bm25, hybrid, index
+    from .vector_query import VectorSearcher
+
+    if backend == "tfidf":
+        return index.Searcher(work / "tfidf.joblib").search
+    if backend == "bm25":
+        return bm25.Bm25Searcher(work / "bm25").search
+    if backend == "vector":
+        return VectorSearcher(work / "vector", cache_size=0).search
+    kw, vec = bm25.Bm25Searcher(work / "bm25"), VectorSearcher(work / "vector", cache_size=0)
+    return lambda q, k: [(h.record, h.score) for h in hybrid.search(q, k, keyword=kw, vector=vec)]
+
+
+def _suite_query(backend: str, work: Path, questions: list[dict], k: int) -> dict:
+    search = _suite_searcher(backend, work)
+    t0 = time.perf_counter()
+    search(questions[0]["question"], k)  # loads the index (and encoder)
+    out = {"load_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    lat, by_set = [], {}
+    for q in questions:
+        t0 = time.perf_counter()
+        res = search(q["question"], k)
+        lat.append(time.perf_counter() - t0)
+        rank = next((r for r, (rec, _) in enumerate(res, 1) if q["answer"] in rec.get("text", "")), None)
+        by_set.setdefault(q["set"], []).append(rank)
+    out.update(latency_stats(lat))
+    for name, ranks in by_set.items():
+        out[f"{name}_recall@{k}"] = round(sum(r is not None for r in ranks) / len(ranks), 3)
+        out[f"{name}_mrr"] = round(sum(1 / r for r in ranks if r) / len(ranks), 3)
+    return out
+
+
+def _suite_worker(args) -> None:
+    """One stage in a fresh process, so its peak RSS is that stage's alone; prints one JSON line."""
+    import json
+    import resource
+
+    work = Path(args.work)
+    if args.stage == "build":
+        res = _suite_build(args.backend, work / "docs.jsonl", work, args.model, args.vector_index)
+    else:
+        questions = json.loads((work / "questions.json").read_text(encoding="utf-8"))
+        res = _suite_query(args.backend, work, questions, args.k)
+    res[f"{args.stage}_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(json.dumps(res))
+
+
+def bench_suite(sizes=(10_000,), backends=SUITE_BACKENDS, n_questions: int = 200, k: int = 10,
+                model: str = "hash", vector_index: str = "flat", out: Path | None = None,
+                work: Path | None = None) -> dict:
+    """
+    Every retrieval backend over synthetic corpora of `sizes` chunks, with the
+    shipped Title V guide mixed in: build time, index size, peak RSS of build and
+    of querying, p50/p95/p99 latency, and recall@k / MRR for the synthetic
+    questions and for TITLEV_QUESTIONS. Each stage runs in its own process.
+    Results are also written to `out` as JSON for comparing runs.
+    """
+    import json
+    import os
+    import platform
+    import subprocess
+    import sys
+
+    rows = {}
+    report = {"meta": {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                       "machine": platform.machine(), "cpus": os.cpu_count(), "model": model,
+                       "vector_index": vector_index, "k": k},
+              "results": []}
+    for n in sizes:
+        with tempfile.TemporaryDirectory(dir=work) as tmp:
+            tmp = Path(tmp)
+            t0 = time.perf_counter()
+            questions = synthetic_chunks(tmp / "docs.jsonl", n, n_questions)
+            guide = guide_records()
+            with (tmp / "docs.jsonl").open("a", encoding="utf-8") as f:
+                for rec in guide:
+                    f.write(json.dumps(rec) + "\n")
+            questions += [{"set": "titlev", "question": q, "answer": a} for q, a in TITLEV_QUESTIONS]
+            (tmp / "questions.json").write_text(json.dumps(questions), encoding="utf-8")
+            gen_s = round(time.perf_counter() - t0, 1)
+            for backend in backends:
+                row = {"chunks": n + len(guide), "backend": backend}
+                for stage in ("query",) if backend == "hybrid" else ("build", "query"):
+                    cmd = [sys.executable, "-m", "rag.bench", "_suite-worker", "--stage", stage, "--backend", backend,
+                           "--work", str(tmp), "--model", model, "--vector-index", vector_index, "-k", str(k)]
+                    p = subprocess.run(cmd, capture_output=True, text=True,
+                                       cwd=Path(__file__).resolve().parent.parent)
+                    if p.returncode != 0:
+                        row[f"{stage}_error"] = (p.stderr.strip().splitlines() or ["failed"])[-1]
+                        break
+                    row.update(json.loads(p.stdout.strip().splitlines()[-1]))
+                report["results"].append({**row, "corpus_s": gen_s})
+                rows[f"{n // 1000}k {backend}"] = {k_: v for k_, v in row.items() if k_ not in ("chunks", "backend")}
+    if out:
+        Path(out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return rows
+
+
+def bench_swap(n_docs: int = 200, rebuilds: int = 6, model: str = "hash") -> dict:
+    """
+    Vector searches running while the index is rebuilt `rebuilds` times, alternating
+    between two corpora: built in place (the old sidebar button) vs a new
+    generation published by rag.jobs. A result is "inconsistent" when its score
+    does not match the returned chunk, i.e. the index and the records came from
+    different builds.
+    """
+    import numpy as np
+    from . import jobs
+    from .encoders import get_encoder
+    from .index_vector import build_vector_index
+    from .vector_query import VectorSearcher
+
+    enc = get_encoder(model)
+    corpora = [synthetic_corpus(n_docs, seed=0), synthetic_corpus(n_docs // 2, seed=1)]
+    questions = [q["question"] for q in corpora[0][1][:50]]
+    out = {}
+    for mode in ("in-place", "generations"):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            live = tmp / "vector"
+            for i, (docs, _) in enumerate(corpora):
+                write_docs_jsonl(docs, tmp / f"docs{i}.jsonl")
+
+            def rebuild(i: int):
+                docs_path = tmp / f"docs{i % 2}.jsonl"
+                if mode == "in-place":
+                    build_vector_index(docs_path=docs_path, vector_dir=live, model_name=model,
+                                       cache_dir=tmp / "cache", workers=1)
+                else:
+                    gen = jobs.new_generation("vector", tmp / "generations")
+                    build_vector_index(docs_path=docs_path, vector_dir=gen, model_name=model,
+                                       cache_dir=tmp / "cache", workers=1)
+                    jobs.publish(live, gen)
+                    jobs.prune("vector", live, 2, tmp / "generations")
+
+            rebuild(0)
+            searcher = VectorSearcher(live, cache_size=0)
+            counts = {"queries": 0, "errors": 0, "empty": 0, "inconsistent": 0}
+            lat, done = [], threading.Event()
+
+            def query_loop():
+                n = 0
+                while not done.is_set():
+                    q = questions[n % len(questions)]
+                    n += 1
+                    t0 = time.perf_counter()
+                    try:
+                        res = searcher.search(q, 3)
+                    except Exception:
+                        counts["errors"] += 1
+                        continue
+                    lat.append(time.perf_counter() - t0)
+                    counts["queries"] += 1
+                    if not res:
+                        counts["empty"] += 1
+                        continue
+                    qv = searcher.embed(q)
+                    rv = np.asarray(enc.encode([res[0][0]["text"]], normalize_embeddings=True)[0], dtype=np.float32)
+                    counts["inconsistent"] += abs(float(qv @ rv) - res[0][1]) > 1e-3
+
+            t = threading.Thread(target=query_loop)
+            t.start()
+            t0 = time.perf_counter()
+            for i in range(1, rebuilds + 1):
+                rebuild(i)
+            done.set()
+            t.join()
+            out[mode] = {"rebuild_s": round((time.perf_counter() - t0) / rebuilds, 2), **counts,
+                         **latency_stats(lat)}
+    return out
+
+
+# --------------------------------------------------------------------------------------
+# Cold start: python -X importtime over the modules the apps import
+# --------------------------------------------------------------------------------------
+IMPORT_TARGETS = {
+    # everything streamlit_app imports from rag (streamlit itself excluded)
+    "app": "import rag.config, rag.parse, rag.dedup, rag.index, rag.bm25, rag.query, rag.hybrid, rag.llm, "
+           "rag.index_vector, rag.vector_query, rag.server, rag.trace, rag.jobs",
+    "keyword": "import rag.query",
+    "server": "import rag.server",
+}
+# loaded on first use of the feature that needs them, never at import
+HEAVY_MODULES = ("sklearn", "scipy", "joblib", "faiss", "torch", "sentence_transformers", "transformers",
+                 "pdfminer", "readability", "pandas", "plotly", "tiktoken", "openai", "docx", "requests")
+
+
+def _importtime(stmt: str) -> tuple[float, list[str]]:
+    """(cumulative ms, modules imported) for `stmt` in a fresh interpreter."""
+    import subprocess
+    import sys
+
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", stmt], capture_output=True, text=True,
+                         cwd=Path(__file__).resolve().parent.parent, check=True)
+    total, modules = 0, []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        modules.append(name.strip())
+        if name[1:2] != " ":  # top level of the statement (nested imports are indented)
+            total += int(cum)
+    return total / 1000, modules
+
+
+def bench_importtime(targets=tuple(IMPORT_TARGETS), repeat: int = 5, baseline: Path | None = None,
+                     tolerance: float = 0.25, save: Path | None = None) -> dict:
+    """
+    Import time of each target in a fresh interpreter (best of `repeat`), the
+    modules it loads and any HEAVY_MODULES among them. A target fails when it
+    loads a heavy module, or is more than `tolerance` (plus 20 ms of noise)
+    slower than in the `baseline` JSON written earlier with `save`.
+    """
+    import json
+
+    base = json.loads(baseline.read_text(encoding="utf-8")) if baseline else {}
+    out = {}
+    for name in targets:
+        runs = [_importtime(IMPORT_TARGETS[name]) for _ in range(repeat)]
+        ms, modules = min(runs)
+        heavy = sorted({m.split(".")[0] for m in modules} & set(HEAVY_MODULES))
+        row = {"ms": round(ms, 1), "modules": len(modules), "heavy": ",".join(heavy) or "-"}
+        problems = [f"imports {m}" for m in heavy]
+        if name in base:
+            limit = base[name]["ms"] * (1 + tolerance) + 20
+            row["baseline_ms"] = base[name]["ms"]
+            if ms > limit:
+                problems.append(f"{ms:.0f} ms > {limit:.0f} ms")
+        row["status"] = "; ".join(problems) or "ok"
+        out[name] = row
+    if save:
+        save.write_text(json.dumps({n: {"ms": r["ms"], "modules": r["modules"]} for n, r in out.items()}, indent=2),
+                        encoding="utf-8")
+    return out
+
+
+def _print(title: str, res: dict):
+    print(title)
+    for name, row in res.items():
+        print(f"  {name:<16} " + "  ".join(f"{k}={v}" for k, v in row.items()))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    c = sub.add_parser("crawl", help="Serial vs concurrent crawler against local stand-in sites")
+    c.add_argument("--sites", type=int, default=4)
+    c.add_argument("--pages", type=int, default=20)
+    c.add_argument("--latency", type=float, default=0.05, help="Server response delay (s)")
+    c.add_argument("--delay", type=float, default=0.1, help="Per-host politeness delay (s)")
+    c.add_argument("--workers", type=int, default=8)
+    c.add_argument("--per-domain", type=int, default=2)
+
+    h = sub.add_parser("html", help="Per-page CPU time of HTML processing before/after rag.readable")
+    h.add_argument("--fixtures", type=Path, default=HTML_FIXTURES, help="Directory of saved .html pages (default: tests/fixtures/html)")
+    h.add_argument("--repeat", type=int, default=3)
+
+    c = sub.add_parser("chunk", help="Fixed-window vs section-aware chunking on a synthetic corpus")
+    c.add_argument("--docs", type=int, default=50)
+    c.add_argument("-k", type=int, default=3)
+
+    c = sub.add_parser("search", help="TF-IDF query latency: joblib.load per query vs resident Searcher")
+    c.add_argument("--docs", type=int, default=200)
+    c.add_argument("--queries", type=int, default=50)
+
+    c = sub.add_parser("bm25", help="TF-IDF vs BM25F (exhaustive and MaxScore) latency and hit rate")
+    c.add_argument("--docs", type=int, default=300)
+    c.add_argument("--queries", type=int, default=200)
+    c.add_argument("-k", type=int, default=5)
+
+    c = sub.add_parser("append", help="Appending uploads to BM25 segments vs a full rebuild per upload")
+    c.add_argument("--docs", type=int, default=300)
+    c.add_argument("--adds", type=int, default=20)
+
+    c = sub.add_parser("vector", help="Vector search: per-call loading vs resident VectorSearcher (cold/warm)")
+    c.add_argument("--docs", type=int, default=200)
+    c.add_argument("--queries", type=int, default=100)
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("embcache", help="Vector index build: empty embedding cache vs incremental rebuilds")
+    c.add_argument("--docs", type=int, default=200)
+    c.add_argument("--changed", type=float, default=0.01, help="Share of chunks edited before the last rebuild")
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("encode", help="Encoding throughput by worker count, with and without length buckets")
+    c.add_argument("--docs", type=int, default=200)
+    c.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("ann", help="Vector index types: recall@k vs latency vs memory")
+    c.add_argument("--docs", type=int, default=1000)
+    c.add_argument("--queries", type=int, default=200)
+    c.add_argument("-k", type=int, default=10)
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("meta", help="Chunk metadata: meta.jsonl list vs memory-mapped MetaStore by corpus size")
+    c.add_argument("--docs", type=int, nargs="+", default=[100, 400, 1600])
+
+    c = sub.add_parser("hybrid", help="Keyword vs vector vs hybrid (RRF / weighted) latency and hit rate")
+    c.add_argument("--docs", type=int, default=300)
+    c.add_argument("--queries", type=int, default=200)
+    c.add_argument("-k", type=int, default=5)
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("batch", help="Questions/s: per-question loop vs batched search_many")
+    c.add_argument("--docs", type=int, default=300)
+    c.add_argument("--queries", type=int, default=500)
+    c.add_argument("-k", type=int, default=6)
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("server", help="Query server load test: throughput / tail latency vs concurrency")
+    c.add_argument("--docs", type=int, default=300)
+    c.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    c.add_argument("--requests", type=int, default=800, help="Per concurrency level")
+    c.add_argument("--mode", choices=["keyword", "vector", "hybrid"], default="hybrid")
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+    c.add_argument("--url", help="Measure a running rag.server instead of a temp one")
+
+    c = sub.add_parser("llm", help="rag.llm vs a stand-in chat-completions server: pooling, TTFT, answer cache")
+    c.add_argument("--requests", type=int, default=200)
+    c.add_argument("--questions", type=int, default=40)
+    c.add_argument("--ttft", type=float, default=0.2, help="Stand-in seconds to first token")
+    c.add_argument("--per-token", type=float, default=0.005)
+
+    c = sub.add_parser("context", help="Prompt tokens, LLM latency and answer recall: stitched vs cut vs packed")
+    c.add_argument("--docs", type=int, default=200)
+    c.add_argument("--questions", type=int, default=100)
+    c.add_argument("-k", type=int, default=6)
+    c.add_argument("--budgets", type=int, nargs="+", default=[300, 600, 1200])
+
+    c = sub.add_parser("trace", help="rag.trace overhead: per span and on hybrid retrieval, tracing off vs on")
+    c.add_argument("--docs", type=int, default=300)
+    c.add_argument("--queries", type=int, default=300)
+    c.add_argument("-k", type=int, default=6)
+    c.add_argument("--spans", type=int, default=200_000)
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("swap", help="Searches during vector rebuilds: in place vs generation swap (rag.jobs)")
+    c.add_argument("--docs", type=int, default=200)
+    c.add_argument("--rebuilds", type=int, default=6)
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+
+    c = sub.add_parser("importtime", help="Cold-start import time of the apps; exits 1 on a heavy import or regression")
+    c.add_argument("--targets", nargs="+", choices=list(IMPORT_TARGETS), default=list(IMPORT_TARGETS))
+    c.add_argument("--repeat", type=int, default=5)
+    c.add_argument("--baseline", type=Path, help="JSON from an earlier --save to compare against")
+    c.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline")
+    c.add_argument("--save", type=Path, help="Write this run's times as the new baseline")
+
+    c = sub.add_parser("suite", help="All retrieval backends over scaled corpora: build, size, RSS, latency, recall")
+    c.add_argument("--chunks", type=int, nargs="+", default=[10_000], help="Synthetic corpus sizes")
+    c.add_argument("--backends", nargs="+", choices=SUITE_BACKENDS, default=SUITE_BACKENDS)
+    c.add_argument("--questions", type=int, default=200, help="Synthetic questions (plus the Title V guide set)")
+    c.add_argument("-k", type=int, default=10)
+    c.add_argument("--model", default="hash", help="Encoder name; 'hash' is the offline stand-in")
+    c.add_argument("--vector-index", default="flat", choices=["flat", "ivf", "hnsw", "ivfpq", "numpy"])
+    c.add_argument("--out", type=Path, help="Write the results as JSON")
+    c.add_argument("--work", type=Path, help="Parent directory for the temporary corpora (default: system temp)")
+
+    c = sub.add_parser("_suite-worker")  # one build/query stage of `suite`, in its own process
+    c.add_argument("--stage", choices=["build", "query"], required=True)
+    c.add_argument("--backend", choices=SUITE_BACKENDS, required=True)
+    c.add_argument("--work", required=True)
+    c.add_argument("--model", default="hash")
+    c.add_argument("--vector-index", default="flat")
+    c.add_argument("-k", type=int, default=10)
+
+    args = ap.parse_args()
+    if args.cmd == "crawl":
+        _print("crawl", bench_crawl(args.sites, args.pages, args.latency, args.delay, args.workers, args.per_domain))
+    elif args.cmd == "html":
+        _print("html", bench_html(args.fixtures, args.repeat))
+    elif args.cmd == "chunk":
+        _print("chunk", bench_chunk(args.docs, args.k))
+    elif args.cmd == "search":
+        _print("search", bench_search(args.docs, args.queries))
+    elif args.cmd == "bm25":
+        _print("bm25", bench_bm25(args.docs, args.queries, args.k))
+    elif args.cmd == "append":
+        _print("append", bench_append(args.docs, args.adds))
+    elif args.cmd == "vector":
+        _print("vector", bench_vector(args.docs, args.queries, args.model))
+    elif args.cmd == "embcache":
+        _print("embcache", bench_embcache(args.docs, args.changed, args.model))
+    elif args.cmd == "encode":
+        _print("encode", bench_encode(args.docs, args.workers, args.model))
+    elif args.cmd == "ann":
+        _print("ann", bench_ann(args.docs, args.queries, args.k, args.model))
+    elif args.cmd == "meta":
+        _print("meta", bench_meta(args.docs))
+    elif args.cmd == "hybrid":
+        _print("hybrid", bench_hybrid(args.docs, args.queries, args.k, args.model))
+    elif args.cmd == "batch":
+        _print("batch", bench_batch(args.docs, args.queries, args.k, args.model))
+    elif args.cmd == "server":
+        _print("server", bench_server(args.docs, args.concurrency, args.requests, args.mode, args.model, args.url))
+    elif args.cmd == "llm":
+        _print("llm", bench_llm(args.requests, args.questions, args.ttft, args.per_token))
+    elif args.cmd == "context":
+        _print("context", bench_context(args.docs, args.questions, args.k, args.budgets))
+    elif args.cmd == "trace":
+        _print("trace", bench_trace(args.docs, args.queries, args.k, args.spans, args.model))
+    elif args.cmd == "swap":
+        _print("swap", bench_swap(args.docs, args.rebuilds, args.model))
+    elif args.cmd == "importtime":
+        res = bench_importtime(args.targets, args.repeat, args.baseline, args.tolerance, args.save)
+        _print("importtime", res)
+        if any(r["status"] != "ok" for r in res.values()):
+            raise SystemExit(1)
+    elif args.cmd == "suite":
+        _print("suite", bench_suite(args.chunks, args.backends, args.questions, args.k, args.model,
+                                    args.vector_index, args.out, args.work))
+    elif args.cmd == "_suite-worker":
+        _suite_worker(args)
@@ -0,0 +1,59 @@
+# rag/binfile.py
+#
+# Minimal container for named numpy arrays in one binary file:
+#
+#   magic (8 bytes) | header length (uint64 LE) | JSON header | arrays, 64-byte aligned
+#
+# The header holds free-form metadata plus dtype/shape/offset of every array, so
+# readers can np.memmap each array without loading the file.
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+
+_ALIGN = 64
+
+
+def write_arrays(path: Path, magic: bytes, meta: dict, arrays: Dict[str, np.ndarray]):
+    """Write `arrays` and `meta` to `path` atomically (temp file + rename)."""
+    assert len(magic) == 8
+    layout, offset = {}, 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({"meta": meta, "arrays": layout}).encode()
+    start = -(-(16 + len(header)) // _ALIGN) * _ALIGN
+
+    tmp = Path(f"{path}.tmp")
+    with tmp.open("wb") as f:
+        f.write(magic + struct.pack("<Q", len(header)) + header)
+        f.write(b"\0" * (start - 16 - len(header)))
+        for name, arr in arrays.items():
+            data = np.ascontiguousarray(arr).tobytes()
+            f.write(data)
+            f.write(b"\0" * (-len(data) % _ALIGN))
+    os.replace(tmp, path)
+
+
+def read_arrays(path: Path, magic: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """(meta, arrays) with every array memory-mapped read-only."""
+    with open(path, "rb") as f:
+        head = f.read(16)
+        if head[:8] != magic:
+            raise ValueError(f"{path} is not a {magic!r} file")
+        (n,) = struct.unpack("<Q", head[8:])
+        header = json.loads(f.read(n))
+    start = -(-(16 + n) // _ALIGN) * _ALIGN
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", offset=start + spec["offset"], shape=shape)
+    return header["meta"], arrays
@@ -0,0 +1,628 @@
+# rag/bm25.py
+#
+# BM25F keyword engine with its own inverted index. Postings are array-backed
+# (doc ids + per-field term frequencies) in a binary file that is memory-mapped
+# at query time. Queries run term-at-a-time with MaxScore pruning: once the
+# remaining terms' score upper bounds cannot lift a new document into the top-k,
+# those terms are only looked up for the current candidates, so query cost follows
+# the query terms' postings rather than the corpus size. A batch (search_many)
+# is scored term at a time instead: each distinct term's postings are read once
+# for every query in the batch that has the term.
+#
+# The index is a directory of immutable segment files listed in segments.json.
+# New documents go into a new small segment instead of a full rebuild; deleting a
+# document (or re-adding its source) records a tombstone in the manifest. Small
+# or mostly-deleted segments are merged in a background thread. Every change is
+# published by atomically replacing the manifest, and IDF, document count and
+# average lengths are computed over the live documents of all segments. Manifest
+# updates hold an OS file lock on write.lock, so writers in different processes
+# (a build job, the Streamlit upload tab) take turns.
+#
+#   python -m rag.bm25 --rebuild
+#   python -m rag.bm25 --add data/raw/custom/permit.pdf
+#   python -m rag.bm25 --changed   # pages the last crawl fetched
+
+import argparse
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .binfile import read_arrays, write_arrays
+from .config import BM25_DIR, BM25_K1, BM25_FIELDS, BM25_MAX_SEGMENTS, BM25_MERGE_DELETED, index_docs
+
+MAGIC = b"RAGBM25\x02"
+ACC_CELLS = 1 << 24  # search_many: dense float32 scores per block of queries (64 MB)
+MANIFEST = "segments.json"
+FIELDS = tuple(BM25_FIELDS)  # order of the tf / doc_len columns
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+_STOP = frozenset(
+    "a an and are as at be by for from has have in is it its of on or shall that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words; rule numbers like 122.10 stay one token."""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOP]
+
+
+def _field_text(rec: dict, field: str) -> str:
+    return rec.get(field) or ""
+
+
+def _doc_key(rec: dict) -> str:
+    """What a document is replaced or deleted by: its source URL, else its file path (uploads)."""
+    return rec.get("source") or rec.get("path") or ""
+
+
+# --------------------------------------------------------------------------------------
+# Build
+# --------------------------------------------------------------------------------------
+def build_arrays(records: Iterable[dict]) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Inverted index arrays for `records` (docs.jsonl dicts)."""
+    vocab: Dict[str, int] = {}
+    T, D, F, C = [], [], [], []
+    doc_len, blobs, doc_keys = [], [], []
+    for d, rec in enumerate(records):
+        lens = []
+        for f, field in enumerate(FIELDS):
+            counts = Counter(tokenize(_field_text(rec, field)))
+            lens.append(sum(counts.values()))
+            for term, c in counts.items():
+                T.append(vocab.setdefault(term, len(vocab)))
+                D.append(d)
+                F.append(f)
+                C.append(c)
+        doc_len.append(lens)
+        blobs.append(json.dumps(rec).encode())
+        doc_keys.append(_doc_key(rec))
+    n_docs = len(blobs)
+    key_list = sorted(set(doc_keys))
+    key_id = {k: i for i, k in enumerate(key_list)}
+
+    # renumber terms in sorted order so the vocabulary can be stored as one sorted blob
+    terms = sorted(vocab)
+    remap = np.empty(len(vocab), dtype=np.int64)
+    remap[[vocab[t] for t in terms]] = np.arange(len(terms))
+    T = remap[np.array(T, dtype=np.int64)] if T else np.zeros(0, dtype=np.int64)
+    D = np.array(D, dtype=np.int64)
+
+    # one posting per (term, doc), sorted by term then doc; field tfs side by side
+    keys, inverse = np.unique(T * max(n_docs, 1) + D, return_inverse=True)
+    tf = np.zeros((len(keys), len(FIELDS)), dtype=np.uint16)
+    np.add.at(tf, (inverse, np.array(F, dtype=np.int64)), np.minimum(np.array(C), 65535).astype(np.uint16))
+    post_terms = keys // max(n_docs, 1)
+    term_ptr = np.searchsorted(post_terms, np.arange(len(terms) + 1)).astype(np.int64)
+
+    vocab_blob = "\n".join(terms).encode()
+    doc_ptr = np.zeros(n_docs + 1, dtype=np.int64)
+    doc_ptr[1:] = np.cumsum([len(b) for b in blobs])
+    arrays = {
+        "term_ptr": term_ptr,
+        "doc_ids": (keys % max(n_docs, 1)).astype(np.int32),
+        "tf": tf,
+        "doc_len": np.array(doc_len, dtype=np.uint32).reshape(n_docs, len(FIELDS)),
+        "vocab": np.frombuffer(vocab_blob, dtype=np.uint8),
+        "doc_blob": np.frombuffer(b"".join(blobs), dtype=np.uint8),
+        "doc_ptr": doc_ptr,
+        "keys": np.frombuffer("\n".join(key_list).encode(), dtype=np.uint8),
+        "doc_key": np.array([key_id[k] for k in doc_keys], dtype=np.int32),
+    }
+    return {"n_docs": n_docs, "fields": list(FIELDS)}, arrays
+
+
+def _iter_docs(path: Path):
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+# --------------------------------------------------------------------------------------
+# Query
+# --------------------------------------------------------------------------------------
+class Segment:
+    """One memory-mapped index file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta, a = read_arrays(self.path, MAGIC)
+        self.term_ptr, self.doc_ids, self.tf = a["term_ptr"], a["doc_ids"], a["tf"]
+        self.doc_len, self.doc_blob, self.doc_ptr = a["doc_len"], a["doc_blob"], a["doc_ptr"]
+        terms = bytes(a["vocab"]).decode().split("\n") if len(a["vocab"]) else []
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.n_docs = int(self.meta["n_docs"])
+        keys = bytes(a["keys"]).decode().split("\n") if len(a["keys"]) else []
+        self.keys = {k: i for i, k in enumerate(keys)}
+        self.doc_key = a["doc_key"]
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        i = self.vocab.get(term)
+        if i is None:
+            return np.zeros(0, dtype=np.int32), np.zeros((0, len(FIELDS)), dtype=np.uint16)
+        s, e = self.term_ptr[i], self.term_ptr[i + 1]
+        return self.doc_ids[s:e], self.tf[s:e]
+
+    def doc(self, i: int) -> dict:
+        return json.loads(bytes(self.doc_blob[self.doc_ptr[i]:self.doc_ptr[i + 1]]))
+
+    def ids_for_keys(self, keys: Iterable[str]) -> np.ndarray:
+        """Local ids of the documents whose source URL / path is in `keys`."""
+        wanted = [self.keys[k] for k in keys if k in self.keys]
+        if not wanted:
+            return np.zeros(0, dtype=np.int64)
+        return np.nonzero(np.isin(self.doc_key, wanted))[0]
+
+
+class Bm25Index:
+    """
+    BM25F over one or more segments with corpus-wide statistics. `live` holds a
+    boolean mask per segment (None: no deletions); deleted documents are neither
+    scored nor counted in the statistics. Per field f with weight w_f and length
+    normalization b_f:
+
+        tf~(t, d) = sum_f w_f * tf_f / (1 - b_f + b_f * len_f(d) / avglen_f)
+        score(d)  = sum_t idf(t) * tf~ * (k1 + 1) / (tf~ + k1)
+    """
+
+    def __init__(self, segments: List[Segment], k1: float = BM25_K1, fields: dict = BM25_FIELDS,
+                 live: Optional[List[Optional[np.ndarray]]] = None):
+        self.segments = segments
+        self.live = live or [None] * len(segments)
+        self.k1 = k1
+        self.weights = np.array([fields[f]["weight"] for f in FIELDS], dtype=np.float32)
+        self.b = np.array([fields[f]["b"] for f in FIELDS], dtype=np.float32)
+        self.bases = np.cumsum([0] + [s.n_docs for s in segments])  # global id space, deleted included
+        total = np.zeros(len(FIELDS))
+        self.n_docs = 0
+        for seg, live in zip(segments, self.live):
+            lens = seg.doc_len if live is None else seg.doc_len[live]
+            total += lens.sum(axis=0, dtype=np.float64)
+            self.n_docs += len(lens)
+        self.avglen = np.maximum(total / max(self.n_docs, 1), 1e-9).astype(np.float32)
+        self._ub: Dict[str, float] = {}
+        self._idf: Dict[str, float] = {}
+
+    def _postings(self, s: int, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        d, tf = self.segments[s].postings(term)
+        live = self.live[s]
+        if live is not None and len(d):
+            keep = live[d]
+            d, tf = d[keep], tf[keep]
+        return d, tf
+
+    def _norm_tf(self, seg: Segment, ids: np.ndarray, tf: np.ndarray) -> np.ndarray:
+        lens = seg.doc_len[ids].astype(np.float32)
+        denom = 1 - self.b + self.b * lens / self.avglen
+        return (tf.astype(np.float32) * self.weights / denom).sum(axis=1)
+
+    def _score(self, ntf: np.ndarray, idf: float) -> np.ndarray:
+        return idf * ntf * (self.k1 + 1) / (ntf + self.k1)
+
+    def idf(self, term: str) -> float:
+        if term not in self._idf:
+            df = sum(len(self._postings(s, term)[0]) for s in range(len(self.segments)))
+            self._idf[term] = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5)) if df else 0.0
+        return self._idf[term]
+
+    def _scored(self, term: str, idf: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Global doc ids and scores of every posting of `term`."""
+        ids, scores = [], []
+        for s, (base, seg) in enumerate(zip(self.bases, self.segments)):
+            d, tf = self._postings(s, term)
+            if len(d):
+                ids.append(d.astype(np.int64) + base)
+                scores.append(self._score(self._norm_tf(seg, d, tf), idf))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(ids), np.concatenate(scores)
+
+    def _add_for(self, term: str, idf: float, cand: np.ndarray, acc: np.ndarray):
+        """Add `term`'s score to the candidates only (binary search into each segment's postings)."""
+        for s, (base, seg) in enumerate(zip(self.bases, self.segments)):
+            d, tf = self._postings(s, term)
+            if not len(d):
+                continue
+            lo, hi = np.searchsorted(cand, [base, base + seg.n_docs])
+            sub = cand[lo:hi] - base
+            pos = np.minimum(np.searchsorted(d, sub), len(d) - 1)
+            hit = d[pos] == sub
+            if hit.any():
+                view = acc[lo:hi]
+                view[hit] += self._score(self._norm_tf(seg, d[pos[hit]], tf[pos[hit]]), idf)
+
+    def upper_bound(self, term: str) -> float:
+        """Highest score `term` alone can add to any document (computed once per index load)."""
+        if term not in self._ub:
+            scores = self._scored(term, self.idf(term))[1]
+            self._ub[term] = float(scores.max()) if len(scores) else 0.0
+        return self._ub[term]
+
+    def search_ids(self, query: str, top_k: int = 8, prune: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        terms = sorted({t for t in tokenize(query) if self.upper_bound(t) > 0}, key=self.upper_bound, reverse=True)
+        if not terms or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ubs = np.array([self.upper_bound(t) for t in terms])
+        rest = np.concatenate([np.cumsum(ubs[::-1])[::-1], [0.0]])  # rest[i] = sum of ubs[i:]
+
+        cand = np.zeros(0, dtype=np.int64)
+        acc = np.zeros(0, dtype=np.float32)
+        theta = 0.0
+        for i, term in enumerate(terms):
+            idf = self.idf(term)
+            if prune and len(cand) >= top_k and rest[i] <= theta:
+                # MaxScore: the remaining terms cannot lift a document outside `cand`
+                # into the top-k, so only score them for the candidates and drop the
+                # candidates that can no longer reach theta
+                self._add_for(term, idf, cand, acc)
+                keep = acc + rest[i + 1] >= theta
+                cand, acc = cand[keep], acc[keep]
+            else:
+                ids, scores = self._scored(term, idf)
+                merged = np.union1d(cand, ids)
+                new_acc = np.zeros(len(merged), dtype=np.float32)
+                new_acc[np.searchsorted(merged, cand)] = acc
+                new_acc[np.searchsorted(merged, ids)] += scores
+                cand, acc = merged, new_acc
+            if len(acc) >= top_k:
+                theta = float(np.partition(acc, len(acc) - top_k)[len(acc) - top_k])
+        k = min(top_k, len(acc))
+        best = np.argpartition(-acc, k - 1)[:k]
+        best = best[np.argsort(-acc[best], kind="stable")]
+        return cand[best], acc[best]
+
+    def search_many_ids(self, queries: List[str], top_k: int = 8,
+                        max_cells: int = ACC_CELLS) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        search_ids for a list of queries, term at a time across all of them: each
+        distinct term's postings are read and scored once and added to the dense
+        score row of every query that has the term. Exhaustive rather than MaxScore,
+        so the results are those of search_ids(prune=False). Queries go in blocks
+        of at most `max_cells` / documents rows.
+        """
+        n = int(self.bases[-1])
+        out = []
+        block = max(1, max_cells // max(n, 1))
+        for b in range(0, len(queries), block):
+            part = queries[b:b + block]
+            by_term: Dict[str, List[int]] = {}
+            for r, q in enumerate(part):
+                for t in {t for t in tokenize(q) if self.idf(t) > 0}:
+                    by_term.setdefault(t, []).append(r)
+            acc = np.zeros((len(part), n), dtype=np.float32)
+            for term, rows in by_term.items():
+                ids, scores = self._scored(term, self.idf(term))
+                acc[np.ix_(rows, ids)] += scores  # ids are distinct within a term
+            k = min(top_k, n)
+            if k <= 0:
+                out.extend((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in part)
+                continue
+            best = np.argpartition(-acc, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(acc, best, axis=1)
+            order = np.argsort(-top, axis=1, kind="stable")
+            best, top = np.take_along_axis(best, order, axis=1), np.take_along_axis(top, order, axis=1)
+            for ids, scores in zip(best, top):
+                hit = scores > 0  # documents with none of the query's terms
+                out.append((ids[hit].astype(np.int64), scores[hit]))
+        return out
+
+    def search_many(self, queries: List[str], top_k: int = 8):
+        return [[(self.doc(int(i)), float(s)) for i, s in zip(ids, scores)]
+                for ids, scores in self.search_many_ids(queries, top_k)]
+
+    def doc(self, gid: int) -> dict:
+        s = int(np.searchsorted(self.bases, gid, side="right") - 1)
+        return self.segments[s].doc(int(gid - self.bases[s]))
+
+    def search(self, query: str, top_k: int = 8, prune: bool = True):
+        ids, scores = self.search_ids(query, top_k, prune)
+        return [(self.doc(int(i)), float(s)) for i, s in zip(ids, scores)]
+
+
+# --------------------------------------------------------------------------------------
+# Segments
+# --------------------------------------------------------------------------------------
+_write_lock = threading.Lock()  # one writer at a time in this process; readers only see whole manifests
+_merge_lock = threading.Lock()
+LOCK_FILE = "write.lock"
+MERGE_LOCK_FILE = "merge.lock"
+_open: Dict[str, Segment] = {}  # segment files are immutable, so they are opened once
+
+
+def _segment(path: Path) -> Segment:
+    seg = _open.get(str(path))
+    if seg is None:
+        seg = _open[str(path)] = Segment(path)
+    return seg
+
+
+def read_manifest(index_dir: Path = BM25_DIR) -> dict:
+    """{"next": n, "segments": [{"file", "n_docs", "deleted": [local ids]}]}"""
+    p = Path(index_dir) / MANIFEST
+    if not p.exists():
+        return {"next": 0, "segments": []}
+    return json.loads(p.read_text(encoding="utf-8"))
+
+
+@contextmanager
+def _flock(path: Path):
+    """Exclusive OS lock on `path`, held across processes until the block ends."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # gives up after ~10 s; try again
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def _locked(index_dir: Path):
+    """The write lock (manifest updates, segment names), in this process and across processes."""
+    with _write_lock, _flock(Path(index_dir) / LOCK_FILE):
+        yield
+
+
+def _publish(index_dir: Path, manifest: dict):
+    tmp = Path(index_dir) / f"{MANIFEST}.tmp"
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp, Path(index_dir) / MANIFEST)
+
+
+def _remove(index_dir: Path, files: Iterable[str]):
+    for name in files:
+        _open.pop(str(Path(index_dir) / name), None)
+        try:
+            (Path(index_dir) / name).unlink()
+        except OSError:
+            pass  # already gone, or still mapped on Windows; the next rebuild sweeps it
+
+
+def _reserve(manifest: dict) -> str:
+    name = f"seg-{manifest['next']:06d}.idx"
+    manifest["next"] += 1
+    return name
+
+
+def _write_segment(index_dir: Path, name: str, records: Iterable[dict]) -> dict:
+    meta, arrays = build_arrays(records)
+    write_arrays(Path(index_dir) / name, MAGIC, meta, arrays)
+    return {"file": name, "n_docs": meta["n_docs"], "deleted": []}
+
+
+def _tombstone(index_dir: Path, manifest: dict, keys: set) -> int:
+    n = 0
+    for e in manifest["segments"]:
+        ids = _segment(Path(index_dir) / e["file"]).ids_for_keys(keys)
+        if len(ids):
+            dead = set(e["deleted"])
+            n += sum(int(i) not in dead for i in ids)
+            e["deleted"] = sorted(dead.union(int(i) for i in ids))
+    return n
+
+
+def build_index(docs_path: Optional[Path] = None, index_dir: Path = BM25_DIR) -> str:
+    """Full rebuild: one segment over the deduplicated chunks replaces every existing segment."""
+    docs_path = docs_path or index_docs()
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    with _locked(index_dir):
+        manifest = read_manifest(index_dir)
+        entry = _write_segment(index_dir, _reserve(manifest), _iter_docs(docs_path))
+        manifest["segments"] = [entry]
+        _publish(index_dir, manifest)
+        # under the lock, so a segment another writer publishes right after is not swept
+        _remove(index_dir, [p.name for p in index_dir.glob("seg-*.idx") if p.name != entry["file"]])
+    return str(index_dir)
+
+
+def add_docs(records: Iterable[dict], index_dir: Path = BM25_DIR, merge: bool = True) -> dict:
+    """
+    Append `records` as a new segment. Older chunks with the same source URL (or
+    path, for uploads) are tombstoned in the same manifest update, so a re-fetched
+    page replaces its previous version atomically.
+    """
+    records = list(records)
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    with _locked(index_dir):
+        manifest = read_manifest(index_dir)
+        deleted = _tombstone(index_dir, manifest, {_doc_key(r) for r in records})
+        if records:
+            manifest["segments"].append(_write_segment(index_dir, _reserve(manifest), records))
+        _publish(index_dir, manifest)
+    if merge:
+        maybe_merge(index_dir)
+    return {"added": len(records), "deleted": deleted, "segments": len(manifest["segments"])}
+
+
+def delete_docs(keys: Iterable[str], index_dir: Path = BM25_DIR) -> int:
+    """Tombstone every chunk whose source URL or path is in `keys`; returns how many."""
+    with _locked(index_dir):
+        manifest = read_manifest(index_dir)
+        n = _tombstone(index_dir, manifest, set(keys))
+        if n:
+            _publish(index_dir, manifest)
+    return n
+
+
+def _merge_plan(manifest: dict) -> List[str]:
+    """Segments worth rewriting: mostly-deleted ones, plus all but the largest once there are too many."""
+    segs = manifest["segments"]
+    plan = [e for e in segs if e["deleted"] and len(e["deleted"]) >= BM25_MERGE_DELETED * e["n_docs"]]
+    if len(segs) > BM25_MAX_SEGMENTS:
+        rest = sorted((e for e in segs if e not in plan), key=lambda e: e["n_docs"] - len(e["deleted"]))
+        plan += rest[:-1]
+    return [e["file"] for e in plan]
+
+
+def merge_segments(index_dir: Path = BM25_DIR, files: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Rewrite `files` (default: the merge plan) as one segment without their deleted
+    documents. Documents are read outside the write lock, so adds and deletes go on
+    meanwhile; deletions that arrive during the merge are carried over to the new
+    segment. Returns the new segment's file name.
+    """
+    index_dir = Path(index_dir)
+    with _merge_lock, _flock(index_dir / MERGE_LOCK_FILE):
+        with _locked(index_dir):
+            manifest = read_manifest(index_dir)
+            files = set(_merge_plan(manifest) if files is None else files)
+            inputs = [e for e in manifest["segments"] if e["file"] in files]
+            if not inputs:
+                return None
+            # opened under the lock: a rebuild in another process may delete the files once it is released
+            opened = [_segment(index_dir / e["file"]) for e in inputs]
+            name = _reserve(manifest)
+            _publish(index_dir, manifest)
+
+        records, remap = [], {}
+        for e, seg in zip(inputs, opened):
+            new_id = np.full(seg.n_docs, -1, dtype=np.int64)
+            dead = set(e["deleted"])
+            for i in range(seg.n_docs):
+                if i not in dead:
+                    new_id[i] = len(records)
+                    records.append(seg.doc(i))
+            remap[e["file"]] = (dead, new_id)
+        merged = _write_segment(index_dir, name, records) if records else None
+
+        with _locked(index_dir):
+            manifest = read_manifest(index_dir)
+            current = {e["file"]: e for e in manifest["segments"]}
+            if not all(f in current for f in remap):  # a full rebuild replaced them meanwhile
+                _remove(index_dir, [name])
+                return None
+            late = set()
+            for f, (dead, new_id) in remap.items():
+                late.update(int(new_id[i]) for i in current[f]["deleted"] if i not in dead)
+            pos = next(i for i, e in enumerate(manifest["segments"]) if e["file"] in remap)
+            segs = [e for e in manifest["segments"] if e["file"] not in remap]
+            if merged:
+                merged["deleted"] = sorted(late)
+                segs.insert(pos, merged)
+            manifest["segments"] = segs
+            _publish(index_dir, manifest)
+        _remove(index_dir, remap)
+        return name if merged else None
+
+
+def maybe_merge(index_dir: Path = BM25_DIR, background: bool = True):
+    """Start a merge if the manifest calls for one and none is running."""
+    if _merge_lock.locked() or not _merge_plan(read_manifest(index_dir)):
+        return None
+    if background:
+        t = threading.Thread(target=merge_segments, args=(index_dir,), name="bm25-merge", daemon=True)
+        t.start()
+        return t
+    return merge_segments(index_dir)
+
+
+def load_index(index_dir: Path = BM25_DIR) -> Bm25Index:
+    """Bm25Index over the segments the manifest lists, with their tombstones applied."""
+    index_dir = Path(index_dir)
+    for attempt in range(3):
+        manifest = read_manifest(index_dir)
+        try:
+            segments = [_segment(index_dir / e["file"]) for e in manifest["segments"]]
+            break
+        except FileNotFoundError:
+            if attempt == 2:  # a merge removed a segment between reading the manifest and opening it
+                raise
+    live = []
+    for seg, e in zip(segments, manifest["segments"]):
+        mask = None
+        if e["deleted"]:
+            mask = np.ones(seg.n_docs, dtype=bool)
+            mask[e["deleted"]] = False
+        live.append(mask)
+    return Bm25Index(segments, live=live)
+
+
+class Bm25Searcher:
+    """Bm25Index over BM25_DIR, reloaded when the manifest is replaced (same contract as index.Searcher)."""
+
+    def __init__(self, index_dir: Path = BM25_DIR):
+        self.index_dir = Path(index_dir)
+        self.manifest_path = self.index_dir / MANIFEST
+        self._lock = threading.Lock()
+        self._stamp = None
+        self.index = None
+
+    def _ensure_loaded(self):
+        st = self.manifest_path.stat()
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp != self._stamp:
+                self.index = load_index(self.index_dir)
+                self._stamp = stamp
+
+    def search(self, query: str, top_k: int = 8, prune: bool = True):
+        self._ensure_loaded()
+        return self.index.search(query, top_k, prune)
+
+    def search_many(self, queries: List[str], top_k: int = 8):
+        self._ensure_loaded()
+        return self.index.search_many(queries, top_k)
+
+
+_searcher = None
+
+
+def get_bm25_searcher() -> Bm25Searcher:
+    global _searcher
+    if _searcher is None:
+        _searcher = Bm25Searcher()
+    return _searcher
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rebuild", action="store_true", help="Full rebuild from docs.jsonl")
+    ap.add_argument("--add", nargs="+", metavar="FILE", help="Parse raw files and append them")
+    ap.add_argument("--changed", action="store_true", help="Append the files crawled as new or changed since the last parse")
+    ap.add_argument("--delete", nargs="+", metavar="KEY", help="Delete chunks by source URL or path")
+    ap.add_argument("--merge", action="store_true", help="Merge segments now if the merge policy calls for it")
+    args = ap.parse_args()
+    if args.rebuild:
+        print("Building BM25 index...")
+        print("Index at", build_index())
+    elif args.add or args.changed:
+        from .parse import parse_files, changed_files
+        files = [Path(f) for f in args.add] if args.add else changed_files()
+        res = add_docs(parse_files(files), merge=False)
+        print(f"Added {res['added']} chunks, deleted {res['deleted']} old ones; {res['segments']} segments")
+        merged = maybe_merge(background=False)
+        if merged:
+            print("Merged into", merged)
+    elif args.delete:
+        print(f"Deleted {delete_docs(args.delete)} chunks")
+    elif args.merge:
+        print("Merged into", maybe_merge(background=False) or "nothing to merge")
+    else:
+        print("Nothing to do. Use --rebuild after parsing, or --add FILE.")
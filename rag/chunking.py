@@ -0,0 +1,201 @@
+# rag/chunking.py
+#
+# Structure-aware chunking for regulatory text. Chunks end on section markers
+# (§ 122.10, numbered headings, PART/Subchapter headings), subsection markers
+# ((a), (1), (i), (A)) or sentence ends, never mid-sentence unless a single
+# sentence is longer than `max_size`. Each chunk carries the section id in force
+# where it starts, e.g. "122.10(a)(1)".
+#
+# chunk_stream takes the document in pieces (pages) and keeps only the text of the
+# chunk being built, so a long PDF is chunked as its pages are read.
+
+import re
+from collections import deque
+from itertools import chain
+from typing import Iterable, Iterator, Optional, Tuple
+
+from .config import CHUNK_TARGET, CHUNK_MAX, CHUNK_MIN
+
+# Boundaries can only start right after a space, at one of these characters. The
+# candidate scan is a plain character-class search; the anchored match below then
+# classifies each candidate, so the document is scanned once in linear time.
+# Text is whitespace-normalized by the parser, so sentence ends are ". " exactly.
+_CANDIDATE = re.compile(r"(?:^|(?<= ))[§(0-9A-Z\"]")
+_KIND = re.compile(
+    r"(?P<sec>§+ ?(?P<secid>\d+[A-Za-z]?(?:\.\d+[A-Za-z]?)*))"
+    r"|(?P<head>(?P<headid>\d+(?:\.\d+){1,3}) (?=[A-Z]))"
+    r"|(?P<part>(?:PART|Part|SUBCHAPTER|Subchapter|Subpart|Chapter) [0-9A-Z]+ ?[:—–-])"
+    r"|(?P<sub>\((?P<subid>[a-z]{1,4}|\d{1,3}|[A-Z])\)) (?P<cap>[A-Z\"(])?"
+    r"|(?P<sent>)"
+)
+_SENTENCE_END = frozenset(".;:!?)]")
+_MARGIN = 256  # text past a candidate that classifying it may read (ids like 122.10.5 are far shorter)
+
+
+def _boundaries(text: str, start: int = 0, stop: Optional[int] = None):
+    """
+    Yield (position, match) for each unit start in text[start:stop]. Markers count
+    after a sentence end (or at the start); a subsection marker also counts
+    mid-sentence when followed by a capitalized clause ("... as follows (a) The
+    owner"), but not "paragraph (a) of".
+    """
+    for c in _CANDIDATE.finditer(text, start, len(text) if stop is None else stop):
+        pos = c.start()
+        after_end = pos < 2 or text[pos - 2] in _SENTENCE_END
+        m = _KIND.match(text, pos)
+        if m.group("sub") is not None:
+            if after_end or m.group("cap"):
+                yield pos, m
+        elif m.group("sent") is None:
+            if after_end:
+                yield pos, m
+        elif pos >= 2 and text[pos - 2] in ".;!?":
+            yield pos, m
+
+
+_ROMAN = re.compile(r"^(?:x{0,3})(?:ix|iv|v?i{0,3})$")
+
+
+def _sub_level(subid: str, path: list) -> int:
+    """CFR/TAC nesting: (a) -> 1, (1) -> 2, (i) -> 3, (A) -> 4."""
+    if subid.isdigit():
+        return 2
+    if subid.isupper():
+        return 4
+    if _ROMAN.match(subid):
+        # (i), (v), (x) continue a lettered list when they follow (h), (u), (w)
+        prev = path[0] if path else ""
+        if len(subid) == 1 and len(prev) == 1 and ord(subid) == ord(prev) + 1:
+            return 1
+        return 3
+    return 1
+
+
+class _Section:
+    def __init__(self):
+        self.sec = ""
+        self.path = []  # subsection ids, index = level - 1
+
+    def enter(self, m: re.Match):
+        if m.group("sec") is not None:
+            self.sec, self.path = m.group("secid"), []
+        elif m.group("head") is not None:
+            self.sec, self.path = m.group("headid"), []
+        elif m.group("part") is not None:
+            self.sec, self.path = m.group("part").rstrip(":—–- "), []
+        elif m.group("sub") is not None:
+            subid = m.group("subid")
+            level = _sub_level(subid, self.path)
+            self.path = self.path[:level - 1] + [""] * max(0, level - 1 - len(self.path)) + [subid]
+
+    @property
+    def id(self) -> str:
+        return self.sec + "".join(f"({p})" for p in self.path if p)
+
+
+def _split_long(text: str, start: int, end: int, max_size: int) -> Iterator[Tuple[int, int]]:
+    """Cut a single over-long span at the last space before `max_size`."""
+    while end - start > max_size:
+        cut = text.rfind(" ", start + max_size // 2, start + max_size)
+        cut = cut if cut > start else start + max_size
+        yield start, cut
+        start = cut
+    yield start, end
+
+
+class _Packer:
+    """The chunk being built: units are added in document order, finished chunks come out."""
+
+    def __init__(self, target: int, max_size: int, min_size: int):
+        self.target, self.max_size, self.min_size = target, max_size, min_size
+        self.sect = _Section()
+        self.cstart = self.cend = 0
+        self.csec = ""
+
+    def add(self, text: str, base: int, us: int, m: Optional[re.Match], ue: int):
+        """The unit at document offsets us..ue; `text` holds the document from `base` on."""
+        hard = m is not None and m.group("sent") is None and m.group("sub") is None
+        size = self.cend - self.cstart
+        if size and (size + ue - us > self.target or (hard and size >= self.min_size)):
+            yield self.cstart, self.csec, text[self.cstart - base:self.cend - base].strip()
+            self.cstart = self.cend = us
+        if m is not None:
+            self.sect.enter(m)
+        if self.cend == self.cstart:
+            self.cstart, self.csec = us, self.sect.id
+        if ue - us > self.max_size:
+            # a single unit over max_size can only arrive with an empty chunk
+            *full, (ls, _) = _split_long(text, us - base, ue - base, self.max_size)
+            for ps, pe in full:
+                yield ps + base, self.csec, text[ps:pe].strip()
+            self.cstart = ls + base
+        self.cend = ue
+
+    def finish(self, text: str, base: int):
+        chunk = text[self.cstart - base:self.cend - base].strip()
+        if self.cend > self.cstart and chunk:
+            yield self.cstart, self.csec, chunk
+
+
+def chunk_stream(pieces: Iterable[str], target: int = CHUNK_TARGET, max_size: int = CHUNK_MAX,
+                 min_size: int = CHUNK_MIN) -> Iterator[Tuple[int, str, str]]:
+    """
+    Yield (offset, section_id, chunk) over the document made of `pieces` joined as
+    they are. Units between boundaries are packed up to `target` characters; a
+    section marker starts a new chunk once the current one holds `min_size`
+    characters. No overlap between chunks. Boundaries within _MARGIN of the end of
+    the text read so far wait for the next piece, so the chunks do not depend on
+    where the pieces are cut.
+    """
+    packer = _Packer(target, max_size, min_size)
+    buf, base = "", 0  # the document from offset `base` on
+    scanned = 0        # document offset the boundary scan has reached
+    prev = None        # the last unit start found, waiting for the next one to end it
+    for piece in chain(pieces, [None]):
+        if piece is not None:
+            # drop text before the chunk being built; the scan needs two characters of lookbehind
+            cut = max(0, min(packer.cstart, scanned - 2)) - base
+            buf, base = buf[cut:] + piece, base + cut
+            stop = len(buf) - _MARGIN
+            if stop <= scanned - base:
+                continue
+        else:
+            stop = len(buf)
+        for i, m in _boundaries(buf, scanned - base, stop):
+            if prev is None and base + i > 0:
+                prev = (0, None)
+            if prev is not None:
+                yield from packer.add(buf, base, *prev, base + i)
+            prev = (base + i, m)
+        scanned = base + stop
+    yield from packer.add(buf, base, *(prev or (0, None)), base + len(buf))
+    yield from packer.finish(buf, base)
+
+
+def chunk_text(text: str, target: int = CHUNK_TARGET, max_size: int = CHUNK_MAX,
+               min_size: int = CHUNK_MIN) -> Iterator[Tuple[int, str, str]]:
+    """chunk_stream over one string."""
+    return chunk_stream([text], target, max_size, min_size)
+
+
+def chunk_pages(pages: Iterable[Tuple[Optional[int], str]], **kw) -> Iterator[Tuple[int, Optional[int], str, str]]:
+    """
+    chunk_stream over page-tagged text joined by spaces (offsets are the same as
+    parse._chunk_pages), consumed page by page. Yields (offset, page, section_id, chunk).
+    """
+    marks = deque()  # (offset, page) of page starts not yet behind the last chunk
+
+    def pieces():
+        pos = 0
+        for page, text in pages:
+            if not text:
+                continue
+            sep = " " if pos else ""
+            marks.append((pos + len(sep), page))
+            yield sep + text
+            pos += len(sep) + len(text)
+
+    for offset, section, chunk in chunk_stream(pieces(), **kw):
+        while len(marks) > 1 and marks[1][0] <= offset:
+            marks.popleft()
+        yield offset, marks[0][1] if marks else None, section, chunk
@@ -0,0 +1,204 @@
+# rag/context.py
+#
+# Context packing between retrieval and the LLM. The retrieved chunks are split
+# into sentence / clause units (the boundaries rag.chunking cuts on), each unit is
+# scored against the question (TF-IDF with the index's vectorizer, or the vector
+# encoder), repeated units from overlapping chunks are dropped, and the best units
+# fill a token budget. Kept units are printed in document order under a numbered
+# header per chunk, and only the chunks that contributed are cited.
+#
+#   python -m rag.context "When is the annual compliance certification due?" --budget 600
+
+import argparse
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .chunking import _boundaries
+from .config import CONTEXT_BUDGET, CONTEXT_SCORER, CONTEXT_OVERLAP, INDEX_PATH
+
+_MIN_UNIT = 30  # characters; shorter units (bare markers, headings) are joined to the next one
+_WORD = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+_ENC = None  # tiktoken encoding, loaded on the first count; False when tiktoken is not installed
+
+
+def _encoding():
+    global _ENC
+    if _ENC is None:
+        try:
+            import tiktoken  # type: ignore
+            _ENC = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _ENC = False
+    return _ENC
+
+
+def count_tokens(text: str) -> int:
+    """Prompt tokens: tiktoken's cl100k when installed, else ~4 characters per token."""
+    enc = _encoding()
+    if enc:
+        return len(enc.encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text: str, n: int) -> str:
+    """The longest prefix of `text` within `n` tokens, cut back to a word boundary."""
+    if n <= 0:
+        return ""
+    if count_tokens(text) <= n:
+        return text
+    enc = _encoding()
+    head = enc.decode(enc.encode(text)[:n]) if enc else text[:4 * n]
+    while head and count_tokens(head) > n:  # decoding can merge tokens differently at the cut
+        head = head[:-1]
+    cut = head.rfind(" ")
+    return head[:cut] if cut > 0 else head
+
+
+def split_units(text: str) -> List[str]:
+    """Sentence / clause units of a chunk, in order."""
+    cuts = sorted({0, *(pos for pos, _ in _boundaries(text))})
+    units, start = [], 0
+    for end in cuts[1:] + [len(text)]:
+        if end - start >= _MIN_UNIT or end == len(text):
+            unit = text[start:end].strip()
+            if unit:
+                units.append(unit)
+            start = end
+    return units
+
+
+def _scores_tfidf(question: str, units: List[str]) -> np.ndarray:
+    vec = None
+    if INDEX_PATH.exists():
+        try:
+            from .index import get_searcher
+            vec = get_searcher()._ensure_loaded().vectorizer
+        except Exception:
+            vec = None
+    if vec is None:
+        # no TF-IDF index built (BM25-only setups): fit on the candidates themselves
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vec = TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True).fit(units + [question])
+    U, q = vec.transform(units), vec.transform([question])
+    return (U @ q.T).toarray().ravel()
+
+
+def _scores_vector(question: str, units: List[str]) -> Optional[np.ndarray]:
+    from .vector_query import get_vector_searcher
+    s = get_vector_searcher()
+    ix = s._load()
+    if not ix.built:
+        return None
+    U = ix.encoder.encode(units, batch_size=64, show_progress_bar=False, normalize_embeddings=True)
+    return np.asarray(U, dtype=np.float32) @ s.embed(question, ix)
+
+
+def score_units(question: str, units: List[str], scorer: str = CONTEXT_SCORER) -> np.ndarray:
+    """Similarity of each unit to the question; "vector" falls back to TF-IDF when no vector index is built."""
+    if not units:
+        return np.zeros(0, dtype=np.float32)
+    if scorer == "vector":
+        try:
+            sims = _scores_vector(question, units)
+            if sims is not None:
+                return sims
+        except Exception:
+            pass
+    return _scores_tfidf(question, units)
+
+
+def _words(text: str) -> frozenset:
+    return frozenset(_WORD.findall(text.lower()))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+@dataclass
+class Packed:
+    text: str                   # packed context for the prompt
+    citations: List[dict]       # chunks that contributed, numbered as in the text ([1], [2], ...)
+    tokens: int                 # count_tokens(text)
+    source_tokens: int          # tokens of the retrieved chunks, stitched as before
+    units: int = 0              # sentence / clause units kept
+    dropped: Dict[str, int] = field(default_factory=dict)  # units left out: {"overlap": n, "budget": n}
+
+
+def _header(i: int, cite: dict) -> str:
+    loc = cite.get("section") or (f"p. {cite['page']}" if cite.get("page") else "")
+    return f"[{i}] {cite.get('title', '')}" + (f" ({loc})" if loc else "")
+
+
+def pack(question: str, records: List[dict], citations: List[dict], budget: int = CONTEXT_BUDGET,
+         scorer: str = CONTEXT_SCORER, overlap: float = CONTEXT_OVERLAP) -> Packed:
+    """
+    Fill `budget` tokens with the units of `records` (retrieval order, citations
+    aligned) that best match `question`. Ties go to the better-ranked chunk.
+    If no unit fits whole, the best one is truncated to the budget, so the
+    context is never empty while there is something to cite.
+    """
+    source = "\n\n".join(r.get("text", "") for r in records)
+    units: List[Tuple[int, int, str]] = [(c, j, u) for c, r in enumerate(records)
+                                         for j, u in enumerate(split_units(r.get("text", "")))]
+    sims = score_units(question, [u for _, _, u in units], scorer)
+    order = sorted(range(len(units)), key=lambda i: (-sims[i], units[i][0], units[i][1]))
+
+    kept: Dict[int, List[Tuple[int, str]]] = {}
+    kept_words: List[frozenset] = []
+    seen = set()
+    dropped = {"overlap": 0, "budget": 0}
+    used = 0
+    for i in order:
+        c, j, u = units[i]
+        norm = " ".join(u.lower().split())
+        w = _words(u)
+        if norm in seen or any(_jaccard(w, o) >= overlap for o in kept_words):
+            dropped["overlap"] += 1  # the same clause from an overlapping chunk or duplicate page
+            continue
+        cost = count_tokens(u) + 1 + (0 if c in kept else count_tokens(_header(len(kept) + 1, citations[c])) + 2)
+        if used + cost > budget:
+            dropped["budget"] += 1
+            continue  # a shorter unit further down may still fit
+        used += cost
+        seen.add(norm)
+        kept_words.append(w)
+        kept.setdefault(c, []).append((j, u))
+    if not kept and order:
+        c, j, u = units[order[0]]
+        room = budget - count_tokens(_header(1, citations[c])) - 3  # header, newlines, " ..."
+        u = truncate_tokens(u, room)
+        if u:
+            kept[c] = [(j, u + " ...")]
+            dropped["budget"] -= 1  # it was counted as dropped above
+
+    blocks, cites = [], []
+    for n, c in enumerate(sorted(kept), start=1):
+        # document order inside a chunk; " ... " marks skipped units
+        parts = sorted(kept[c])
+        body = parts[0][1]
+        for (pj, _), (j, u) in zip(parts, parts[1:]):
+            body += (" " if j == pj + 1 else " ... ") + u
+        blocks.append(f"{_header(n, citations[c])}\n{body}")
+        cites.append(citations[c])
+    text = "\n\n".join(blocks)
+    return Packed(text, cites, count_tokens(text), count_tokens(source),
+                  sum(len(v) for v in kept.values()), dropped)
+
+
+if __name__ == "__main__":
+    from .hybrid import search
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("query")
+    ap.add_argument("-k", type=int, default=6)
+    ap.add_argument("--budget", type=int, default=CONTEXT_BUDGET or 1200)
+    ap.add_argument("--scorer", choices=["tfidf", "vector"], default=CONTEXT_SCORER)
+    args = ap.parse_args()
+    hits = search(args.query, args.k)
+    p = pack(args.query, [h.record for h in hits], [h.citation() for h in hits], args.budget, args.scorer)
+    print(p.text)
+    print(f"\n{p.tokens} tokens (from {p.source_tokens}), {p.units} units, dropped {p.dropped}")
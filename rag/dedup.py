@@ -0,0 +1,159 @@
+# rag/dedup.py
+#
+# Near-duplicate chunk elimination between parse and index building. Each chunk
+# gets a MinHash signature over word shingles; LSH banding puts likely duplicates
+# in the same bucket so only bucket members are compared (no all-pairs pass).
+# The first chunk of each duplicate group is kept and lists the others' sources
+# under "alt_sources". The result goes to docs.dedup.jsonl, which the indexers
+# read; docs.jsonl stays the parser's complete output, so an incremental parse
+# still has every chunk to copy over.
+#
+#   python -m rag.dedup --threshold 0.85
+
+import argparse
+import json
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import DOCS_JSONL, DEDUP_JSONL, DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_SHINGLE
+
+_PRIME = np.uint64(4294967311)  # > 2**32, so hashes stay distinct modulo p
+_WORD = re.compile(r"\w+")
+
+
+def _perms(num_perm: int, seed: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 2**31 - 1, size=num_perm).astype(np.uint64)
+    b = rng.randint(0, 2**31 - 1, size=num_perm).astype(np.uint64)
+    return a, b
+
+
+def _shingles(text: str, k: int) -> np.ndarray:
+    words = _WORD.findall(text.lower())
+    if len(words) < k:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.fromiter((zlib.crc32(g.encode()) for g in set(grams)), dtype=np.uint64)
+
+
+def minhash(text: str, a: np.ndarray, b: np.ndarray, k: int = DEDUP_SHINGLE) -> np.ndarray:
+    x = _shingles(text, k)
+    return ((np.outer(x, a) + b) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def _bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) whose LSH threshold (1/b)^(1/r) is closest to, but not above, `threshold`."""
+    best, best_t = (num_perm, 1), 1 / num_perm
+    for r in range(1, num_perm + 1):
+        b = num_perm // r
+        t = (1 / b) ** (1 / r)
+        if best_t < t <= threshold:
+            best, best_t = (b, r), t
+    return best
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = np.arange(n)
+
+    def find(self, i: int) -> int:
+        p = self.parent
+        while p[i] != i:
+            p[i] = p[p[i]]
+            i = p[i]
+        return i
+
+    def union(self, i: int, j: int):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            # the lower row id stays the root, i.e. the first occurrence is canonical
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+def find_duplicates(texts: List[str], threshold: float = DEDUP_THRESHOLD,
+                    num_perm: int = DEDUP_NUM_PERM) -> np.ndarray:
+    """Canonical row id for every text (itself when it has no earlier near-duplicate)."""
+    a, b = _perms(num_perm)
+    sigs = np.vstack([minhash(t, a, b) for t in texts]) if texts else np.zeros((0, num_perm), np.uint32)
+    bands, rows = _bands(num_perm, threshold)
+    uf = _UnionFind(len(texts))
+    for band in range(bands):
+        buckets: Dict[bytes, int] = {}
+        block = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        for i in range(len(texts)):
+            key = block[i].tobytes()
+            first = buckets.setdefault(key, i)
+            # compare with the bucket's first member only: linear in bucket size
+            if first != i and uf.find(first) != uf.find(i):
+                if np.mean(sigs[first] == sigs[i]) >= threshold:
+                    uf.union(first, i)
+    return np.array([uf.find(i) for i in range(len(texts))], dtype=np.int64)
+
+
+def _alt(rec: dict) -> dict:
+    return {"source": rec.get("source", ""), "path": rec.get("path", ""), "offset": rec.get("offset", 0)}
+
+
+def dedup_docs(path: Path = DOCS_JSONL, threshold: float = DEDUP_THRESHOLD,
+               num_perm: int = DEDUP_NUM_PERM, out_path: Optional[Path] = None) -> Dict[str, float]:
+    """
+    Write `path` with one canonical chunk per near-duplicate group to `out_path`
+    (DEDUP_JSONL for docs.jsonl, <name>.dedup.jsonl next to any other file);
+    `path` itself is left alone. Returns shrink stats.
+    """
+    if out_path is None:
+        out_path = DEDUP_JSONL if path == DOCS_JSONL else path.with_suffix(".dedup.jsonl")
+    texts, alts = [], []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            texts.append(rec["text"])
+            alts.append(_alt(rec))
+    canon = find_duplicates(texts, threshold, num_perm)
+    bytes_in = sum(len(t.encode()) for t in texts)
+    del texts
+
+    extra: Dict[int, List[dict]] = {}
+    for i, c in enumerate(canon):
+        if c != i:
+            extra.setdefault(int(c), []).append(alts[i])
+
+    kept = bytes_out = 0
+    tmp = out_path.with_suffix(".tmp")
+    with path.open("r", encoding="utf-8") as f, tmp.open("w", encoding="utf-8") as out:
+        for i, line in enumerate(f):
+            if canon[i] != i:
+                continue
+            rec = json.loads(line)
+            if i in extra:
+                have = rec.get("alt_sources", [])
+                rec["alt_sources"] = have + [a for a in extra[i] if a not in have]
+            out.write(json.dumps(rec) + "\n")
+            kept += 1
+            bytes_out += len(rec["text"].encode())
+    os.replace(tmp, out_path)
+    n = len(canon)
+    return {
+        "chunks_in": n,
+        "chunks_out": kept,
+        "removed": n - kept,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "shrink": round(1 - bytes_out / bytes_in, 3) if bytes_in else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD, help="Estimated Jaccard similarity")
+    ap.add_argument("--num-perm", type=int, default=DEDUP_NUM_PERM)
+    args = ap.parse_args()
+    s = dedup_docs(threshold=args.threshold, num_perm=args.num_perm)
+    print(f"Kept {s['chunks_out']}/{s['chunks_in']} chunks, removed {s['removed']}; "
+          f"{s['bytes_in']} -> {s['bytes_out']} bytes ({s['shrink']:.1%} smaller)")
@@ -0,0 +1,115 @@
+# rag/embcache.py
+#
+# Persistent embedding store keyed by (model name, hash of the chunk text), so a
+# vector index rebuild only encodes chunks it has not seen before. One directory
+# per model under EMBED_CACHE_DIR:
+#
+#   keys.bin     16-byte blake2b digests of the chunk texts, one per row
+#   vectors.f32  float32 rows (n x dim), memory-mapped on read
+#   meta.json    {"model", "dim", "gen", "s_per_chunk"}  (last measured encode cost, for reports)
+#
+# Both files are append-only; keys.bin is written after vectors.f32, so its length
+# decides how many rows are valid after an interrupted append. compact() writes a
+# new pair, keys.<gen>.bin and vectors.<gen>.f32, and switches to it by replacing
+# meta.json: an interrupted compaction leaves the previous pair in use.
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from .config import EMBED_CACHE_DIR
+
+_KEY = 16
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=_KEY).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, root: Path = EMBED_CACHE_DIR):
+        self.model_name = model_name
+        self.dir = Path(root) / re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+        self.meta_path = self.dir / "meta.json"
+        self.dim = None
+        self.s_per_chunk = None
+        self.rows: Dict[bytes, int] = {}
+        self._set_gen(0)
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            if meta.get("model") == model_name:
+                self.dim = int(meta["dim"])
+                self.s_per_chunk = meta.get("s_per_chunk")
+                self._set_gen(int(meta.get("gen", 0)))
+                keys = self.keys_path.read_bytes() if self.keys_path.exists() else b""
+                n = min(len(keys) // _KEY, self._vec_rows())
+                self.rows = {keys[i * _KEY:(i + 1) * _KEY]: i for i in range(n)}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _set_gen(self, gen: int):
+        self.gen = gen
+        suffix = f".{gen}" if gen else ""
+        self.keys_path, self.vec_path = self.dir / f"keys{suffix}.bin", self.dir / f"vectors{suffix}.f32"
+
+    def _vec_rows(self) -> int:
+        return self.vec_path.stat().st_size // (4 * self.dim) if self.vec_path.exists() else 0
+
+    def save_meta(self):
+        meta = {"model": self.model_name, "dim": self.dim, "gen": self.gen, "s_per_chunk": self.s_per_chunk}
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+
+    def lookup(self, hashes: List[bytes]) -> np.ndarray:
+        """Cache row of every hash, -1 where missing."""
+        return np.array([self.rows.get(h, -1) for h in hashes], dtype=np.int64)
+
+    def add(self, hashes: List[bytes], vecs: np.ndarray):
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vecs.shape[1]
+            self.dir.mkdir(parents=True, exist_ok=True)
+            for p in (self.keys_path, self.vec_path):
+                p.unlink(missing_ok=True)  # left over from another model / dim
+            self.save_meta()
+        n = len(self.rows)
+        with self.vec_path.open("r+b" if self.vec_path.exists() else "wb") as f:
+            f.seek(n * 4 * self.dim)  # drop rows an interrupted append left without keys
+            f.write(vecs.tobytes())
+            f.truncate()
+        with self.keys_path.open("r+b" if self.keys_path.exists() else "wb") as f:
+            f.seek(n * _KEY)
+            f.write(b"".join(hashes))
+            f.truncate()
+        for i, h in enumerate(hashes):
+            self.rows[h] = n + i
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Rows gathered from the memory-mapped store (a copy, in `rows` order)."""
+        if not len(rows):
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        X = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+        return np.asarray(X[rows])
+
+    def compact(self, keep: Iterable[bytes]):
+        """Rewrite the store with only the rows for `keep` (drops embeddings of deleted chunks)."""
+        keep = [h for h in dict.fromkeys(keep) if h in self.rows]
+        if len(keep) == len(self.rows):
+            return
+        vecs = self.vectors(self.lookup(keep))
+        self._set_gen(self.gen + 1)
+        self.vec_path.write_bytes(vecs.tobytes())
+        self.keys_path.write_bytes(b"".join(keep))
+        self.save_meta()  # the switch to the new pair
+        self.rows = {h: i for i, h in enumerate(keep)}
+        for p in self.dir.glob("*"):
+            # the previous pair, and any left by an interrupted compaction
+            if p.suffix in (".bin", ".f32") and p not in (self.keys_path, self.vec_path):
+                p.unlink(missing_ok=True)
@@ -0,0 +1,75 @@
+# rag/encoders.py
+#
+# Text encoders for the vector index. Model names are sentence-transformers ids
+# ("BAAI/bge-base-en"), loaded once per process by get_encoder(). The name
+# "hash" (or "hash-<dim>") selects HashingEncoder, a dependency-free stand-in
+# with the same encode() signature, for offline benchmarks and CI:
+#
+#   EMBEDDINGS_MODEL=hash python -m rag.index_vector
+
+import re
+import threading
+import zlib
+from typing import Dict, List
+
+import numpy as np
+
+_WORD = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+
+
+class HashingEncoder:
+    """
+    Signed feature hashing of word unigrams and bigrams, log-scaled and L2
+    normalized. Deterministic across processes (crc32, not the salted hash()).
+    Not semantic; retrieval quality is roughly that of a keyword index.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _features(self, text: str) -> List[int]:
+        words = _WORD.findall(text.lower())
+        grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return [zlib.crc32(g.encode()) for g in grams]
+
+    def encode(self, texts, batch_size: int = 64, normalize_embeddings: bool = True,
+               show_progress_bar: bool = False, **kw) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        X = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            h = np.array(self._features(text), dtype=np.uint64)
+            if not len(h):
+                continue
+            sign = np.where((h >> np.uint64(31)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+            np.add.at(X[i], (h % np.uint64(self.dim)).astype(np.int64), sign)
+        X = np.sign(X) * np.log1p(np.abs(X))
+        if normalize_embeddings:
+            X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+        return X
+
+
+def load_encoder(name: str):
+    """A new encoder for `name` (no caching; use get_encoder)."""
+    if name == "hash" or name.startswith("hash-"):
+        return HashingEncoder(int(name.split("-", 1)[1]) if "-" in name else 384)
+    from sentence_transformers import SentenceTransformer  # heavy; only when a real model is used
+    return SentenceTransformer(name)
+
+
+_encoders: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def get_encoder(name: str):
+    """Process-wide encoder for `name`, loaded on first use."""
+    enc = _encoders.get(name)
+    if enc is None:
+        with _lock:
+            enc = _encoders.get(name)
+            if enc is None:
+                enc = _encoders[name] = load_encoder(name)
+    return enc
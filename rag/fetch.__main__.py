@@ -1,11 +1,15 @@
 from .fetch import crawl
-from .config import SEED_SOURCES
+from .config import SEED_SOURCES, CRAWL_WORKERS, CRAWL_PER_DOMAIN, CRAWL_DELAY
 import argparse
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--source-list", default=None)
     ap.add_argument("--max-per-site", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=CRAWL_WORKERS)
+    ap.add_argument("--per-domain", type=int, default=CRAWL_PER_DOMAIN)
+    ap.add_argument("--delay", type=float, default=CRAWL_DELAY)
+    ap.add_argument("--full", action="store_true")
     args = ap.parse_args()
     seeds = []
     if args.source_list:
@@ -13,5 +17,6 @@ if __name__ == "__main__":
     else:
         for v in SEED_SOURCES.values():
             seeds.extend(v)
-    crawl(seeds, max_per_site=args.max_per_site)
-    print("Fetch complete.")
+    changed = crawl(seeds, max_per_site=args.max_per_site, delay=args.delay, workers=args.workers,
+                    per_domain=args.per_domain, incremental=not args.full)
+    print(f"Fetch complete. {len(changed)} new or changed files.")
@@ -1,108 +1,315 @@
-import os, time, hashlib, re, sys, argparse
-from urllib.parse import urljoin, urlparse
+import os, time, hashlib, re, sys, argparse, json, tempfile, threading, contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from urllib.parse import urlparse
 import requests
-from bs4 import BeautifulSoup
-from readability import Document as ReadabilityDoc
-from pdfminer.high_level import extract_text
 from pathlib import Path
-from .config import RAW_DIR, USER_AGENT, TIMEOUT, MAX_BYTES, ALLOWED_MIME, SEED_SOURCES
+from .readable import readable, load_or_build, resolve_links
+from . import trace
+from .config import (RAW_DIR, USER_AGENT, TIMEOUT, MAX_BYTES, ALLOWED_MIME, ALLOWED_DOMAINS, SEED_SOURCES,
+                     MANIFEST_NAME, CHANGED_NAME, CRAWL_WORKERS, CRAWL_PER_DOMAIN, CRAWL_DELAY)
 
 HEADERS = {"User-Agent": USER_AGENT}
+STREAM_CHUNK = 64 * 1024
 
-def _safe_filename(url: str) -> str:
-    h = hashlib.sha256(url.encode()).hexdigest()[:16]
-    parsed = urlparse(url)
-    name = (parsed.netloc + parsed.path).strip("/").replace("/", "_")
-    if not name:
-        name = "index"
-    return f"{name[:80]}_{h}"
+def load_manifest(outdir: Path = RAW_DIR) -> dict:
+    """Per-URL fetch state: {url: {file (blob name), etag, last_modified, sha256, fetched_at, status}}."""
+    p = outdir / MANIFEST_NAME
+    if not p.exists():
+        return {}
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except Exception as e:
+        trace.error("fetch.manifest", e)
+        return {}
+
+def save_manifest(manifest: dict, outdir: Path = RAW_DIR):
+    with _lock:
+        data = json.dumps(manifest, indent=1, sort_keys=True)
+    tmp = outdir / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(data, encoding="utf-8")
+    os.replace(tmp, outdir / MANIFEST_NAME)
+
+_lock = threading.Lock()
+
+def _record(manifest: dict | None, url: str, **entry):
+    if "status" in entry:
+        trace.incr("rag_pages_fetched_total", status=entry["status"])
+    if manifest is None:
+        return
+    entry["fetched_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    with _lock:
+        manifest[url] = {**manifest.get(url, {}), **entry}
 
-def fetch_url(url: str, session: requests.Session, outdir: Path) -> Path | None:
+def _sidecar_urls(blob: Path) -> list[str]:
+    side = blob.with_suffix(".url")
+    if not side.exists():
+        return []
+    return [u for u in side.read_text().splitlines() if u.strip()]
+
+def _link(blob: Path, url: str):
+    """Add `url` to the blob's .url sidecar (one URL per line, first one is canonical)."""
+    urls = _sidecar_urls(blob)
+    if url not in urls:
+        blob.with_suffix(".url").write_text("\n".join(urls + [url]) + "\n")
+
+def _unlink(blob: Path, url: str):
+    """Drop `url` from the blob's sidecar; delete the blob once no URL points at it."""
+    urls = [u for u in _sidecar_urls(blob) if u != url]
+    if urls:
+        blob.with_suffix(".url").write_text("\n".join(urls) + "\n")
+        return
+    for p in blob.parent.glob(blob.stem + ".*"):
+        p.unlink(missing_ok=True)
+
+def _stream_to(r: requests.Response, outdir: Path) -> tuple[Path, str]:
+    """
+    Stream the body into a temp file in `outdir`, hashing as it goes. Raises
+    ValueError past MAX_BYTES, or the download error; the temp file is removed.
+    """
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=outdir, suffix=".part")
     try:
-        r = session.get(url, headers=HEADERS, timeout=TIMEOUT, stream=True, allow_redirects=True)
-        r.raise_for_status()
-        ctype = r.headers.get("Content-Type","").split(";")[0].strip().lower()
-        if not any(ctype.startswith(a) for a in ALLOWED_MIME):
-            # Try to guess by extension
-            if url.lower().endswith(".pdf"):
-                ctype = "application/pdf"
-            elif url.lower().endswith(".html") or url.lower().endswith("/"):
-                ctype = "text/html"
-            else:
+        with os.fdopen(fd, "wb") as f:
+            for block in r.iter_content(STREAM_CHUNK):
+                size += len(block)
+                if size > MAX_BYTES:
+                    raise ValueError("body exceeds MAX_BYTES")
+                h.update(block)
+                f.write(block)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    trace.incr("rag_bytes_fetched_total", size)
+    return Path(tmp), h.hexdigest()
+
+@trace.traced("fetch.url")
+def fetch_url(url: str, session: requests.Session, outdir: Path, manifest: dict | None = None,
+              conditional: bool = True) -> Path | None:
+    """
+    Download `url` into `outdir` as a content-addressed blob `<sha256>.<ext>`; the
+    same document linked from several URLs is stored once and its `.url` sidecar
+    lists every URL. The body is streamed to disk and the download is aborted as
+    soon as it passes MAX_BYTES.
+
+    With a `manifest` (URL -> blob), send If-None-Match / If-Modified-Since from the
+    previous fetch (unless not `conditional`, which forces a full download). Status
+    is "unchanged" for a 304 or identical body, "duplicate" when the body is already
+    stored for another URL, otherwise "new"/"changed".
+    """
+    prev = (manifest or {}).get(url, {})
+    prev_path = outdir / prev["file"] if prev.get("file") else None
+    headers = dict(HEADERS)
+    if conditional and prev_path and prev_path.exists():
+        if prev.get("etag"):
+            headers["If-None-Match"] = prev["etag"]
+        if prev.get("last_modified"):
+            headers["If-Modified-Since"] = prev["last_modified"]
+    try:
+        with session.get(url, headers=headers, timeout=TIMEOUT, stream=True, allow_redirects=True) as r:
+            if r.status_code == 304 and prev_path and prev_path.exists():
+                _record(manifest, url, status="unchanged", http_status=304)
+                return prev_path
+            r.raise_for_status()
+            ctype = r.headers.get("Content-Type","").split(";")[0].strip().lower()
+            if not any(ctype.startswith(a) for a in ALLOWED_MIME):
+                # Try to guess by extension
+                if url.lower().endswith(".pdf"):
+                    ctype = "application/pdf"
+                elif url.lower().endswith(".html") or url.lower().endswith("/"):
+                    ctype = "text/html"
+                else:
+                    return None
+            # size limit, before and while downloading
+            if int(r.headers.get("Content-Length") or 0) > MAX_BYTES:
+                _record(manifest, url, status="error", error="Content-Length exceeds MAX_BYTES")
                 return None
-        # size limit
-        content = r.content
-        if len(content) > MAX_BYTES:
-            return None
-        fname = _safe_filename(url)
+            tmp, digest = _stream_to(r, outdir)
         ext = ".pdf" if ctype == "application/pdf" or url.lower().endswith(".pdf") else ".html"
-        path = outdir / f"{fname}{ext}"
-        path.write_bytes(content)
-        (outdir / f"{fname}.url").write_text(url)
+        path = outdir / f"{digest}{ext}"
+        with _lock:
+            if path.exists():
+                tmp.unlink()
+                status = "unchanged" if prev.get("sha256") == digest else "duplicate"
+            else:
+                os.replace(tmp, path)
+                status = "changed" if prev else "new"
+            _link(path, url)
+            if prev_path and prev_path != path:
+                _unlink(prev_path, url)
+        _record(manifest, url, file=path.name, sha256=digest, status=status, http_status=r.status_code,
+                etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))
         return path
     except Exception as e:
+        trace.error("fetch.url", e)
+        _record(manifest, url, status="error", error=f"{type(e).__name__}: {e}"[:200])
         return None
 
 def extract_links(html: str, base: str) -> list[str]:
-    soup = BeautifulSoup(html, "lxml")
-    links = []
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if href.startswith("#"):
-            continue
-        href = urljoin(base, href)
-        links.append(href)
-    return links
-
-def crawl(seed: list[str], max_per_site: int = 50, delay=0.5):
-    RAW_DIR.mkdir(parents=True, exist_ok=True)
+    return resolve_links(readable(html), base)
+
+def _discover(path: Path, url: str) -> list[str]:
+    # main content, title and links in one pass, saved next to the blob for parse
+    with trace.span("fetch.readable"):
+        return resolve_links(load_or_build(path), url)
+
+def crawl_serial(seed: list[str], max_per_site: int = 50, delay=CRAWL_DELAY, outdir: Path = RAW_DIR, allow=ALLOWED_DOMAINS):
+    """One fetch at a time with a fixed sleep; kept as the baseline for rag.bench."""
+    outdir.mkdir(parents=True, exist_ok=True)
     seen = set()
-    q = list(seed)
+    q = deque(seed)
     per_site = {}
     with requests.Session() as s:
-        for url in q:
-            domain = urlparse(url).netloc
-            per_site.setdefault(domain, 0)
-        i = 0
         while q:
-            url = q.pop(0)
+            url = q.popleft()
             dom = urlparse(url).netloc
             if per_site.get(dom,0) >= max_per_site:
                 continue
             if url in seen:
                 continue
             seen.add(url)
-            p = fetch_url(url, s, RAW_DIR)
+            p = fetch_url(url, s, outdir)
             if not p:
                 continue
             per_site[dom] = per_site.get(dom,0) + 1
             if p.suffix == ".html":
-                html = p.read_text(errors="ignore")
-                # read main content only for link discovery too
-                try:
-                    doc = ReadabilityDoc(html)
-                    main_html = doc.summary(html_partial=True)
-                except Exception:
-                    main_html = html
-                links = extract_links(main_html, (p.with_suffix(".url")).read_text())
                 # keep only same-domain or known regulatory domains
-                allow = (".tceq.texas.gov", ".epa.gov", "ecfr.gov", "law.cornell.edu", "govinfo.gov", "cdx.epa.gov", "texas-sos.appianportalsgov.com")
-                for lk in links:
+                for lk in _discover(p, url):
                     if any(d in lk for d in allow):
                         q.append(lk)
             time.sleep(delay)
 
+_local = threading.local()
+
+def _session() -> requests.Session:
+    # requests.Session is not safe to share between threads; keep one per worker
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = _local.session = requests.Session()
+    return s
+
+def _fetch_and_discover(url: str, outdir: Path, manifest: dict | None,
+                        conditional: bool = True) -> tuple[Path | None, list[str]]:
+    p = fetch_url(url, _session(), outdir, manifest, conditional)
+    if p and p.suffix == ".html":
+        return p, _discover(p, url)
+    return p, []
+
+@trace.traced("fetch.crawl")
+def crawl(seed: list[str], max_per_site: int = 50, delay=CRAWL_DELAY, workers: int = CRAWL_WORKERS,
+          per_domain: int = CRAWL_PER_DOMAIN, outdir: Path = RAW_DIR, allow=ALLOWED_DOMAINS,
+          incremental: bool = True) -> list[Path]:
+    """
+    Crawl from `seed` with a bounded pool of fetch threads.
+
+    Each host has its own deque frontier, at most `per_domain` requests in flight and
+    at least `delay` seconds between request starts, so different hosts are fetched
+    concurrently while each one sees the same politeness as the serial crawler.
+
+    With `incremental`, requests are conditional on the manifest from the previous
+    run; without it every URL is downloaded again. Either way the manifest keeps the
+    entries of URLs this crawl did not reach. Returns the raw files that are new or changed; they are also added to
+    `outdir/changed.txt`, where they stay until `python -m rag.parse` parses them,
+    so several crawls between two parses lose nothing.
+    """
+    outdir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(outdir)
+    changed: list[Path] = []
+    frontier: dict[str, deque] = {}
+    seen = set()
+    per_site = {}   # successful fetches per host
+    inflight = {}   # requests in flight per host
+    next_ok = {}    # earliest monotonic time for the next request per host
+
+    def enqueue(url: str):
+        if url in seen:
+            return
+        seen.add(url)
+        dom = urlparse(url).netloc
+        if dom not in frontier:
+            frontier[dom] = deque()
+            per_site[dom] = inflight[dom] = 0
+            next_ok[dom] = 0.0
+        frontier[dom].append(url)
+
+    for url in seed:
+        enqueue(url)
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            now = time.monotonic()
+            wake = None
+            for dom, dq in frontier.items():
+                if per_site[dom] >= max_per_site:
+                    dq.clear()
+                    continue
+                if not dq or inflight[dom] >= per_domain or per_site[dom] + inflight[dom] >= max_per_site:
+                    continue
+                if len(pending) >= workers:
+                    break
+                if next_ok[dom] > now:
+                    wake = next_ok[dom] if wake is None else min(wake, next_ok[dom])
+                    continue
+                url = dq.popleft()
+                next_ok[dom] = now + delay
+                inflight[dom] += 1
+                # copy_context: the fetch spans join this crawl's trace
+                pending[pool.submit(contextvars.copy_context().run, _fetch_and_discover, url, outdir,
+                                    manifest, incremental)] = (dom, url)
+
+            if not pending:
+                if wake is None:
+                    break
+                time.sleep(max(0.0, wake - time.monotonic()))
+                continue
+
+            timeout = None if wake is None else max(0.0, wake - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                dom, url = pending.pop(fut)
+                inflight[dom] -= 1
+                try:
+                    p, links = fut.result()
+                except Exception as e:
+                    trace.error("fetch.crawl", e)
+                    continue
+                if not p:
+                    continue
+                per_site[dom] += 1
+                if manifest.get(url, {}).get("status") in ("new", "changed"):
+                    changed.append(p)
+                # keep only same-domain or known regulatory domains
+                for lk in links:
+                    if any(d in lk for d in allow):
+                        enqueue(lk)
+
+    save_manifest(manifest, outdir)
+    pending = outdir / CHANGED_NAME
+    listed = pending.read_text(encoding="utf-8").splitlines() if pending.exists() else []
+    listed = dict.fromkeys([line for line in listed if line.strip()] + [str(p) for p in changed])
+    tmp = pending.with_suffix(".tmp")
+    tmp.write_text("".join(f"{line}\n" for line in listed), encoding="utf-8")
+    os.replace(tmp, pending)
+    return changed
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--source-list", default=None, help="Limit to a top-level key in seed_sources.json (e.g., tceq, ecfr, epa)")
     ap.add_argument("--max-per-site", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=CRAWL_WORKERS)
+    ap.add_argument("--per-domain", type=int, default=CRAWL_PER_DOMAIN, help="Concurrent requests per host")
+    ap.add_argument("--delay", type=float, default=CRAWL_DELAY, help="Seconds between requests to the same host")
+    ap.add_argument("--full", action="store_true", help="Skip conditional requests and download everything again (the manifest is kept)")
     args = ap.parse_args()
-    from .config import SEED_SOURCES
     seeds = []
     if args.source_list:
         seeds = SEED_SOURCES.get(args.source_list, [])
     else:
         for v in SEED_SOURCES.values():
             seeds.extend(v)
-    crawl(seeds, max_per_site=args.max_per_site)
-    print("Fetch complete.")
+    changed = crawl(seeds, max_per_site=args.max_per_site, delay=args.delay, workers=args.workers,
+                    per_domain=args.per_domain, incremental=not args.full)
+    print(f"Fetch complete. {len(changed)} new or changed files.")
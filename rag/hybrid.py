@@ -0,0 +1,182 @@
+# rag/hybrid.py
+#
+# Hybrid retrieval: the keyword (BM25 / TF-IDF) and vector backends run at the same
+# time in a shared thread pool and their rankings are fused, either by reciprocal
+# rank fusion or by a weighted sum of min-max normalized scores. A chunk found by
+# both backends appears once. Every mode returns the same Hit type and citation
+# shape, so callers do not care which backend answered.
+#
+#   python -m rag.hybrid "CAM applicability for boilers" --mode hybrid --fusion rrf
+
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .config import HYBRID_FUSION, HYBRID_RRF_K, HYBRID_WEIGHTS, HYBRID_DEPTH
+from .query import citation, get_keyword_searcher
+from .vector_query import get_vector_searcher
+from . import trace
+
+MODES = ("keyword", "vector", "hybrid")
+NOT_BUILT = {
+    "keyword": "Keyword index not built yet. Click 'Rebuild BM25 Index' in the sidebar.",
+    "vector": "Vector index not built yet. Click 'Build Vector Index' in the sidebar.",
+}
+
+
+@dataclass
+class Hit:
+    record: dict
+    score: float                                            # fused score (the backend's own in single mode)
+    ranks: Dict[str, int] = field(default_factory=dict)     # backend -> 1-based rank
+    scores: Dict[str, float] = field(default_factory=dict)  # backend -> raw score
+
+    def citation(self) -> dict:
+        return {**citation(self.record, self.score), "backends": sorted(self.ranks)}
+
+
+def chunk_key(rec: dict) -> Tuple[str, int]:
+    """Identity of a chunk across backends: its file (or URL) and character offset."""
+    return rec.get("path") or rec.get("source", ""), int(rec.get("offset") or 0)
+
+
+def fuse(results: Dict[str, List[Tuple[dict, float]]], k: int, fusion: str = HYBRID_FUSION,
+         weights: Dict[str, float] = HYBRID_WEIGHTS, rrf_k: int = HYBRID_RRF_K) -> List[Hit]:
+    """Merge per-backend rankings into the top `k` Hits, one per chunk."""
+    hits: Dict[Tuple[str, int], Hit] = {}
+    for backend, ranked in results.items():
+        if not ranked:
+            continue
+        lo, hi = min(s for _, s in ranked), max(s for _, s in ranked)
+        for rank, (rec, score) in enumerate(ranked, start=1):
+            hit = hits.setdefault(chunk_key(rec), Hit(rec, 0.0))
+            if backend in hit.ranks:
+                continue  # the same chunk twice in one backend (e.g. duplicate rows)
+            hit.ranks[backend], hit.scores[backend] = rank, float(score)
+            if fusion == "weighted":
+                norm = (score - lo) / (hi - lo) if hi > lo else 1.0
+                hit.score += weights.get(backend, 1.0) * norm
+            else:
+                hit.score += 1.0 / (rrf_k + rank)
+    return sorted(hits.values(), key=lambda h: -h.score)[:k]
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+    return _pool
+
+
+def _safe(fn, query: str, n: int) -> List[Tuple[dict, float]]:
+    # a backend that is not built just contributes nothing; any other failure is the caller's
+    try:
+        return fn(query, n)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        trace.error("hybrid.backend", e)
+        raise
+
+
+def _built(searcher) -> bool:
+    """False when `searcher` has no index on disk (VectorSearcher reports it, Searcher raises)."""
+    ensure = getattr(searcher, "_ensure_loaded", None)
+    if ensure is None:
+        return True
+    try:
+        return ensure() is not False
+    except FileNotFoundError:
+        return False
+
+
+@trace.traced("retrieve")
+def search(query: str, k: int = 6, mode: str = "hybrid", fusion: str = HYBRID_FUSION,
+           keyword=None, vector=None) -> List[Hit]:
+    """
+    Top `k` Hits for `query`. In "hybrid" mode both backends are queried for
+    HYBRID_DEPTH * k candidates concurrently, so latency follows the slower
+    backend rather than the sum of both.
+    """
+    keyword = keyword or get_keyword_searcher()
+    vector = vector or get_vector_searcher()
+    if mode == "keyword":
+        return [Hit(r, s, {"keyword": i}, {"keyword": s}) for i, (r, s) in enumerate(_safe(keyword.search, query, k), 1)]
+    if mode == "vector":
+        return [Hit(r, s, {"vector": i}, {"vector": s}) for i, (r, s) in enumerate(_safe(vector.search, query, k), 1)]
+    n = HYBRID_DEPTH * k
+    # each task runs in a copy of the caller's context, so its spans nest under the caller's
+    futures = {name: _executor().submit(contextvars.copy_context().run, _safe, s.search, query, n)
+               for name, s in (("keyword", keyword), ("vector", vector))}
+    return fuse({name: f.result() for name, f in futures.items()}, k, fusion)
+
+
+def _safe_many(fn, queries: List[str], n: int) -> List[List[Tuple[dict, float]]]:
+    try:
+        return fn(queries, n)
+    except FileNotFoundError:
+        return [[] for _ in queries]
+    except Exception as e:
+        trace.error("hybrid.backend", e)
+        raise
+
+
+@trace.traced("retrieve.batch")
+def search_many(queries: List[str], k: int = 6, mode: str = "hybrid", fusion: str = HYBRID_FUSION,
+                keyword=None, vector=None) -> List[List[Hit]]:
+    """search() for a list of queries through the backends' batched search_many."""
+    keyword = keyword or get_keyword_searcher()
+    vector = vector or get_vector_searcher()
+    if mode in ("keyword", "vector"):
+        s = keyword if mode == "keyword" else vector
+        return [[Hit(r, sc, {mode: i}, {mode: sc}) for i, (r, sc) in enumerate(res, 1)]
+                for res in _safe_many(s.search_many, queries, k)]
+    n = HYBRID_DEPTH * k
+    futures = {name: _executor().submit(contextvars.copy_context().run, _safe_many, s.search_many, queries, n)
+               for name, s in (("keyword", keyword), ("vector", vector))}
+    kw, vec = futures["keyword"].result(), futures["vector"].result()
+    return [fuse({"keyword": a, "vector": b}, k, fusion) for a, b in zip(kw, vec)]
+
+
+def answer(query: str, k: int = 6, mode: str = "hybrid", budget: int = 0, **kw) -> Tuple[str, List[dict]]:
+    """
+    (context, citations) in the same shape for every mode. With a token `budget`
+    the context is packed by rag.context (best sentences, cited chunks only)
+    instead of the stitched chunks. When no backend of `mode` has an index, the
+    context says which to build.
+    """
+    hits = search(query, k, mode, **kw)
+    if not hits:
+        searchers = {"keyword": kw.get("keyword") or get_keyword_searcher(),
+                     "vector": kw.get("vector") or get_vector_searcher()}
+        names = ["keyword", "vector"] if mode == "hybrid" else [mode]
+        missing = [name for name in names if not _built(searchers[name])]
+        if missing and len(missing) == len(names):
+            return "\n".join(NOT_BUILT[name] for name in missing), []
+    return pack_hits(query, hits, budget)
+
+
+def pack_hits(query: str, hits: List[Hit], budget: int = 0) -> Tuple[str, List[dict]]:
+    if budget:
+        from .context import pack
+        with trace.span("context.pack"):
+            p = pack(query, [h.record for h in hits], [h.citation() for h in hits], budget)
+        return p.text, p.citations
+    return "\n\n".join(h.record.get("text", "") for h in hits), [h.citation() for h in hits]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("query")
+    ap.add_argument("-k", type=int, default=6)
+    ap.add_argument("--mode", choices=MODES, default="hybrid")
+    ap.add_argument("--fusion", choices=["rrf", "weighted"], default=HYBRID_FUSION)
+    args = ap.parse_args()
+    for h in search(args.query, args.k, args.mode, args.fusion):
+        c = h.citation()
+        print(f"{h.score:.4f}  {c['title']} @ {c['page'] or c['offset']}  {c['source']}  {h.ranks}")
@@ -1,8 +1,10 @@
-import argparse, json, joblib
+import argparse, json, os, threading
 from pathlib import Path
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from .config import PROCESSED_DIR, DOCS_JSONL, INDEX_PATH
+from typing import Any, NamedTuple, Optional
+import numpy as np
+from .config import PROCESSED_DIR, INDEX_PATH, index_docs
+from .metastore import MetaStore, write_store
+from . import trace
 
 def load_docs(path: Path):
     docs = []
@@ -14,19 +16,158 @@ def load_docs(path: Path):
             docs.append(rec)
     return texts, docs
 
-def build_index():
-    texts, docs = load_docs(DOCS_JSONL)
-    vec = TfidfVectorizer(ngram_range=(1,2), max_df=0.85, min_df=2)
-    X = vec.fit_transform(texts)
-    INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
-    joblib.dump({"vectorizer": vec, "matrix": X, "docs": docs}, INDEX_PATH)
-    return str(INDEX_PATH)
+def meta_path(index_path: Path) -> Path:
+    """Row-aligned chunk records of an index (rag.metastore)."""
+    return index_path.with_suffix(".meta")
+
+def _iter_records(path: Path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+@trace.traced("index.tfidf.build")
+def build_index(docs_path: Optional[Path] = None, index_path: Path = INDEX_PATH):
+    import joblib
+    from sklearn.feature_extraction.text import TfidfVectorizer  # ~1 s to import; only when building
+    docs_path = docs_path or index_docs()
+    texts = [rec["text"] for rec in _iter_records(docs_path)]
+    trace.incr("rag_chunks_indexed_total", len(texts), index="tfidf")
+    with trace.span("index.tfidf.fit"):
+        vec = TfidfVectorizer(ngram_range=(1,2), max_df=0.85, min_df=2)
+        X = vec.fit_transform(texts)
+    del texts
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    # records go to a memory-mapped store, written first: the bundle's mtime triggers reloads
+    with trace.span("index.tfidf.store"):
+        write_store(meta_path(index_path), _iter_records(docs_path))
+    # uncompressed, so the matrix arrays can be memory-mapped by Searcher
+    with trace.span("index.tfidf.dump"):
+        tmp = index_path.with_suffix(".tmp")
+        joblib.dump({"vectorizer": vec, "matrix": X}, tmp)
+        os.replace(tmp, index_path)
+    return str(index_path)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, via a partial sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idxs = np.argpartition(-scores, k - 1)[:k]
+    return idxs[np.argsort(-scores[idxs], kind="stable")]
+
+DOC_BLOCK = 16384  # rows scored at a time by search_many: bounds the dense block to DOC_BLOCK x queries
+
+def top_k_columns(blocks, k: int):
+    """
+    Top `k` rows of every column over score blocks given as (first row, rows x
+    queries array), best first: (queries x k) row ids and scores. Only the k best
+    candidates per column are kept between blocks, so memory follows the block
+    size rather than the number of rows.
+    """
+    I = D = None
+    for start, S in blocks:
+        kk = min(k, len(S))
+        if kk <= 0:
+            continue
+        part = np.argpartition(-S, kk - 1, axis=0)[:kk]
+        ids, top = part + start, np.take_along_axis(S, part, axis=0)
+        I, D = (ids, top) if I is None else (np.vstack([I, ids]), np.vstack([D, top]))
+        if len(I) > k:
+            part = np.argpartition(-D, k - 1, axis=0)[:k]
+            I, D = np.take_along_axis(I, part, axis=0), np.take_along_axis(D, part, axis=0)
+    if I is None:
+        return np.zeros((0, 0), dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    order = np.argsort(-D, axis=0, kind="stable")
+    return np.take_along_axis(I, order, axis=0).T, np.take_along_axis(D, order, axis=0).T
+
+class Loaded(NamedTuple):
+    """One generation of the TF-IDF index; replaced as a whole, never updated in place."""
+    stamp: tuple
+    vectorizer: Any
+    matrix: Any
+    docs: Any  # MetaStore, or the records list of bundles from before it
+
+class Searcher:
+    """
+    TF-IDF index held in memory between queries. The matrix is memory-mapped from
+    the joblib file and chunk records are read from the MetaStore on demand; the
+    bundle is loaded again only when the file's mtime changes, or when `index_path`
+    is a symlink that rag.jobs points at a new generation. A reload swaps the one
+    `loaded` reference, and each query reads it once, so a query never mixes the
+    vectorizer of one generation with the matrix or records of another.
+    """
+    def __init__(self, index_path: Path = INDEX_PATH):
+        self.index_path = Path(index_path)
+        self._lock = threading.Lock()
+        self.loaded: Optional[Loaded] = None
+
+    def _ensure_loaded(self) -> Loaded:
+        path = self.index_path.resolve()  # bundle and records from the same generation
+        stamp = (str(path), path.stat().st_mtime_ns)
+        cur = self.loaded
+        if cur is not None and cur.stamp == stamp:
+            return cur
+        with self._lock:
+            if self.loaded is not None and self.loaded.stamp == stamp:
+                return self.loaded
+            with trace.span("index.tfidf.load"):
+                import joblib  # unpickling the vectorizer imports sklearn as well
+                bundle = joblib.load(path, mmap_mode="r")
+            # bundles from before the MetaStore carry the records themselves
+            docs = bundle["docs"] if "docs" in bundle else MetaStore(meta_path(path))
+            self.loaded = Loaded(stamp, bundle["vectorizer"], bundle["matrix"], docs)
+            return self.loaded
+
+    @trace.traced("index.tfidf.search")
+    def search(self, query: str, top_k: int = 8):
+        ix = self._ensure_loaded()
+        qv = ix.vectorizer.transform([query])
+        # rows and query are L2-normalized by TfidfVectorizer, so the dot product is the cosine
+        sims = (ix.matrix @ qv.T).toarray().ravel()
+        idxs = top_k_indices(sims, top_k)
+        with trace.span("meta.fetch"):
+            return [(ix.docs[i], float(sims[i])) for i in idxs]
+
+    @trace.traced("index.tfidf.search_many")
+    def search_many(self, queries, top_k: int = 8, block: int = 256, doc_block: int = DOC_BLOCK):
+        """
+        search() for a list of queries: one sparse product per `block` of queries
+        and `doc_block` of rows, keeping a running top-k, so the dense scores never
+        exceed doc_block x block.
+        """
+        ix = self._ensure_loaded()
+        X, n = ix.matrix, ix.matrix.shape[0]
+        out = []
+        for s in range(0, len(queries), block):
+            QT = ix.vectorizer.transform(queries[s:s + block]).T.tocsc()
+            I, D = top_k_columns(((d, (X[d:d + doc_block] @ QT).toarray()) for d in range(0, n, doc_block)), top_k)
+            if not len(I):
+                out.extend([] for _ in range(QT.shape[1]))
+                continue
+            out.extend([(ix.docs[i], float(sc)) for i, sc in zip(ids, scores)] for ids, scores in zip(I, D))
+        return out
+
+_searcher = None
+
+def get_searcher() -> Searcher:
+    """Process-wide Searcher over INDEX_PATH."""
+    global _searcher
+    if _searcher is None:
+        _searcher = Searcher()
+    return _searcher
 
 def search(query: str, top_k=8):
-    bundle = joblib.load(INDEX_PATH)
+    return get_searcher().search(query, top_k)
+
+def search_uncached(query: str, top_k=8, index_path: Path = INDEX_PATH):
+    """The pre-Searcher path: load the whole bundle for every query. Kept for rag.bench."""
+    import joblib
+    from sklearn.metrics.pairwise import cosine_similarity
+    index_path = Path(index_path).resolve()
+    bundle = joblib.load(index_path)
     vec = bundle["vectorizer"]
     X = bundle["matrix"]
-    docs = bundle["docs"]
+    docs = bundle["docs"] if "docs" in bundle else MetaStore(meta_path(index_path))
     qv = vec.transform([query])
     sims = cosine_similarity(qv, X).ravel()
     idxs = sims.argsort()[::-1][:top_k]
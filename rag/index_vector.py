@@ -1,96 +1,261 @@
 # rag/index_vector.py
 
+import argparse
+import multiprocessing
 import os
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 
-# Try FAISS
-try:
-    import faiss  # type: ignore
-    HAS_FAISS = True
-except Exception:
-    HAS_FAISS = False
+from .config import (PROCESSED_DIR, EMBED_CACHE_DIR, ENCODE_WORKERS, ENCODE_POOL_MIN_CHUNKS, VECTOR_INDEX,
+                     VECTOR_DTYPE, VECTOR_NLIST, VECTOR_HNSW_M, VECTOR_PQ_M, index_docs)
+from .embcache import EmbeddingCache, text_hash
+from .metastore import write_store
+from .encoders import get_encoder
+from . import trace
 
-from sentence_transformers import SentenceTransformer
-from .config import PROCESSED_DIR, DOCS_JSONL
-
-# Default model
+# Default model ("hash" selects the offline stand-in encoder, see rag.encoders)
 MODEL_NAME = os.getenv("EMBEDDINGS_MODEL", "BAAI/bge-base-en")
 
 # Vector storage directory
-VECTOR_DIR = PROCESSED_DIR / "vector"
-VECTOR_DIR.mkdir(parents=True, exist_ok=True)
+VECTOR_DIR = PROCESSED_DIR / "vector"  # created by build_vector_index
 
 INDEX_PATH = VECTOR_DIR / "faiss.index"
-META_PATH = VECTOR_DIR / "meta.jsonl"
+META_PATH = VECTOR_DIR / "meta.jsonl"  # legacy row metadata; new builds write STORE_PATH
+STORE_PATH = VECTOR_DIR / "meta.store"
 MODEL_TAG_PATH = VECTOR_DIR / "model.txt"
 
+_faiss_mod = None
+
+
+def get_faiss():
+    """The faiss module, imported on first use (keyword-only sessions never load it); None if not installed."""
+    global _faiss_mod
+    if _faiss_mod is None:
+        try:
+            import faiss  # type: ignore
+            _faiss_mod = faiss
+        except Exception:
+            _faiss_mod = False
+    return _faiss_mod or None
+
 
 # --------------------------------------------------------------------------------------
 # Load parsed documents (JSONL)
 # --------------------------------------------------------------------------------------
-def _load_docs() -> List[Dict[str, Any]]:
+def _load_docs(docs_path: Path) -> List[Dict[str, Any]]:
     docs = []
-    if not DOCS_JSONL.exists():
+    if not docs_path.exists():
         return docs
 
-    with DOCS_JSONL.open("r", encoding="utf-8") as f:
+    with docs_path.open("r", encoding="utf-8") as f:
         for line in f:
             try:
                 obj = json.loads(line)
                 if obj.get("text"):
                     docs.append(obj)
-            except:
-                pass
+            except Exception as e:
+                trace.error("vector.docs", e)
     return docs
 
 
 # --------------------------------------------------------------------------------------
-# Build FAISS vector index
+# Encoding
 # --------------------------------------------------------------------------------------
-def build_vector_index(batch_size: int = 64) -> Tuple[int, str]:
+def _init_worker(model_name: str, threads: int):
+    # split the cores between the worker processes instead of oversubscribing them
+    if not model_name.startswith("hash"):
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except Exception:
+            pass
 
-    docs = _load_docs()
-    if not docs:
-        return 0, "No documents found in DOCS_JSONL."
 
-    model = SentenceTransformer(MODEL_NAME)
+def _encode_batch(model_name: str, texts: List[str]) -> np.ndarray:
+    model = get_encoder(model_name)  # loaded once per worker process
+    return model.encode(texts, batch_size=len(texts), show_progress_bar=False,
+                        normalize_embeddings=True).astype("float32")
+
 
-    texts = [d["text"] for d in docs]
-    all_vecs = []
+def pool_workers(model_name: str, n: int, workers: int = ENCODE_WORKERS) -> int:
+    """
+    Encoder processes actually worth starting for `n` chunks. Each worker is
+    spawned and loads its own copy of the model, which only pays off for a real
+    model and at least ENCODE_POOL_MIN_CHUNKS chunks; the "hash" stand-in is
+    cheaper to run than to ship to another process.
+    """
+    if model_name.startswith("hash") or n < ENCODE_POOL_MIN_CHUNKS:
+        return 1
+    return max(1, workers)
 
-    # Encode in batches
-    for i in range(0, len(texts), batch_size):
-        chunk = texts[i:i + batch_size]
-        vecs = model.encode(chunk, show_progress_bar=True, normalize_embeddings=True)
-        all_vecs.append(vecs.astype("float32"))
 
-    # Stack into one matrix
-    X = np.vstack(all_vecs)
+def encode_into_cache(cache: EmbeddingCache, todo: Dict[bytes, str], model_name: str, batch_size: int = 64,
+                      workers: int = ENCODE_WORKERS, bucket: bool = True) -> int:
+    """
+    Encode `todo` (hash -> text) and append the vectors to `cache` as batches
+    finish. With `bucket`, texts are sorted by length before batching so each
+    batch pads to a similar length. Batches are spread over up to `workers`
+    processes (see pool_workers), started with "spawn": a forked copy of a
+    process that already runs torch or tokenizer threads can deadlock.
+    Returns the number of processes used.
+    """
+    keys = sorted(todo, key=lambda h: len(todo[h])) if bucket else list(todo)
+    batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+    workers = pool_workers(model_name, len(keys), workers)
+    if workers <= 1 or len(batches) <= 1:
+        for b in batches:
+            cache.add(b, _encode_batch(model_name, [todo[h] for h in b]))
+        return 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(model_name, threads)) as pool:
+        futures = [pool.submit(_encode_batch, model_name, [todo[h] for h in b]) for b in batches]
+        for b, fut in zip(batches, futures):
+            cache.add(b, fut.result())
+    return workers
 
-    # Save FAISS or NumPy
-    if HAS_FAISS:
-        dim = X.shape[1]
-        index = faiss.IndexFlatIP(dim)
-        index.add(X)
-        faiss.write_index(index, str(INDEX_PATH))
+
+def _factory(kind: str, n: int, dim: int) -> str:
+    """FAISS index_factory string for VECTOR_INDEX `kind` over `n` vectors."""
+    nlist = VECTOR_NLIST or int(4 * np.sqrt(n))
+    nlist = min(nlist, n // 39)  # FAISS wants ~39 training points per list
+    if kind == "hnsw":
+        return f"HNSW{VECTOR_HNSW_M}"
+    if kind in ("ivf", "ivfpq") and nlist >= 2:
+        if kind == "ivf" or n < 256 * 39:  # PQ codebooks (256 centroids) need ~10k training points
+            return f"IVF{nlist},Flat"
+        m = VECTOR_PQ_M or dim // 8
+        while dim % m:
+            m -= 1
+        return f"IVF{nlist},PQ{m}"
+    return "Flat"  # also for corpora too small to train IVF on
+
+
+def _write_matrix(cache: EmbeddingCache, rows: np.ndarray, index_path: Path, dtype: str, block: int):
+    npy = Path(str(index_path) + ".npy")
+    scale_path = Path(str(index_path) + ".scale.npy")
+    scale = None
+    if dtype == "int8":
+        # per-dimension scale so each column uses the full int8 range; scores use q / scale
+        peak = np.zeros(cache.dim, dtype=np.float32)
+        for s in range(0, len(rows), block):
+            peak = np.maximum(peak, np.abs(cache.vectors(rows[s:s + block])).max(axis=0))
+        scale = 127 / np.maximum(peak, 1e-12)
+    X = np.lib.format.open_memmap(f"{npy}.tmp", mode="w+", dtype=dtype, shape=(len(rows), cache.dim))
+    for s in range(0, len(rows), block):
+        V = cache.vectors(rows[s:s + block])
+        X[s:s + block] = np.rint(V * scale) if scale is not None else V
+    X.flush()
+    del X
+    if scale is not None:
+        np.save(scale_path, scale.astype(np.float32))
     else:
-        np.save(str(INDEX_PATH) + ".npy", X)
-
-    # Save metadata (row-aligned)
-    with META_PATH.open("w", encoding="utf-8") as mf:
-        for d in docs:
-            meta_line = {
-                "title": d.get("title", ""),
-                "source": d.get("source", ""),
-                "offset": d.get("offset", 0),
-                "text": d.get("text", "")[:5000]  # preview limit
-            }
-            mf.write(json.dumps(meta_line) + "\n")
-
-    # Save the model tag
-    MODEL_TAG_PATH.write_text(MODEL_NAME, encoding="utf-8")
-
-    return len(docs), f"Successfully built vector index using model {MODEL_NAME}"
+        scale_path.unlink(missing_ok=True)
+    os.replace(f"{npy}.tmp", npy)
+
+
+def _write_index(cache: EmbeddingCache, rows: np.ndarray, index_path: Path, kind: str = VECTOR_INDEX,
+                 dtype: str = VECTOR_DTYPE, block: int = 65536) -> str:
+    """
+    Stream cached rows into the index a block at a time: a FAISS index built with
+    index_factory for `kind`, or for "numpy" (and whenever FAISS is missing) a
+    memory-mapped float32 / float16 / int8 matrix. Returns what was built.
+    """
+    faiss = get_faiss() if kind != "numpy" else None
+    if faiss is None:
+        _write_matrix(cache, rows, index_path, dtype, block)
+        Path(index_path).unlink(missing_ok=True)  # VectorSearcher prefers a FAISS file when present
+        return f"numpy-{dtype}"
+    spec = _factory(kind, len(rows), cache.dim)
+    index = faiss.index_factory(cache.dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:  # IVF: k-means on a sample of up to 256 points per list
+        n_train = min(len(rows), 256 * faiss.extract_index_ivf(index).nlist)
+        sample = np.sort(np.random.default_rng(0).choice(len(rows), n_train, replace=False))
+        index.train(cache.vectors(rows[sample]))
+    for s in range(0, len(rows), block):
+        index.add(cache.vectors(rows[s:s + block]))
+    tmp = str(index_path) + ".tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, index_path)
+    for p in (Path(str(index_path) + ".npy"), Path(str(index_path) + ".scale.npy")):
+        p.unlink(missing_ok=True)
+    return spec
+
+
+# --------------------------------------------------------------------------------------
+# Build FAISS vector index
+# --------------------------------------------------------------------------------------
+@trace.traced("vector.build")
+def build_vector_index(batch_size: int = 64, docs_path: Optional[Path] = None, vector_dir: Path = VECTOR_DIR,
+                       model_name: str = MODEL_NAME, cache_dir: Path = EMBED_CACHE_DIR,
+                       stats: Dict[str, Any] = None, workers: int = ENCODE_WORKERS,
+                       kind: str = VECTOR_INDEX, dtype: str = VECTOR_DTYPE) -> Tuple[int, str]:
+    """
+    Embed the deduplicated chunks (config.index_docs) and write the vector index.
+    Embeddings come from the per-model EmbeddingCache; only chunks whose text is not cached are encoded
+    (the model is not even loaded when nothing is new). Pass a dict as `stats`
+    for the encoded/reused report.
+    """
+    docs = _load_docs(docs_path or index_docs())
+    if not docs:
+        return 0, "No documents found in docs.jsonl."
+
+    vector_dir.mkdir(parents=True, exist_ok=True)
+    index_path = vector_dir / INDEX_PATH.name
+
+    with trace.span("vector.cache_lookup"):
+        texts = [d["text"] for d in docs]
+        hashes = [text_hash(t) for t in texts]
+        cache = EmbeddingCache(model_name, cache_dir)
+        rows = cache.lookup(hashes)
+        todo = {h: t for h, t, r in zip(hashes, texts, rows) if r < 0}  # unique texts not cached yet
+        missing = list(todo)
+    trace.incr("rag_chunks_encoded_total", len(missing))
+    trace.incr("rag_embed_cache_hits_total", len(docs) - len(missing))
+
+    # Encode the missing chunks, appending each batch to the cache
+    t0 = time.perf_counter()
+    if missing:
+        with trace.span("vector.encode"):
+            encode_into_cache(cache, todo, model_name, batch_size, workers)
+        cache.s_per_chunk = (time.perf_counter() - t0) / len(missing)
+        cache.save_meta()
+    encode_s = time.perf_counter() - t0
+
+    # Stream the cached vectors into the index, row-aligned with docs
+    with trace.span("vector.write_index"):
+        built = _write_index(cache, cache.lookup(hashes), index_path, kind, dtype)
+        if len(cache) > 2 * len(set(hashes)):
+            cache.compact(hashes)  # mostly embeddings of chunks that no longer exist
+
+    # Save the chunk records (row-aligned) to the memory-mapped store
+    with trace.span("vector.store"):
+        write_store(vector_dir / STORE_PATH.name, docs)
+    (vector_dir / META_PATH.name).unlink(missing_ok=True)
+
+    # Save the model tag last: VectorSearcher reloads when it changes
+    (vector_dir / MODEL_TAG_PATH.name).write_text(model_name, encoding="utf-8")
+
+    reused = len(docs) - len(missing)
+    saved = reused * cache.s_per_chunk if cache.s_per_chunk else 0.0
+    if stats is not None:
+        stats.update({"chunks": len(docs), "encoded": len(missing), "reused": reused,
+                      "encode_s": round(encode_s, 2), "saved_s": round(saved, 1),
+                      "chunks_per_s": round(len(missing) / encode_s, 1) if missing and encode_s else 0.0})
+    return len(docs), (f"Successfully built {built} vector index using model {model_name}: "
+                       f"encoded {len(missing)}, reused {reused} cached embeddings (~{saved:.0f}s saved)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=ENCODE_WORKERS, help="Encoder processes (in-process below ENCODE_POOL_MIN_CHUNKS new chunks)")
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--index", default=VECTOR_INDEX, choices=["flat", "ivf", "hnsw", "ivfpq", "numpy"])
+    ap.add_argument("--dtype", default=VECTOR_DTYPE, choices=["float32", "float16", "int8"], help="numpy matrix")
+    args = ap.parse_args()
+    n, msg = build_vector_index(batch_size=args.batch_size, workers=args.workers, kind=args.index, dtype=args.dtype)
+    print(msg, f"({n} chunks)")
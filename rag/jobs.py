@@ -0,0 +1,445 @@
+# rag/jobs.py
+#
+# Background index builds. start() launches `python -m rag.jobs run <id>` in its
+# own process and session, so a Streamlit rerun or a closed browser tab does not
+# stop it, and returns the job id at once. The worker runs the job's stages in
+# order and rewrites JOBS_DIR/<id>.json (atomically) as each stage starts and
+# ends: state, current stage, per-stage state / seconds / result, error. status()
+# and latest() read it back; cancel() stops the worker. Its output goes to
+# JOBS_DIR/<id>.log. One job runs at a time, across processes (the CLI and every
+# Streamlit session), because every job rewrites docs.jsonl: start() creates
+# JOBS_DIR/build.lock with O_EXCL and the worker removes it when it ends. A lock
+# whose job is no longer active (the worker died) is stale and taken over.
+#
+# TF-IDF and vector indexes are built into a new directory under GENERATIONS_DIR
+# and published by replacing a symlink (INDEX_PATH, VECTOR_DIR) with os.replace.
+# Searchers keep reading the complete previous generation until the swap and load
+# the new one on their next query. A failed or cancelled build is never published.
+# BM25 is rebuilt in place, because its manifest swap is already atomic. Where
+# symlinks are not available (Windows without developer mode), the indexes are
+# built in place as before.
+#
+#   python -m rag.jobs start keyword [--wait]   # parse, dedup, TF-IDF, BM25
+#   python -m rag.jobs start vector
+#   python -m rag.jobs start refresh            # fetch, then all of the above
+#   python -m rag.jobs status [<job id>]
+#   python -m rag.jobs cancel <job id>
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .config import INDEX_PATH, JOBS_DIR, GENERATIONS_DIR, GENERATIONS_KEEP, SEED_SOURCES
+from . import trace
+
+JOBS = {
+    "keyword": ["parse", "dedup", "tfidf", "bm25"],
+    "vector": ["vector"],
+    "refresh": ["fetch", "parse", "dedup", "tfidf", "bm25", "vector"],
+}
+ACTIVE = ("queued", "running")
+QUEUED_TIMEOUT = 60  # seconds a job may stay queued before it counts as failed (the worker never started)
+
+
+# --------------------------------------------------------------------------------------
+# Generations: build next to the live index, then swap a symlink
+# --------------------------------------------------------------------------------------
+_links_ok: Dict[str, bool] = {}
+
+
+def _symlinks(root: Path) -> bool:
+    if str(root) not in _links_ok:
+        root.mkdir(parents=True, exist_ok=True)
+        probe = root / f".probe-{os.getpid()}"
+        try:
+            os.symlink(root, probe, target_is_directory=True)
+            probe.unlink()
+            _links_ok[str(root)] = True
+        except OSError:
+            _links_ok[str(root)] = False
+    return _links_ok[str(root)]
+
+
+def new_generation(name: str, root: Path = GENERATIONS_DIR) -> Optional[Path]:
+    """Empty directory for the next `name` build, or None where builds must go in place."""
+    if not _symlinks(root):
+        return None
+    gen = root / name / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{os.urandom(2).hex()}"
+    gen.mkdir(parents=True)
+    return gen
+
+
+def publish(live: Path, target: Path):
+    """Point `live` at `target` in one step: a new symlink renamed over it."""
+    live.parent.mkdir(parents=True, exist_ok=True)
+    if live.is_dir() and not live.is_symlink():
+        # the first publish over an index built in place: os.replace cannot put a symlink
+        # over a directory, so move it in with the generations (searches miss it during the rename)
+        os.replace(live, target.parent / f"in-place-{time.strftime('%Y%m%d-%H%M%S')}")
+    tmp = live.with_name(f".{live.name}.{os.getpid()}.swap")
+    tmp.unlink(missing_ok=True)
+    # relative, so the data directory can be moved or mounted elsewhere
+    os.symlink(os.path.relpath(target.resolve(), live.parent.resolve()), tmp, target_is_directory=target.is_dir())
+    os.replace(tmp, live)
+
+
+def prune(name: str, live: Path, keep: int = GENERATIONS_KEEP, root: Path = GENERATIONS_DIR) -> int:
+    """Delete all but the newest `keep` generations of `name`; the live one is always kept."""
+    d = root / name
+    if not d.exists():
+        return 0
+    current = live.resolve()
+    gens = sorted((p for p in d.iterdir() if p.is_dir()), key=lambda p: p.stat().st_mtime)
+    n = 0
+    for g in gens[:max(0, len(gens) - max(keep, 1))]:
+        if g == current or g in current.parents:
+            continue
+        # open searchers keep their memory maps of deleted files (POSIX); new ones read the live generation
+        shutil.rmtree(g, ignore_errors=True)
+        n += 1
+    return n
+
+
+# --------------------------------------------------------------------------------------
+# Stages
+# --------------------------------------------------------------------------------------
+def _stage_fetch(ctx: dict) -> str:
+    from .fetch import crawl
+    ctx["changed"] = crawl([url for urls in SEED_SOURCES.values() for url in urls])
+    return f"{len(ctx['changed'])} new or changed files"
+
+
+def _stage_parse(ctx: dict) -> str:
+    from .parse import build_docs
+    return build_docs(ctx.get("changed"))
+
+
+def _stage_dedup(ctx: dict) -> str:
+    from .dedup import dedup_docs
+    dd = dedup_docs()
+    return f"removed {dd['removed']} near-duplicate chunks ({dd['shrink']:.0%} smaller)"
+
+
+def _stage_tfidf(ctx: dict) -> str:
+    from .index import build_index, meta_path
+    gen = new_generation("tfidf")
+    if gen is None:
+        return build_index()
+    try:
+        build_index(index_path=gen / INDEX_PATH.name)
+    except BaseException:
+        shutil.rmtree(gen, ignore_errors=True)
+        raise
+    publish(INDEX_PATH, gen / INDEX_PATH.name)
+    meta_path(INDEX_PATH).unlink(missing_ok=True)  # records of an index that was built in place
+    prune("tfidf", INDEX_PATH)
+    return str(gen)
+
+
+def _stage_bm25(ctx: dict) -> str:
+    from .bm25 import build_index
+    return build_index()
+
+
+def _stage_vector(ctx: dict) -> str:
+    from .index_vector import build_vector_index, VECTOR_DIR
+    gen = new_generation("vector")
+    if gen is None:
+        return build_vector_index()[1]
+    try:
+        n, msg = build_vector_index(vector_dir=gen)
+    except BaseException:
+        shutil.rmtree(gen, ignore_errors=True)
+        raise
+    if not n:
+        shutil.rmtree(gen, ignore_errors=True)  # nothing to index: keep serving the current generation
+        return msg
+    publish(VECTOR_DIR, gen)
+    prune("vector", VECTOR_DIR)
+    return msg
+
+
+STAGES = {"fetch": _stage_fetch, "parse": _stage_parse, "dedup": _stage_dedup, "tfidf": _stage_tfidf,
+          "bm25": _stage_bm25, "vector": _stage_vector}
+
+
+# --------------------------------------------------------------------------------------
+# Status files
+# --------------------------------------------------------------------------------------
+def _status_path(job_id: str) -> Path:
+    return JOBS_DIR / f"{job_id}.json"
+
+
+def _write(job: dict):
+    job["updated"] = time.time()
+    p = _status_path(job["id"])
+    tmp = p.with_name(p.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(job, default=str), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def _pid_path(job_id: str) -> Path:
+    # the launcher records the worker's pid here, not in the status file, which the worker owns
+    return JOBS_DIR / f"{job_id}.pid"
+
+
+def _lock_path() -> Path:
+    return JOBS_DIR / "build.lock"
+
+
+def _alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # os.kill would terminate it; rely on the status file
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+_procs: Dict[str, subprocess.Popen] = {}
+_start_lock = threading.Lock()
+
+
+def status(job_id: str) -> Optional[dict]:
+    """
+    The job's status dict, or None for an unknown id. A job whose worker died, or
+    that stayed queued past QUEUED_TIMEOUT, is recorded as failed.
+    """
+    try:
+        job = json.loads(_status_path(job_id).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if job["state"] not in ACTIVE:
+        return job
+    if job.get("pid") is None:
+        try:
+            job["pid"] = int(_pid_path(job_id).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+    proc = _procs.get(job_id)
+    if proc is not None and proc.poll() is not None:
+        _procs.pop(job_id, None)  # reaped, so _alive() below sees it gone
+    if job.get("pid") and not _alive(job["pid"]):
+        error = f"worker exited unexpectedly (see {job_id}.log)"
+    elif job["state"] == "queued" and time.time() - job["created"] > QUEUED_TIMEOUT:
+        error = f"worker did not start within {QUEUED_TIMEOUT}s (see {job_id}.log)"
+    else:
+        return job
+    job.update(state="failed", stage=None, finished=time.time(), error=job.get("error") or error)
+    _write(job)
+    return job
+
+
+def jobs(limit: int = 20) -> List[dict]:
+    """Most recent jobs first."""
+    if not JOBS_DIR.exists():
+        return []
+    paths = sorted(JOBS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)[:limit]
+    return [j for j in (status(p.stem) for p in paths) if j is not None]
+
+
+def latest(name: Optional[str] = None) -> Optional[dict]:
+    """Most recent job (of kind `name`)."""
+    for job in jobs():
+        if name is None or job["job"] == name:
+            return job
+    return None
+
+
+def progress(job: dict) -> Tuple[int, int]:
+    """(stages done, stages)."""
+    return sum(s["state"] == "done" for s in job["stages"]), len(job["stages"])
+
+
+def _acquire(job_id: str) -> Optional[str]:
+    """Take build.lock for `job_id`; if another job holds it and is active, return that job's id."""
+    while True:
+        try:
+            fd = os.open(_lock_path(), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                holder = _lock_path().read_text(encoding="utf-8").strip()
+                age = time.time() - _lock_path().stat().st_mtime
+            except OSError:
+                continue  # released meanwhile
+            job = status(holder) if holder else None
+            if job is not None and job["state"] in ACTIVE:
+                return holder
+            if job is None and age < 5:
+                time.sleep(0.05)  # just taken; its status file is being written
+                continue
+            # stale: rename before deleting, so of two processes taking it over only one removes it
+            stale = _lock_path().with_name(f"build.lock.{os.getpid()}.stale")
+            try:
+                os.replace(_lock_path(), stale)
+                stale.unlink()
+            except OSError:
+                pass
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(job_id)
+        return None
+
+
+def _release(job_id: str):
+    try:
+        if _lock_path().read_text(encoding="utf-8").strip() == job_id:
+            _lock_path().unlink()
+    except OSError:
+        pass
+
+
+def start(name: str) -> str:
+    """
+    Start job `name` (a key of JOBS) in a worker process and return its id. If a
+    job is already running, here or in another process, its id is returned
+    instead and nothing is started.
+    """
+    if name not in JOBS:
+        raise ValueError(f"unknown job {name!r}; one of {sorted(JOBS)}")
+    with _start_lock:
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.urandom(2).hex()}"
+        running = _acquire(job_id)
+        if running is not None:
+            return running
+        # written before the worker exists; from here on only the worker writes it
+        _write({"id": job_id, "job": name, "state": "queued", "pid": None, "created": time.time(),
+                "started": None, "finished": None, "stage": None, "error": None,
+                "stages": [{"name": s, "state": "pending"} for s in JOBS[name]]})
+        detach = ({"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == "nt"
+                  else {"start_new_session": True})
+        try:
+            with (JOBS_DIR / f"{job_id}.log").open("ab") as log:
+                proc = subprocess.Popen([sys.executable, "-m", "rag.jobs", "run", job_id],
+                                        cwd=Path(__file__).resolve().parent.parent, stdin=subprocess.DEVNULL,
+                                        stdout=log, stderr=subprocess.STDOUT, **detach)
+        except BaseException as e:
+            _write({**status(job_id), "state": "failed", "finished": time.time(), "error": f"{type(e).__name__}: {e}"})
+            _release(job_id)
+            raise
+        _procs[job_id] = proc
+        _pid_path(job_id).write_text(str(proc.pid), encoding="utf-8")
+    return job_id
+
+
+def cancel(job_id: str) -> bool:
+    """Stop a running job; its unpublished generation is removed. False if it was not running."""
+    job = status(job_id)
+    if job is None or job["state"] not in ACTIVE or not job.get("pid"):
+        return False
+    os.kill(job["pid"], signal.SIGTERM)
+    # SIGTERM is TerminateProcess on Windows, and a queued worker has no handler yet: neither records it
+    if os.name == "nt" or job["state"] == "queued":
+        job.update(state="cancelled", finished=time.time(), stage=None)
+        _write(job)
+        _release(job_id)
+    return True
+
+
+# --------------------------------------------------------------------------------------
+# Worker
+# --------------------------------------------------------------------------------------
+def _terminate(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def run(job_id: str) -> int:
+    """Run the stages of `job_id` in this process, recording each in its status file."""
+    job = json.loads(_status_path(job_id).read_text(encoding="utf-8"))
+    if job["state"] != "queued":
+        return 1  # started too late: already recorded as failed or cancelled
+    job.update(state="running", pid=os.getpid(), started=time.time())
+    _write(job)
+    signal.signal(signal.SIGTERM, _terminate)  # cancel(): unwind the running stage
+    ctx: dict = {}
+    entry = None
+    try:
+        with trace.span(f"job.{job['job']}", job_id=job_id):
+            for entry in job["stages"]:
+                job["stage"], entry["state"] = entry["name"], "running"
+                _write(job)
+                print(f"[{time.strftime('%H:%M:%S')}] {entry['name']}", flush=True)
+                t0 = time.perf_counter()
+                with trace.span(f"job.{entry['name']}"):
+                    result = STAGES[entry["name"]](ctx)
+                entry.update(state="done", seconds=round(time.perf_counter() - t0, 2), result=str(result)[:500])
+                print(f"  {entry['seconds']}s  {entry['result']}", flush=True)
+                _write(job)
+        job["state"] = "done"
+    except BaseException as e:
+        cancelled = isinstance(e, (SystemExit, KeyboardInterrupt))
+        job["state"] = "cancelled" if cancelled else "failed"
+        job["error"] = "cancelled" if cancelled else f"{type(e).__name__}: {e}"
+        if entry is not None and entry["state"] == "running":
+            entry["state"] = job["state"]
+        if not cancelled:
+            traceback.print_exc()
+    finally:
+        job.update(stage=None, finished=time.time())
+        _write(job)
+        _release(job_id)
+        _pid_path(job_id).unlink(missing_ok=True)
+    return 0 if job["state"] == "done" else 1
+
+
+def _print_status(job: dict):
+    done, total = progress(job)
+    print(f"{job['id']}  {job['state']}  {done}/{total}" + (f"  ({job['stage']})" if job["stage"] else ""))
+    for s in job["stages"]:
+        print(f"  {s['name']:<8} {s['state']:<9} " + (f"{s['seconds']:>8}s  {s.get('result', '')}" if "seconds" in s else ""))
+    if job["error"]:
+        print(f"  ! {job['error']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("start")
+    c.add_argument("job", choices=sorted(JOBS))
+    c.add_argument("--wait", action="store_true", help="Print progress until the job ends")
+    c = sub.add_parser("run")  # the worker process
+    c.add_argument("job_id")
+    c = sub.add_parser("status")
+    c.add_argument("job_id", nargs="?")
+    c = sub.add_parser("cancel")
+    c.add_argument("job_id")
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        sys.exit(run(args.job_id))
+    elif args.cmd == "start":
+        job_id = start(args.job)
+        job = status(job_id)
+        if job["job"] != args.job:
+            print(f"Job {job_id} is still running; not starting {args.job}.")
+        else:
+            print(f"Started {job_id} (log: {JOBS_DIR / (job_id + '.log')})")
+        if args.wait:
+            seen = None
+            while job is not None and job["state"] in ACTIVE:
+                if (job["state"], job["stage"]) != seen:
+                    seen = (job["state"], job["stage"])
+                    _print_status(job)
+                time.sleep(1)
+                job = status(job_id)
+            _print_status(job)
+            sys.exit(0 if job["state"] == "done" else 1)
+    elif args.cmd == "status":
+        job = status(args.job_id) if args.job_id else latest()
+        if job is None:
+            print("No jobs.")
+        else:
+            _print_status(job)
+    elif args.cmd == "cancel":
+        print("Cancelled." if cancel(args.job_id) else "Not running.")
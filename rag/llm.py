@@ -1,29 +1,195 @@
 
+import hashlib
 import os
-from typing import Optional
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
 
-def synthesize_with_openai(prompt: str, context: str, model: Optional[str] = None) -> Optional[str]:
+from .config import LLM_TIMEOUT, LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX
+from . import trace
+
+SYS_PROMPT = (
+    "You are a compliance assistant for Title V (Texas). "
+    "Answer concisely, cite the provided sources by title when referencing rules, "
+    "and prefer exact rule language for limits/timings. "
+    "If uncertain, say what needs human review."
+)
+
+def _model(model: Optional[str] = None) -> str:
+    return model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+def _messages(prompt: str, context: str) -> list:
+    return [
+        {"role": "system", "content": SYS_PROMPT},
+        {"role": "user", "content": f"Question:\n{prompt}\n\nRelevant context:\n{context}\n"}
+    ]
+
+# --------------------------------------------------------------------------------------
+# Pooled client: one OpenAI client (and its HTTP connection pool) per key / base URL
+# --------------------------------------------------------------------------------------
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Shared OpenAI client, or None without OPENAI_API_KEY or the openai package.
+    Recreated only if the key or base URL changes.
+    """
+    global _client, _client_key
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         return None
+    key = (api_key, os.getenv("OPENAI_BASE_URL"))
+    with _client_lock:
+        if _client is None or _client_key != key:
+            try:
+                from openai import OpenAI
+            except ImportError as e:
+                trace.error("llm.client", e)
+                return None
+            _client = OpenAI(api_key=api_key, base_url=key[1] or None, timeout=LLM_TIMEOUT)
+            _client_key = key
+        return _client
+
+# --------------------------------------------------------------------------------------
+# Answer cache: sqlite, keyed by (model, prompt, hash of the retrieved context)
+# --------------------------------------------------------------------------------------
+def context_hash(context: str) -> str:
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """
+    Persistent LLM answers. Entries expire `ttl` seconds after they were written;
+    beyond `max_entries` the least recently used are evicted.
+    """
+    def __init__(self, path: Path = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX):
+        self.path, self.ttl, self.max_entries = Path(path), ttl, max_entries
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, model TEXT, "
+                             "created REAL, used REAL, answer TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS answers_used ON answers (used)")
+        return self._db
+
+    @staticmethod
+    def key(model: str, prompt: str, context: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}\0{context_hash(context)}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prompt: str, context: str) -> Optional[str]:
+        if self.ttl <= 0:
+            return None
+        k, now = self.key(model, prompt, context), time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT answer FROM answers WHERE key = ? AND created > ?", (k, now - self.ttl)).fetchone()
+            if row is None:
+                self.misses += 1
+                trace.incr("rag_llm_cache_total", result="miss")
+                return None
+            db.execute("UPDATE answers SET used = ? WHERE key = ?", (now, k))
+            self.hits += 1
+            trace.incr("rag_llm_cache_total", result="hit")
+            return row[0]
+
+    def put(self, model: str, prompt: str, context: str, answer: str):
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                       (self.key(model, prompt, context), model, now, now, answer))
+            db.execute("DELETE FROM answers WHERE created <= ?", (now - self.ttl,))
+            db.execute("DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY used DESC "
+                       "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn().execute("DELETE FROM answers")
+
+_cache = None
+
+def get_cache() -> AnswerCache:
+    global _cache
+    if _cache is None:
+        _cache = AnswerCache()
+    return _cache
+
+# --------------------------------------------------------------------------------------
+# Synthesis
+# --------------------------------------------------------------------------------------
+def synthesize_with_openai(prompt: str, context: str, model: Optional[str] = None,
+                           use_cache: bool = True) -> Optional[str]:
+    client = get_client()
+    if client is None:
+        return None
+    mdl = _model(model)
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        hit = cache.get(mdl, prompt, context)
+        if hit is not None:
+            return hit
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        sys_prompt = (
-            "You are a compliance assistant for Title V (Texas). "
-            "Answer concisely, cite the provided sources by title when referencing rules, "
-            "and prefer exact rule language for limits/timings. "
-            "If uncertain, say what needs human review."
-        )
-        messages = [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": f"Question:\n{prompt}\n\nRelevant context:\n{context}\n"}
-        ]
-        mdl = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        resp = client.chat.completions.create(model=mdl, messages=messages, temperature=0.2)
-        return resp.choices[0].message.content.strip()
-    except Exception:
+        with trace.span("llm.completion"):
+            resp = client.chat.completions.create(model=mdl, messages=_messages(prompt, context), temperature=0.2)
+        text = resp.choices[0].message.content.strip()
+    except Exception as e:
+        trace.error("llm.completion", e)
         return None
+    if cache is not None and text:
+        cache.put(mdl, prompt, context, text)
+    return text
+
+def stream_openai(prompt: str, context: str, model: Optional[str] = None, use_cache: bool = True) -> Iterator[str]:
+    """
+    The answer as it is generated, one text delta at a time (st.write_stream
+    renders it token by token). A cached answer is yielded whole; a completed
+    stream is cached. Yields nothing without OPENAI_API_KEY or on error.
+    """
+    client = get_client()
+    if client is None:
+        return
+    mdl = _model(model)
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        hit = cache.get(mdl, prompt, context)
+        if hit is not None:
+            yield hit
+            return
+    parts = []
+    # timed by hand rather than with a span: the generator is suspended between deltas
+    t0 = time.perf_counter()
+    try:
+        stream = client.chat.completions.create(model=mdl, messages=_messages(prompt, context),
+                                                temperature=0.2, stream=True)
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not parts:
+                    trace.observe("rag_llm_ttft_seconds", time.perf_counter() - t0)
+                parts.append(delta)
+                yield delta
+    except Exception as e:
+        trace.error("llm.stream", e)
+        return  # partial answers are not cached
+    trace.record("llm.stream", time.perf_counter() - t0)
+    text = "".join(parts).strip()
+    if cache is not None and text:
+        cache.put(mdl, prompt, context, text)
 
 def compress_extractive(context: str, max_chars: int = 1500) -> str:
     ctx = context.strip()
@@ -36,3 +202,17 @@ def answer_with_fallback(question: str, retrieved_text: str) -> str:
     if gen and len(gen) > 20:
         return gen
     return compress_extractive(retrieved_text)
+
+def stream_with_fallback(question: str, retrieved_text: str) -> Iterator[str]:
+    """answer_with_fallback as a stream: LLM deltas, or the extractive answer if the LLM gave nothing."""
+    head = ""  # held back until it is long enough to count as an answer (same rule as above)
+    for delta in stream_openai(question, retrieved_text):
+        if head is None:
+            yield delta
+            continue
+        head += delta
+        if len(head) > 20:
+            yield head
+            head = None
+    if head is not None:
+        yield compress_extractive(retrieved_text)
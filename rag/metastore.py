@@ -0,0 +1,91 @@
+# rag/metastore.py
+#
+# Random-access store for chunk records (title, source, page, text, ...), used by
+# the TF-IDF and vector indexes to map a row id back to its chunk. Layout:
+#
+#   magic (8) | n (uint64) | dict length (uint64) | zlib preset dictionary
+#   | offsets (n + 1 uint64) | records
+#
+# Each record is JSON compressed on its own with a preset dictionary sampled from
+# the first records, so one row decompresses without touching its neighbours.
+# Readers memory-map the file: opening is O(1) and a lookup reads one record.
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+
+MAGIC = b"RAGMETA\x01"
+_DICT_SAMPLE = 200     # records sampled for the preset dictionary
+_DICT_SIZE = 8 * 1024   # bytes; a larger dictionary compresses a little better but slows every lookup
+
+
+def _dictionary(sample: List[bytes]) -> bytes:
+    # the tail of the sample: zlib gives the shortest back-references to bytes near the end
+    return b"".join(sample)[-_DICT_SIZE:]
+
+
+def write_store(path: Path, records: Iterable[dict]) -> int:
+    """Write `records` to `path` (atomically); returns how many. Memory use is independent of the count."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    it = iter(records)
+    head = [json.dumps(r).encode() for _, r in zip(range(_DICT_SAMPLE), it)]
+    zdict = _dictionary(head)
+    offsets = [0]
+    with tempfile.TemporaryFile(dir=path.parent) as blob:
+        for data in (d for part in (head, (json.dumps(r).encode() for r in it)) for d in part):
+            c = zlib.compressobj(6, zdict=zdict)
+            z = c.compress(data) + c.flush()
+            blob.write(z)
+            offsets.append(offsets[-1] + len(z))
+        n = len(offsets) - 1
+        tmp = Path(f"{path}.tmp")
+        with tmp.open("wb") as f:
+            f.write(MAGIC + struct.pack("<QQ", n, len(zdict)) + zdict)
+            f.write(np.array(offsets, dtype="<u8").tobytes())
+            blob.seek(0)
+            shutil.copyfileobj(blob, f)
+    os.replace(tmp, path)
+    return n
+
+
+class MetaStore:
+    """Read-only, memory-mapped view of a store written by write_store."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f"{path} is not a metadata store")
+        n, dlen = struct.unpack("<QQ", self._mm[8:24])
+        self.zdict = self._mm[24:24 + dlen]
+        start = 24 + dlen
+        self.offsets = np.frombuffer(self._mm, dtype="<u8", count=n + 1, offset=start)
+        self._base = start + 8 * (n + 1)
+        self.n = n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, i: int) -> dict:
+        i = int(i)
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        s, e = self._base + int(self.offsets[i]), self._base + int(self.offsets[i + 1])
+        d = zlib.decompressobj(zdict=self.zdict)
+        return json.loads(d.decompress(self._mm[s:e]) + d.flush())
+
+    def get_many(self, ids: Iterable[int]) -> List[dict]:
+        return [self[i] for i in ids]
+
+    def __iter__(self):
+        return (self[i] for i in range(self.n))
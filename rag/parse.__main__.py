@@ -1,4 +1,13 @@
-from .parse import build_docs
+from .parse import build_docs, changed_files, format_stats
+from .config import PARSE_WORKERS
+import argparse
+
 if __name__ == "__main__":
-    p = build_docs()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--changed", action="store_true")
+    ap.add_argument("--workers", type=int, default=PARSE_WORKERS)
+    args = ap.parse_args()
+    stats = {}
+    p = build_docs(changed_files() if args.changed else None, workers=args.workers, stats=stats)
     print("Docs written to", p)
+    print(format_stats(stats))
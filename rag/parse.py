@@ -1,9 +1,14 @@
-import json, re
+import json, os, re, time, hashlib, argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
 from pathlib import Path
-from bs4 import BeautifulSoup
-from readability import Document as ReadabilityDoc
-from pdfminer.high_level import extract_text
-from .config import RAW_DIR, PROCESSED_DIR, CHUNK_SIZE, CHUNK_OVERLAP
+from urllib.parse import unquote, urlparse
+from .config import (RAW_DIR, PROCESSED_DIR, CHUNKER, CHUNK_SIZE, CHUNK_OVERLAP, CHANGED_NAME,
+                     PARSE_WORKERS, PARSER_VERSION, PARSE_CACHE_DIR,
+                     PDF_MAX_SECONDS, PDF_MAX_PAGES, PDF_SLOW_SECONDS, PARSE_FILE_TIMEOUT, QUARANTINE_PATH)
+from .readable import load_or_build
+from .chunking import chunk_pages
+from . import trace
 
 def _clean_text(txt: str) -> str:
     txt = re.sub(r"\s+", " ", txt)
@@ -18,55 +23,363 @@ def _chunk(text: str, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
         i += size - overlap
     return chunks
 
-def _html_to_text(path: Path) -> tuple[str, str]:
-    html = path.read_text(errors="ignore")
+def _chunk_pages(pages, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Same windows as `_chunk` over the pages joined by spaces, consumed page by page.
+    Yields (offset, page, chunk) where `page` is the page the chunk starts on.
+    """
+    buf = ""
+    pos = 0           # buf[pos:] is still to be chunked; consumed text is dropped once per page
+    base = 0          # document offset of buf[pos]
+    marks = deque()   # (offset, page) of page starts still inside buf
+    step = size - overlap
+    for page, text in pages:
+        if not text:
+            continue
+        buf = buf[pos:]
+        pos = 0
+        if buf:
+            buf += " "
+        marks.append((base + len(buf), page))
+        buf += text
+        while len(buf) - pos >= size:
+            while len(marks) > 1 and marks[1][0] <= base:
+                marks.popleft()
+            yield base, marks[0][1], buf[pos:pos + size]
+            pos += step
+            base += step
+    while len(buf) > pos:
+        while len(marks) > 1 and marks[1][0] <= base:
+            marks.popleft()
+        yield base, marks[0][1], buf[pos:pos + size]
+        pos += step
+        base += step
+
+def _chunks(pages):
+    """(offset, page, section, chunk) from the configured chunker."""
+    if CHUNKER == "sections":
+        return chunk_pages(pages)
+    return ((offset, page, None, chunk) for offset, page, chunk in _chunk_pages(pages))
+
+def _html_to_text(path: Path, budget: dict):
+    """The page's text as one untagged page; the title goes into `budget`."""
+    # uses the readable sidecar the crawler wrote; builds it for uploads
+    res = load_or_build(path)
+    budget["title"] = res["title"]
+    yield None, res["text"]
+
+def _pdf_pages(path: Path, budget: dict):
+    """Yield (page_no, text) one page at a time, stopping at the time/page limits in `budget`."""
+    from pdfminer.high_level import extract_pages  # only when a PDF is parsed
+    from pdfminer.layout import LTTextContainer
+    t0 = time.perf_counter()
+    for n, layout in enumerate(extract_pages(str(path), maxpages=PDF_MAX_PAGES + 1), start=1):
+        if n > PDF_MAX_PAGES:
+            budget["problem"] = f"more than {PDF_MAX_PAGES} pages"
+            return
+        text = "".join(el.get_text() for el in layout if isinstance(el, LTTextContainer))
+        budget["pages"] = n
+        yield n, _clean_text(text)
+        if time.perf_counter() - t0 > PDF_MAX_SECONDS:
+            budget["problem"] = f"over {PDF_MAX_SECONDS}s after {n} pages"
+            budget["retry"] = True
+            return
+
+def _pdf_title(path: Path) -> str:
+    """The Title entry of the PDF's document info, or "" (missing, or the file is damaged)."""
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+    from pdfminer.utils import decode_text
     try:
-        doc = ReadabilityDoc(html)
-        main = doc.summary()
-        soup = BeautifulSoup(main, "lxml")
-    except Exception:
-        soup = BeautifulSoup(html, "lxml")
-    # Extract title
-    title = soup.title.get_text(strip=True) if soup.title else path.stem
-    # Remove scripts/styles
-    for tag in soup(["script", "style", "noscript"]):
-        tag.decompose()
-    text = soup.get_text(" ")
-    return title, _clean_text(text)
-
-def _pdf_to_text(path: Path) -> tuple[str, str]:
+        with path.open("rb") as fh:
+            for info in PDFDocument(PDFParser(fh)).info:
+                title = resolve1(info.get("Title"))
+                if isinstance(title, bytes):
+                    title = decode_text(title)
+                if isinstance(title, str) and title.strip():
+                    return _clean_text(title)
+    except Exception as e:
+        trace.error("parse.pdf_title", e)
+    return ""
+
+def _pdf_to_text(path: Path, budget: dict):
+    """
+    Page-tagged text of a PDF, one page at a time; the title goes into `budget`.
+    Whatever was extracted before a limit or error is kept; the reason is left in
+    budget["problem"] so build_docs can quarantine the file, and budget["retry"]
+    is set when it may not happen again (out of time, an exception).
+    """
+    budget["title"] = _pdf_title(path)
+    t0 = time.perf_counter()
+    try:
+        yield from _pdf_pages(path, budget)
+    except Exception as e:
+        budget["problem"] = f"error after {budget['pages']} pages: {type(e).__name__}: {e}"[:300]
+        budget["retry"] = True
+    dt = time.perf_counter() - t0
+    if budget["problem"] is None and dt > PDF_SLOW_SECONDS:
+        budget["problem"] = f"slow: {dt:.0f}s for {budget['pages']} pages"
+
+def _previous_records(out: Path) -> dict[str, list[str]]:
+    """Existing docs.jsonl lines grouped by raw file path."""
+    by_path: dict[str, list[str]] = {}
+    if not out.exists():
+        return by_path
+    with out.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                by_path.setdefault(json.loads(line)["path"], []).append(line)
+            except Exception as e:
+                trace.error("parse.previous", e)
+                continue
+    return by_path
+
+def _source_url(file: Path) -> str:
+    # the .url sidecar lists every URL the blob was fetched from; the first is canonical
+    side = file.with_suffix(".url")
+    if not side.exists():
+        return ""
+    urls = side.read_text().split()
+    return urls[0] if urls else ""
+
+def changed_files(raw_dir: Path = RAW_DIR) -> list[Path]:
+    """Raw files crawls reported as new or changed and build_docs has not parsed since."""
+    p = raw_dir / CHANGED_NAME
+    if not p.exists():
+        return []
+    # a blob replaced by a later crawl of the same URL is gone from disk
+    return [Path(line) for line in p.read_text(encoding="utf-8").splitlines() if line.strip() and Path(line).exists()]
+
+def _consume_changed(parsed: set[str] | None, raw_dir: Path = RAW_DIR):
+    """Drop `parsed` (everything, after a full build) from changed.txt; entries a crawl adds meanwhile stay."""
+    p = raw_dir / CHANGED_NAME
+    if not p.exists():
+        return
+    keep = [] if parsed is None else [f for f in changed_files(raw_dir) if str(f) not in parsed]
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text("".join(f"{f}\n" for f in keep), encoding="utf-8")
+    os.replace(tmp, p)
+
+def _file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _cache_path(path: Path) -> Path:
+    return PARSE_CACHE_DIR / f"{_file_hash(path)}-v{PARSER_VERSION}.json"
+
+def _text_path(cache: Path) -> Path:
+    """The page text of a cache entry, one [page, text] per line; the .json summary is written last."""
+    return cache.with_suffix(".pages.jsonl")
+
+def _save(cache: Path, res: dict):
+    tmp = cache.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(res), encoding="utf-8")
+    os.replace(tmp, cache)
+
+def _extract(path: Path) -> dict:
+    """
+    {title, pages, problem, seconds, text, hit} for one raw file; runs in a worker
+    process. Pages are written to the file `text` as they are extracted rather
+    than returned, so neither process holds the whole document. A result that ran
+    out of time or hit an error gets no summary, so it is not a cache hit later.
+    """
+    cache = _cache_path(path)
+    text = _text_path(cache)
+    if cache.exists() and text.exists():
+        try:
+            return {**json.loads(cache.read_text(encoding="utf-8")), "text": str(text), "hit": True}
+        except Exception as e:
+            trace.error("parse.cache", e)  # corrupt entry: extract again
+    t0 = time.perf_counter()
+    budget = {"title": "", "pages": 0, "problem": None, "retry": False}
+    n = 0
+    tmp = text.with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        for page, page_text in (_html_to_text if path.suffix == ".html" else _pdf_to_text)(path, budget):
+            if page_text:
+                f.write(json.dumps([page, page_text]) + "\n")
+                n += 1
+    os.replace(tmp, text)
+    res = {"title": budget["title"], "pages": n, "problem": budget["problem"],
+           "seconds": round(time.perf_counter() - t0, 2)}
+    if not budget["retry"]:
+        _save(cache, res)
+    return {**res, "text": str(text), "hit": False}
+
+def _pages(res: dict):
+    """The [page, text] lines of an _extract result, read back one at a time."""
+    if not res.get("text"):
+        return
+    with open(res["text"], encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def _kill(pool: ProcessPoolExecutor):
+    """Shut down `pool` without waiting for a hung worker: its processes are terminated."""
+    procs = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for proc in procs:
+        proc.terminate()
+
+def _extract_all(todo: list[Path], workers: int, timeout: float = PARSE_FILE_TIMEOUT):
+    """
+    _extract for each of `todo`, in order, in a pool of `workers` processes. A
+    file that takes longer than `timeout` (pdfminer stuck inside one page, where
+    the PDF_MAX_SECONDS check never runs) is given up: the pool is replaced, the
+    files after it are submitted again, and it comes back with a problem so it is
+    quarantined. A timeout is not cached: the next build tries the file again
+    (a busy machine can be the cause).
+    """
+    pool, futures = None, {}
     try:
-        text = extract_text(str(path)) or ""
-    except Exception:
-        text = ""
-    title = path.stem
-    return title, _clean_text(text)
+        for i, path in enumerate(todo):
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=max(1, workers))
+                for p in todo[i:]:
+                    f = futures.get(p)
+                    # kept only if it finished before the old pool went; _kill cancels the rest
+                    if not (f is not None and f.done() and not f.cancelled() and f.exception() is None):
+                        futures[p] = pool.submit(_extract, p)
+            try:
+                # files are taken in submission order, so `path` has been running for at least this long
+                res = futures.pop(path).result(timeout=timeout)
+            except FutureTimeout:
+                _kill(pool)
+                pool = None
+                res = {"title": "", "pages": 0, "problem": f"timed out after {timeout}s", "seconds": timeout,
+                       "hit": False}
+            yield res
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def _previous_quarantine() -> dict[str, str]:
+    if not QUARANTINE_PATH.exists():
+        return {}
+    lines = QUARANTINE_PATH.read_text(encoding="utf-8").splitlines()
+    return {json.loads(l)["path"]: l for l in lines if l.strip()}
+
+def _title(file: Path, res: dict, src: str) -> str:
+    """The extracted title, else the last part of the source URL; crawled blobs are named by content hash."""
+    if res["title"]:
+        return res["title"]
+    if src:
+        u = urlparse(src)
+        return unquote(u.path.rstrip("/").rsplit("/", 1)[-1]) or u.netloc
+    return file.stem
+
+def _records(file: Path, res: dict):
+    src = _source_url(file)
+    title = _title(file, res, src)
+    for offset, page, section, chunk in _chunks(_pages(res)):
+        yield {
+            "title": title,
+            "source": src,
+            "path": str(file),
+            "offset": offset,
+            "page": page,
+            "section": section,
+            "text": chunk
+        }
+
+@trace.traced("parse.files")
+def parse_files(files: list[Path]) -> list[dict]:
+    """Chunk records for just `files` (uploads, re-fetched pages) without touching docs.jsonl."""
+    PARSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    out = []
+    for file in files:
+        file = Path(file)
+        if file.suffix in (".html", ".pdf"):
+            out.extend(_records(file, _extract(file)))
+    return out
 
-def build_docs():
+@trace.traced("parse.build_docs")
+def build_docs(changed: list[Path] | None = None, workers: int = PARSE_WORKERS, stats: dict | None = None):
+    """
+    Parse RAW_DIR into chunk records in docs.jsonl. When `changed` is given, only
+    those files are parsed again; records of every other file still on disk are
+    copied over from the previous docs.jsonl.
+
+    Extraction runs in a pool of `workers` processes and is cached per file under
+    PARSE_CACHE_DIR by content hash and PARSER_VERSION. Files are written in sorted
+    path order, so the output does not depend on the worker count. Pass a dict as
+    `stats` to get the timing report.
+    """
+    t0 = time.perf_counter()
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+    PARSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
     out = PROCESSED_DIR / "docs.jsonl"
-    with out.open("w", encoding="utf-8") as f:
-        for file in RAW_DIR.glob("**/*"):
-            if file.suffix not in [".html", ".pdf"]:
-                continue
-            src = (file.with_suffix(".url").read_text() if file.with_suffix(".url").exists() else "")
-            if file.suffix == ".html":
-                title, text = _html_to_text(file)
-            else:
-                title, text = _pdf_to_text(file)
-            if not text:
-                continue
-            for offset, chunk in _chunk(text):
-                rec = {
-                    "title": title,
-                    "source": src,
-                    "path": str(file),
-                    "offset": offset,
-                    "text": chunk
-                }
-                f.write(json.dumps(rec) + "\n")
+    previous = _previous_records(out) if changed is not None else {}
+    changed_set = {str(p) for p in changed or []}
+    files = sorted(p for p in RAW_DIR.glob("**/*") if p.suffix in (".html", ".pdf"))
+    todo = [p for p in files if not (str(p) in previous and str(p) not in changed_set)]
+
+    results = _extract_all(todo, workers)
+    hits = 0
+    old_quarantine = _previous_quarantine()
+    quarantine = []
+    tmp = out.with_suffix(".jsonl.tmp")
+    try:
+        with tmp.open("w", encoding="utf-8") as f:
+            for file in files:
+                if str(file) in previous and str(file) not in changed_set:
+                    f.writelines(previous[str(file)])
+                    if str(file) in old_quarantine:
+                        quarantine.append(old_quarantine[str(file)] + "\n")
+                    continue
+                with trace.span("parse.wait"):  # extraction time not hidden behind the pool
+                    res = next(results)
+                hits += res["hit"]
+                if not res["hit"]:
+                    # timed in the worker process (html: Readability, pdf: pdfminer)
+                    trace.record(f"parse.extract.{file.suffix[1:]}", res.get("seconds") or 0.0)
+                trace.incr("rag_files_parsed_total", type=file.suffix[1:], cache="hit" if res["hit"] else "miss")
+                if res["problem"]:
+                    trace.incr("rag_parse_quarantined_total")
+                    quarantine.append(json.dumps({"path": str(file), "reason": res["problem"],
+                                                  "pages": res["pages"], "seconds": res.get("seconds")}) + "\n")
+                with trace.span("parse.chunk"):
+                    n = 0
+                    for rec in _records(file, res):
+                        f.write(json.dumps(rec) + "\n")
+                        n += 1
+                trace.incr("rag_chunks_total", n)
+    finally:
+        results.close()
+    os.replace(tmp, out)
+    QUARANTINE_PATH.write_text("".join(quarantine), encoding="utf-8")
+    _consume_changed(changed_set if changed is not None else None)
+
+    if stats is not None:
+        dt = time.perf_counter() - t0
+        stats.update({
+            "files": len(files),
+            "reused": len(files) - len(todo),
+            "extracted": len(todo) - hits,
+            "cache_hits": hits,
+            "cache_hit_rate": round(hits / len(todo), 3) if todo else 0.0,
+            "seconds": round(dt, 3),
+            "files_per_s": round(len(files) / dt, 1) if dt else 0.0,
+            "quarantined": len(quarantine),
+        })
     return str(out)
 
+def format_stats(stats: dict) -> str:
+    return (f"{stats['files']} files in {stats['seconds']}s ({stats['files_per_s']} files/s); "
+            f"extracted {stats['extracted']}, cache hits {stats['cache_hits']} "
+            f"({stats['cache_hit_rate']:.0%}), reused {stats['reused']}, "
+            f"quarantined {stats['quarantined']} (see {QUARANTINE_PATH.name})")
+
 if __name__ == "__main__":
-    p = build_docs()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--changed", action="store_true", help="Only re-parse files the last crawl reported as changed")
+    ap.add_argument("--workers", type=int, default=PARSE_WORKERS)
+    args = ap.parse_args()
+    stats = {}
+    p = build_docs(changed_files() if args.changed else None, workers=args.workers, stats=stats)
     print("Wrote", p)
+    print(format_stats(stats))
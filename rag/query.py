@@ -1,13 +1,31 @@
-from .index import search
+from .config import KEYWORD_BACKEND, BM25_DIR
+from .index import get_searcher
+from .bm25 import get_bm25_searcher, MANIFEST
 
-def answer(query: str, k=6):
-    results = search(query, top_k=k)
+def get_keyword_searcher(backend: str = KEYWORD_BACKEND):
+    """BM25 when selected and built, otherwise the TF-IDF Searcher."""
+    if backend == "bm25" and (BM25_DIR / MANIFEST).exists():
+        return get_bm25_searcher()
+    return get_searcher()
+
+def citation(rec: dict, score: float) -> dict:
+    """The citation shape every retrieval path returns."""
+    return {
+        "title": rec.get("title", ""),
+        "source": rec.get("source") or rec.get("path", ""),
+        "offset": int(rec.get("offset") or 0),
+        "page": rec.get("page"),
+        "section": rec.get("section"),
+        "score": float(score),
+    }
+
+def answer(query: str, k=6, searcher=None):
+    results = (searcher or get_keyword_searcher()).search(query, top_k=k)
     context = []
     citations = []
     for rec, score in results:
         context.append(rec["text"])
-        src = rec["source"] or rec["path"]
-        citations.append({"title": rec["title"], "source": src, "offset": rec["offset"], "score": score})
+        citations.append(citation(rec, score))
     stitched = "\n\n".join(context)
     # Lightweight synthesis: just return top chunks and citations;
     # You can plug an LLM here later for abstractive synthesis.
@@ -0,0 +1,64 @@
+# rag/readable.py
+#
+# One pass over an HTML page: Readability main content, title and outbound links.
+# fetch.crawl runs it once per page and stores the result next to the raw file as
+# <blob>.json; parse.build_docs reads that instead of running Readability again.
+
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from urllib.parse import urljoin
+
+import lxml.html
+from lxml import etree
+
+
+def _clean_text(txt: str) -> str:
+    return re.sub(r"\s+", " ", txt).strip()
+
+
+def readable(html: str) -> dict:
+    """
+    {title, text, links} for a page. `links` are the raw hrefs found in the main
+    content (fragments dropped); resolve them against the URL the page came from.
+    """
+    title = ""
+    try:
+        from readability import Document as ReadabilityDoc  # only when a page is processed
+        doc = ReadabilityDoc(html)
+        title = doc.short_title() or ""
+        tree = lxml.html.fromstring(doc.summary(html_partial=True))
+    except Exception:
+        try:
+            tree = lxml.html.fromstring(html)
+        except Exception:
+            return {"title": title, "text": "", "links": []}
+    etree.strip_elements(tree, "script", "style", "noscript", with_tail=False)
+    links = [h.strip() for h in tree.xpath("//a/@href") if h.strip() and not h.startswith("#")]
+    text = _clean_text(" ".join(tree.itertext()))
+    return {"title": _clean_text(title), "text": text, "links": links}
+
+
+def sidecar(path: Path) -> Path:
+    return path.with_suffix(".json")
+
+
+def load_or_build(path: Path) -> dict:
+    """Readable sidecar of a raw .html file, built and saved if missing or stale."""
+    side = sidecar(path)
+    if side.exists() and side.stat().st_mtime >= path.stat().st_mtime:
+        try:
+            return json.loads(side.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    res = readable(path.read_text(errors="ignore"))
+    tmp = side.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(res), encoding="utf-8")
+    os.replace(tmp, side)
+    return res
+
+
+def resolve_links(res: dict, base: str) -> list[str]:
+    return [urljoin(base, h) for h in res.get("links", [])]
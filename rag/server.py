@@ -0,0 +1,310 @@
+# rag/server.py
+#
+# Standalone query server: the keyword and vector searchers (indexes, metadata,
+# encoder) stay loaded in one process and the UIs call it over HTTP. Concurrent
+# requests are gathered into micro-batches of up to SERVER_MAX_BATCH queries:
+# whatever queued while the previous batch ran, plus (under concurrent load) up
+# to SERVER_MAX_WAIT_MS of stragglers. Each batch goes through
+# hybrid.search_many (one encoder pass, one index search).
+#
+#   python -m rag.server --port 8765 --max-batch 32 --max-wait-ms 5
+#
+#   GET  /health                 {"ok": true}
+#   GET  /stats                  request / batch counters
+#   GET  /metrics                rag.trace counters and histograms (Prometheus text; RAG_TRACE=1)
+#   POST /search  {"query", "k", "mode", "fusion", "budget"}  -> {"context", "citations"}
+#   POST /answer  (same body)                                 -> {"answer", "context", "citations"}
+#
+# Bodies over SERVER_MAX_BODY bytes are refused with 413 (and the connection
+# closed, since the body is never read); "k" is clamped to 1..SERVER_MAX_K.
+#
+# "budget" packs the context into that many tokens (rag.context); /answer
+# defaults to CONTEXT_BUDGET, /search to the stitched chunks.
+#
+# QueryClient is the matching client; with RAG_SERVER_URL set, the UIs use it.
+
+import argparse
+import asyncio
+import http.client
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .config import (CONTEXT_BUDGET, HYBRID_FUSION, SERVER_HOST, SERVER_PORT, SERVER_URL, SERVER_MAX_BATCH,
+                     SERVER_MAX_BODY, SERVER_MAX_K, SERVER_MAX_WAIT_MS)
+from .hybrid import MODES, Hit, pack_hits, search_many
+from . import trace
+from .query import get_keyword_searcher
+from .vector_query import get_vector_searcher
+
+_ROUTES = ("/health", "/stats", "/metrics", "/search", "/answer")
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+            500: "Internal Server Error"}
+
+
+class QueryServer:
+    def __init__(self, keyword=None, vector=None, max_batch: int = SERVER_MAX_BATCH,
+                 max_wait_ms: float = SERVER_MAX_WAIT_MS):
+        self.keyword = keyword or get_keyword_searcher()
+        self.vector = vector or get_vector_searcher()
+        self.max_batch, self.max_wait = max(1, max_batch), max_wait_ms / 1000
+        self.stats = {"requests": 0, "batches": 0, "queries": 0, "max_batch_seen": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._server = None
+        self._loop = None
+
+    # ---------------------------------------------------------------- micro-batching
+    async def search(self, query: str, k: int = 6, mode: str = "hybrid", fusion: str = HYBRID_FUSION) -> List[Hit]:
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, k, mode, fusion, fut))
+        return await fut
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        last = 1
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # wait for stragglers only under concurrent load: a lone client should not pay max_wait
+            deadline = loop.time() + (self.max_wait if last > 1 or len(batch) > 1 else 0)
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            groups: Dict[Tuple[str, str], list] = {}
+            for item in batch:
+                groups.setdefault((item[2], item[3]), []).append(item)
+            for (mode, fusion), items in groups.items():
+                k = max(it[1] for it in items)
+                try:
+                    # off the event loop, so connections keep being accepted while the batch runs
+                    results = await loop.run_in_executor(None, lambda: search_many(
+                        [it[0] for it in items], k, mode, fusion, keyword=self.keyword, vector=self.vector))
+                except Exception as e:
+                    results = e
+                for i, (_, kk, _, _, fut) in enumerate(items):
+                    if fut.done():
+                        continue
+                    if isinstance(results, Exception):
+                        fut.set_exception(results)
+                    else:
+                        fut.set_result(results[i][:kk])
+            last = len(batch)
+            self.stats["batches"] += 1
+            self.stats["queries"] += len(batch)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+
+    # ---------------------------------------------------------------- HTTP
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, object]:
+        if path == "/health":
+            return 200, {"ok": True}
+        if path == "/stats":
+            b = self.stats["batches"]
+            return 200, {**self.stats, "mean_batch": round(self.stats["queries"] / b, 2) if b else 0.0}
+        if path == "/metrics":
+            return 200, trace.prometheus_text()
+        if path not in ("/search", "/answer"):
+            return 404, {"error": f"no route {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            req = json.loads(body or b"{}")
+            query, k = str(req["query"]), min(max(1, int(req.get("k", 6))), SERVER_MAX_K)
+            mode, fusion = req.get("mode", "hybrid"), req.get("fusion", HYBRID_FUSION)
+            budget = int(req.get("budget", CONTEXT_BUDGET if path == "/answer" else 0))
+            if mode not in MODES or fusion not in ("rrf", "weighted"):
+                raise ValueError(f"bad mode/fusion {mode}/{fusion}")
+        except Exception as e:
+            return 400, {"error": f"bad request: {e}"}
+        hits = await self.search(query, k, mode, fusion)
+        loop = asyncio.get_running_loop()
+        context, citations = await loop.run_in_executor(None, pack_hits, query, hits, budget)
+        out = {"context": context, "citations": citations}
+        if path == "/answer":
+            from .llm import answer_with_fallback
+            out["answer"] = await loop.run_in_executor(None, answer_with_fallback, query, context)
+        return 200, out
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload, close: bool):
+        if isinstance(payload, str):
+            data, ctype = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            data, ctype = json.dumps(payload).encode(), "application/json"
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: {ctype}\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: {'close' if close else 'keep-alive'}"
+                     f"\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, _ = line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = h.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= SERVER_MAX_BODY:
+                    # the body is left unread, so the connection cannot carry another request
+                    status = 400 if length < 0 else 413
+                    error = "bad content-length" if length < 0 else f"body over {SERVER_MAX_BODY} bytes"
+                    self.stats["requests"] += 1
+                    trace.observe("rag_request_seconds", 0.0, status=status, path="other")
+                    await self._respond(writer, status, {"error": error}, close=True)
+                    break
+                body = await reader.readexactly(length)
+                self.stats["requests"] += 1
+                path, t0 = urlsplit(target).path, time.perf_counter()
+                try:
+                    status, payload = await self._route(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                trace.observe("rag_request_seconds", time.perf_counter() - t0, status=status,
+                              path=path if path in _ROUTES else "other")
+                close = headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, payload, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = SERVER_HOST, port: int = SERVER_PORT) -> int:
+        """Start listening (port 0 picks a free one); returns the bound port."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        # load indexes and encoder before the first request, not during it
+        await self._loop.run_in_executor(None, lambda: search_many(["warm up"], 1, "hybrid",
+                                                                   keyword=self.keyword, vector=self.vector))
+        self._batch_task = asyncio.ensure_future(self._batcher())
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, host: str = SERVER_HOST, port: int = SERVER_PORT):
+        port = await self.start(host, port)
+        print(f"rag.server listening on http://{host}:{port} "
+              f"(max batch {self.max_batch}, max wait {self.max_wait * 1000:g} ms)")
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_background(self, host: str = SERVER_HOST, port: int = 0) -> int:
+        """Run the server on its own event-loop thread (for rag.bench and embedding in other apps)."""
+        ready = threading.Event()
+        bound = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            bound.append(loop.run_until_complete(self.start(host, port)))
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True, name="rag-server").start()
+        ready.wait()
+        return bound[0]
+
+    def stop(self):
+        if self._loop and self._server:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._batch_task.cancel)
+
+
+class QueryClient:
+    """
+    Client for QueryServer. One keep-alive connection per thread; a dropped
+    connection is reopened once before the error is raised.
+    """
+
+    def __init__(self, url: str = SERVER_URL or f"http://{SERVER_HOST}:{SERVER_PORT}", timeout: float = 60.0):
+        u = urlsplit(url)
+        self.host, self.port, self.timeout = u.hostname, u.port or 80, timeout
+        self._local = threading.local()
+
+    def _conn(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def request(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
+        body = json.dumps(payload).encode() if payload is not None else None
+        for attempt in (0, 1):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                data = json.loads(resp.read() or b"{}")
+                if resp.status != 200:
+                    raise RuntimeError(f"rag.server {resp.status}: {data.get('error')}")
+                return data
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def health(self) -> bool:
+        try:
+            return bool(self.request("GET", "/health").get("ok"))
+        except Exception:
+            return False
+
+    def search(self, query: str, k: int = 6, mode: str = "hybrid", fusion: str = HYBRID_FUSION,
+               budget: int = 0) -> Tuple[str, List[dict]]:
+        """(context, citations), the same shape as hybrid.answer."""
+        r = self.request("POST", "/search", {"query": query, "k": k, "mode": mode, "fusion": fusion,
+                                             "budget": budget})
+        return r["context"], r["citations"]
+
+    def answer(self, query: str, k: int = 6, mode: str = "hybrid", fusion: str = HYBRID_FUSION,
+               budget: int = CONTEXT_BUDGET) -> Tuple[str, str, List[dict]]:
+        """(answer, context, citations) with the LLM (or extractive fallback) run by the server."""
+        r = self.request("POST", "/answer", {"query": query, "k": k, "mode": mode, "fusion": fusion,
+                                             "budget": budget})
+        return r["answer"], r["context"], r["citations"]
+
+
+_client = None
+
+
+def get_client() -> Optional[QueryClient]:
+    """QueryClient for RAG_SERVER_URL, or None when the UIs should retrieve in-process."""
+    global _client
+    if _client is None and SERVER_URL:
+        _client = QueryClient(SERVER_URL)
+    return _client
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=SERVER_HOST)
+    ap.add_argument("--port", type=int, default=SERVER_PORT)
+    ap.add_argument("--max-batch", type=int, default=SERVER_MAX_BATCH)
+    ap.add_argument("--max-wait-ms", type=float, default=SERVER_MAX_WAIT_MS)
+    args = ap.parse_args()
+    server = QueryServer(max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
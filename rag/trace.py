@@ -0,0 +1,336 @@
+# rag/trace.py
+#
+# Lightweight tracing and metrics for the pipeline. Off unless RAG_TRACE=1 (or
+# enable()); while off, span() returns a shared no-op and incr / observe / error
+# return at once, so instrumented code pays one flag check.
+#
+# Spans nest through a context variable and are aggregated by path: a crawl that
+# fetches 500 pages has one "fetch.url" node with count=500 and total / max time.
+# Work done in thread pools joins the caller's span when submitted with
+# contextvars.copy_context().run; work done in other processes is added with
+# record() from the timings they return. When a root span ends, the run (span
+# tree + the counters incremented during it) is appended to TRACE_LOG as one JSON
+# line; last_run() returns the latest one.
+#
+# Counters and histograms are process-wide and exported in the Prometheus text
+# format by prometheus_text() (served at GET /metrics by rag.server).
+#
+#   python -m rag.trace              # latest run as an indented breakdown
+#   python -m rag.trace --metrics    # Prometheus text for this process (mostly useful in-process)
+
+import argparse
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .config import TRACE_ENABLED, TRACE_LOG, TRACE_LOG_MAX
+
+_enabled = TRACE_ENABLED
+_lock = threading.Lock()
+_current: contextvars.ContextVar = contextvars.ContextVar("rag_trace_span", default=None)
+_log = logging.getLogger("rag")
+
+# seconds; the span-duration histogram and any observe() without its own buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def enable(on: bool = True):
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+# --------------------------------------------------------------------------------------
+# Metrics
+# --------------------------------------------------------------------------------------
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+_counters: Dict[_Key, float] = {}
+_hists: Dict[_Key, list] = {}  # key -> [per-bucket counts..., sum, count]; cumulated on export
+
+
+def _key(name: str, labels: dict) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def incr(name: str, value: float = 1, **labels):
+    """Add to a counter (and to the running trace's counters)."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    node = _current.get()
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        if node is not None:
+            run = node.root.counters
+            label = name + "".join(f" {k}={v}" for k, v in key[1])
+            run[label] = run.get(label, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Add a sample to a histogram (BUCKETS, in seconds)."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        h = _hists.get(key)
+        if h is None:
+            h = _hists[key] = [0] * len(BUCKETS) + [0.0, 0]
+        i = bisect.bisect_left(BUCKETS, value)
+        if i < len(BUCKETS):
+            h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+def error(stage: str, exc: BaseException):
+    """
+    Count an exception that `stage` handles (and otherwise would swallow silently).
+    It is logged at debug level on the "rag" logger whether or not tracing is on.
+    """
+    _log.debug("%s: %s: %s", stage, type(exc).__name__, exc, exc_info=exc)
+    if not _enabled:
+        return
+    incr("rag_failures_total", stage=stage, type=type(exc).__name__)
+    node = _current.get()
+    if node is not None:
+        with _lock:
+            node.errors += 1
+            node.root.last_errors.append(f"{stage}: {type(exc).__name__}: {exc}"[:300])
+            del node.root.last_errors[:-20]
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def prometheus_text() -> str:
+    """Counters and histograms in the Prometheus text exposition format."""
+    lines, typed = [], set()
+    with _lock:
+        counters, hists = dict(_counters), {k: list(v) for k, v in _hists.items()}
+    for (name, labels), v in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(labels)} {v:g}")
+    for (name, labels), h in sorted(hists.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cum = 0
+        for le, n in zip([f"{b:g}" for b in BUCKETS] + ["+Inf"], h[:len(BUCKETS)] + [h[-1]]):
+            cum = n if le == "+Inf" else cum + n
+            lines.append(f"{name}_bucket{_labels(labels, 'le=' + json.dumps(le))} {cum}")
+        lines.append(f"{name}_sum{_labels(labels)} {h[-2]:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _hists.clear()
+
+
+# --------------------------------------------------------------------------------------
+# Spans
+# --------------------------------------------------------------------------------------
+class _Node:
+    __slots__ = ("name", "count", "total", "max", "errors", "children", "root", "counters", "last_errors", "attrs")
+
+    def __init__(self, name: str, root: "Optional[_Node]" = None):
+        self.name = name
+        self.count, self.total, self.max, self.errors = 0, 0.0, 0.0, 0
+        self.children: Dict[str, _Node] = {}
+        self.root = root or self
+        if root is None:
+            self.counters, self.last_errors, self.attrs = {}, [], {}
+
+    def child(self, name: str) -> "_Node":
+        node = self.children.get(name)
+        if node is None:
+            with _lock:
+                node = self.children.setdefault(name, _Node(name, self.root))
+        return node
+
+    def add(self, seconds: float, n: int = 1, errors: int = 0):
+        with _lock:
+            self.count += n
+            self.total += seconds
+            self.max = max(self.max, seconds if n == 1 else seconds / n)
+            self.errors += errors
+
+    def to_dict(self) -> dict:
+        d = {"name": self.name, "count": self.count, "ms": round(self.total * 1000, 3),
+             "max_ms": round(self.max * 1000, 3)}
+        if self.errors:
+            d["errors"] = self.errors
+        if self.children:
+            d["children"] = [c.to_dict() for c in list(self.children.values())]
+        return d
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "node", "token", "t0")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name, self.attrs = name, attrs
+
+    def __enter__(self):
+        parent = _current.get()
+        self.node = _Node(self.name) if parent is None else parent.child(self.name)
+        if parent is None and self.attrs:
+            self.node.attrs.update(self.attrs)
+        self.token = _current.set(self.node)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, et, e, tb):
+        dt = time.perf_counter() - self.t0
+        _current.reset(self.token)
+        self.node.add(dt, errors=int(et is not None))
+        observe("rag_span_seconds", dt, span=self.name)
+        if et is not None:
+            incr("rag_failures_total", stage=self.name, type=et.__name__)
+        if self.node.root is self.node:
+            _finish(self.node, dt)
+        return False
+
+    def set(self, **attrs):
+        """Attach attributes to the run (recorded on the root span)."""
+        self.node.root.attrs.update(attrs)
+
+
+def span(name: str, **attrs):
+    """Timing span: `with trace.span("vector.search"): ...`; attrs are kept on a root span."""
+    if not _enabled:
+        return _NOOP
+    return _Span(name, attrs)
+
+
+def traced(name: str):
+    """Decorator form of span()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            if not _enabled:
+                return fn(*a, **kw)
+            with _Span(name, {}):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+
+def record(name: str, seconds: float, n: int = 1):
+    """Add `n` spans totalling `seconds` measured elsewhere (e.g. in a worker process) under the current span."""
+    if not _enabled:
+        return
+    parent = _current.get()
+    if parent is not None:
+        parent.child(name).add(seconds, n)
+    observe("rag_span_seconds", seconds / max(n, 1), span=name)
+
+
+# --------------------------------------------------------------------------------------
+# Runs
+# --------------------------------------------------------------------------------------
+_last: Optional[dict] = None
+
+
+def _finish(root: _Node, seconds: float):
+    global _last
+    run = {"run": root.name, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(),
+           "ms": round(seconds * 1000, 3), "attrs": root.attrs, "spans": root.to_dict(),
+           "counters": root.counters, "errors": root.last_errors}
+    _last = run
+    try:
+        TRACE_LOG.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(run, default=str) + "\n"
+        with _lock:
+            if TRACE_LOG.exists() and TRACE_LOG.stat().st_size > TRACE_LOG_MAX:
+                os.replace(TRACE_LOG, TRACE_LOG.with_name(TRACE_LOG.name + ".1"))
+            with TRACE_LOG.open("a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError:
+        pass  # tracing never breaks the traced code
+
+
+def last_run(name: Optional[str] = None) -> Optional[dict]:
+    """Latest finished run (optionally of root span `name`): this process's, else the log's last line."""
+    if _last is not None and (name is None or _last["run"] == name):
+        return _last
+    if not TRACE_LOG.exists():
+        return None
+    with TRACE_LOG.open("rb") as f:
+        f.seek(max(0, TRACE_LOG.stat().st_size - 512 * 1024))
+        lines = f.read().decode("utf-8", "replace").splitlines()
+    for line in reversed(lines):
+        try:
+            run = json.loads(line)
+        except ValueError:
+            continue
+        if name is None or run.get("run") == name:
+            return run
+    return None
+
+
+def breakdown(run: dict) -> list:
+    """Flattened span tree: [{"span" (indented), "count", "ms", "max_ms", "share"}] in tree order."""
+    rows, total = [], run["spans"]["ms"] or 1.0
+
+    def walk(node: dict, depth: int):
+        rows.append({"span": "  " * depth + node["name"], "count": node["count"], "ms": node["ms"],
+                     "max_ms": node["max_ms"], "share": f"{node['ms'] / total:.0%}", "errors": node.get("errors", 0)})
+        for c in sorted(node.get("children", []), key=lambda c: -c["ms"]):
+            walk(c, depth + 1)
+
+    walk(run["spans"], 0)
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--run", help="Latest run of this root span (e.g. parse.build_docs)")
+    ap.add_argument("--metrics", action="store_true")
+    args = ap.parse_args()
+    if args.metrics:
+        print(prometheus_text(), end="")
+    else:
+        run = last_run(args.run)
+        if run is None:
+            print(f"No runs in {TRACE_LOG}. Set RAG_TRACE=1 and run a pipeline step.")
+        else:
+            print(f"{run['run']} at {run['time']}: {run['ms']:.1f} ms")
+            for r in breakdown(run):
+                print(f"  {r['span']:<36} {r['count']:>6}x  {r['ms']:>10.1f} ms  {r['share']:>4}"
+                      + (f"  errors={r['errors']}" if r["errors"] else ""))
+            for k, v in sorted(run["counters"].items()):
+                print(f"  {k} = {v:g}")
+            for e in run["errors"]:
+                print(f"  ! {e}")
@@ -1,12 +1,18 @@
 import gradio as gr
-from .query import answer
+from .query import answer, get_keyword_searcher
+from .server import get_client
 from .workflows import applicability_check, StepResult
 
 def ask(q):
-    text, cites = answer(q, k=6)
+    client = get_client()  # the shared query server when RAG_SERVER_URL is set
+    if client is not None:
+        text, cites = client.search(q, k=6, mode="keyword")
+    else:
+        text, cites = answer(q, k=6, searcher=get_keyword_searcher())
     cite_lines = []
     for c in cites:
-        cite_lines.append(f"- [{c['title']}]({c['source']}) @ ~{c['offset']} (score={c['score']:.3f})")
+        loc = f"p. {c['page']}" if c.get("page") else f"~{c['offset']}"
+        cite_lines.append(f"- [{c['title']}]({c['source']}) @ {loc} (score={c['score']:.3f})")
     return text, "\n".join(cite_lines)
 
 def run_app():
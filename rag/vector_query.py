@@ -1,96 +1,323 @@
 # rag/vector_query.py
 
 import json
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 
-# Optional FAISS acceleration
-try:
-    import faiss  # type: ignore
-    HAS_FAISS = True
-except Exception:
-    HAS_FAISS = False
+from .config import VECTOR_QUERY_CACHE, VECTOR_NPROBE, VECTOR_EF_SEARCH
+from .encoders import get_encoder
+from .index import DOC_BLOCK, top_k_columns, top_k_indices
+from .index_vector import get_faiss, MODEL_NAME, VECTOR_DIR, INDEX_PATH, META_PATH, STORE_PATH, MODEL_TAG_PATH
+from .metastore import MetaStore
+from .query import citation
+from . import trace
 
-from sentence_transformers import SentenceTransformer
-from .index_vector import MODEL_NAME, INDEX_PATH, META_PATH
 
-
-def _load_meta() -> List[Dict[str, Any]]:
-    """Load row-aligned metadata for each embedding vector."""
+def _load_meta(meta_path: Path = META_PATH):
+    """
+    Row-aligned metadata for each embedding vector: the memory-mapped MetaStore
+    next to `meta_path`, or for indexes built before it, meta.jsonl parsed into a list.
+    """
+    store = meta_path.with_name(STORE_PATH.name)
+    if store.exists():
+        return MetaStore(store)
     metas: List[Dict[str, Any]] = []
-    if not META_PATH.exists():
+    if not meta_path.exists():
         return metas
-    with META_PATH.open("r", encoding="utf-8") as f:
+    with meta_path.open("r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
             try:
                 metas.append(json.loads(line))
-            except Exception:
-                # skip bad lines
-                pass
+            except Exception as e:
+                trace.error("vector.meta", e)  # skip bad lines
     return metas
 
 
-def _load_index():
-    """Load FAISS index if present; otherwise numpy matrix fallback."""
-    if HAS_FAISS and INDEX_PATH.exists():
-        return faiss.read_index(str(INDEX_PATH)), "faiss"
+class MatrixIndex:
+    """
+    Exact inner-product search over a memory-mapped embedding matrix, stored as
+    float32, float16 or int8 with a per-dimension scale (rows ~ X / scale).
+    Scores are computed in float32 over cache-sized blocks; top-k by argpartition.
+    A float16 matrix is converted to a float32 copy once, on load: numpy converts
+    float16 about 30x slower than it multiplies float32, and converting each block
+    on every query made searches that much slower. float16 therefore halves the
+    file but not the memory; int8 converts fast enough to stay quantized.
+    """
+
+    def __init__(self, X: np.ndarray, scale: np.ndarray = None, block: int = 1024):
+        if X.dtype == np.float16:
+            W = np.empty(X.shape, dtype=np.float32)
+            for s in range(0, len(X), 65536):
+                W[s:s + 65536] = X[s:s + 65536]
+            X = W
+        self.X, self.scale, self.block = X, scale, block
+        self.ntotal = len(X)
+
+    def scores(self, q_vec: np.ndarray) -> np.ndarray:
+        q = q_vec / self.scale if self.scale is not None else q_vec
+        if self.X.dtype == np.float32:
+            return self.X @ q
+        out = np.empty(self.ntotal, dtype=np.float32)
+        for s in range(0, self.ntotal, self.block):
+            out[s:s + self.block] = self.X[s:s + self.block].astype(np.float32) @ q
+        return out
+
+    def search(self, q_vec: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        sims = self.scores(q_vec)
+        idxs = top_k_indices(sims, k)
+        return idxs, sims[idxs]
+
+    def search_many(self, Q: np.ndarray, k: int, doc_block: int = DOC_BLOCK) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top `k` for every row of `Q`, one matrix-matrix product per `doc_block` rows
+        with a running top-k; (nq x k) ids and scores.
+        """
+        Qs = (Q / self.scale if self.scale is not None else Q).T.astype(np.float32)
+        if min(k, self.ntotal) <= 0:
+            return np.zeros((len(Q), 0), dtype=np.int64), np.zeros((len(Q), 0), dtype=np.float32)
+
+        def blocks():
+            for s in range(0, self.ntotal, doc_block):
+                rows = self.X[s:s + doc_block]
+                if rows.dtype == np.float32:
+                    yield s, rows @ Qs
+                else:
+                    S = np.empty((len(rows), len(Q)), dtype=np.float32)
+                    for b in range(0, len(rows), self.block):
+                        S[b:b + self.block] = rows[b:b + self.block].astype(np.float32) @ Qs
+                    yield s, S
+
+        return top_k_columns(blocks(), k)
 
-    npy = str(INDEX_PATH) + ".npy"
-    if Path(npy).exists():
-        X = np.load(npy).astype("float32")
-        return X, "numpy"
+
+def _tune(index, nprobe: int, ef_search: int):
+    """Apply the search-time knobs that `index` has (IVF nprobe, HNSW efSearch)."""
+    try:
+        get_faiss().extract_index_ivf(index).nprobe = nprobe
+    except Exception:
+        pass
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def _load_index(index_path: Path = INDEX_PATH, nprobe: int = VECTOR_NPROBE, ef_search: int = VECTOR_EF_SEARCH):
+    """Load FAISS index if present; otherwise numpy matrix fallback (memory-mapped)."""
+    # FAISS (optional acceleration) is imported only once there is a FAISS index to read
+    faiss = get_faiss() if index_path.exists() else None
+    if faiss is not None:
+        index = faiss.read_index(str(index_path))
+        _tune(index, nprobe, ef_search)
+        return index, "faiss"
+
+    npy = Path(str(index_path) + ".npy")
+    if npy.exists():
+        scale = Path(str(index_path) + ".scale.npy")
+        return MatrixIndex(np.load(npy, mmap_mode="r"), np.load(scale) if scale.exists() else None), "numpy"
 
     return None, None
 
 
-def search_vector(question: str, k: int = 6) -> Tuple[str, List[Dict[str, Any]]]:
+def _normalize(question: str) -> str:
+    return " ".join(question.split()).lower()
+
+
+class Loaded(NamedTuple):
+    """One generation of the vector index with its metadata and encoder; replaced as a whole."""
+    stamp: Any
+    index: Any
+    kind: Optional[str]
+    metas: Any  # MetaStore, or the meta.jsonl records of indexes from before it
+    model_name: Optional[str]
+    encoder: Any
+
+    @property
+    def built(self) -> bool:
+        return self.index is not None and len(self.metas) > 0
+
+
+_EMPTY = Loaded(None, None, None, [], None, None)
+
+
+class VectorSearcher:
+    """
+    Encoder, vector index and metadata held in memory between questions. They are
+    loaded again only when model.txt, the index or the metadata changes on disk,
+    or when `vector_dir` is a symlink that rag.jobs points at a new generation.
+    A reload swaps the one `loaded` bundle, and each query reads it once, so a
+    query never embeds with one generation's encoder and searches or maps ids
+    through another's. Query embeddings are kept in a bounded LRU keyed by model
+    and normalized question text, so a repeated question skips the encoder.
+    """
+
+    def __init__(self, vector_dir: Path = VECTOR_DIR, cache_size: int = VECTOR_QUERY_CACHE,
+                 nprobe: int = VECTOR_NPROBE, ef_search: int = VECTOR_EF_SEARCH):
+        self.vector_dir = Path(vector_dir)
+        self.nprobe, self.ef_search = nprobe, ef_search
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self.loaded = _EMPTY
+        self._cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self.hits = self.misses = 0
+
+    def _files_stamp(self, d: Path):
+        paths = (d / MODEL_TAG_PATH.name, d / INDEX_PATH.name, d / (INDEX_PATH.name + ".npy"),
+                 d / (INDEX_PATH.name + ".scale.npy"), d / META_PATH.name, d / STORE_PATH.name)
+        return (str(d),) + tuple(p.stat().st_mtime_ns if p.exists() else None for p in paths)
+
+    def _load(self) -> Loaded:
+        d = self.vector_dir.resolve()  # one generation: every file below is read from the same directory
+        stamp = self._files_stamp(d)
+        cur = self.loaded
+        if cur.stamp == stamp:
+            return cur
+        with self._lock:
+            cur = self.loaded
+            if cur.stamp == stamp:
+                return cur
+            with trace.span("vector.load"):
+                index, kind = _load_index(d / INDEX_PATH.name, self.nprobe, self.ef_search)
+            with trace.span("vector.meta_load"):
+                metas = _load_meta(d / META_PATH.name)
+            tag_path = d / MODEL_TAG_PATH.name
+            tag = tag_path.read_text(encoding="utf-8").strip() if tag_path.exists() else MODEL_NAME
+            model_name, encoder = cur.model_name, cur.encoder
+            if index is not None and tag != model_name:
+                # the index was built with `tag`; queries must use the same model
+                with trace.span("vector.load_encoder"):
+                    model_name, encoder = tag, get_encoder(tag)
+            self.loaded = Loaded(stamp, index, kind, metas, model_name, encoder)
+            return self.loaded
+
+    def _ensure_loaded(self) -> bool:
+        return self._load().built
+
+    # the current generation's parts (a query should take self._load() once instead)
+    index = property(lambda self: self.loaded.index)
+    kind = property(lambda self: self.loaded.kind)
+    metas = property(lambda self: self.loaded.metas)
+    model_name = property(lambda self: self.loaded.model_name)
+    encoder = property(lambda self: self.loaded.encoder)
+
+    def embed(self, question: str, ix: Optional[Loaded] = None) -> np.ndarray:
+        ix = ix or self._load()
+        key = (ix.model_name, _normalize(question))
+        with self._lock:
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                trace.incr("rag_query_cache_total", result="hit")
+                return vec
+        trace.incr("rag_query_cache_total", result="miss")
+        with trace.span("vector.encode_query"):
+            vec = ix.encoder.encode([key[1]], normalize_embeddings=True)[0].astype("float32")
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = vec
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vec
+
+    def embed_many(self, questions: List[str], batch_size: int = 64, ix: Optional[Loaded] = None) -> np.ndarray:
+        """embed() for a list: cached questions are reused, the rest go through the encoder in batches."""
+        ix = ix or self._load()
+        keys = [(ix.model_name, _normalize(q)) for q in questions]
+        vecs: Dict[Tuple[str, str], np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vec = self._cache.get(key)
+                if vec is not None:
+                    self._cache.move_to_end(key)
+                    vecs[key] = vec
+            self.hits += sum(key in vecs for key in keys)
+        todo = list(dict.fromkeys(key for key in keys if key not in vecs))
+        trace.incr("rag_query_cache_total", len(keys) - len(todo), result="hit")
+        trace.incr("rag_query_cache_total", len(todo), result="miss")
+        if todo:
+            with trace.span("vector.encode_query"):
+                enc = ix.encoder.encode([key[1] for key in todo], batch_size=batch_size, show_progress_bar=False,
+                                          normalize_embeddings=True).astype("float32")
+            with self._lock:
+                self.misses += len(todo)
+                for key, vec in zip(todo, enc):
+                    vecs[key] = vec
+                    self._cache[key] = vec
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return np.stack([vecs[key] for key in keys])
+
+    def search_ids(self, question: str, k: int = 6, ix: Optional[Loaded] = None) -> Tuple[np.ndarray, np.ndarray]:
+        ix = ix or self._load()
+        if not ix.built:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        q_vec = self.embed(question, ix)
+        with trace.span("vector.index_search"):
+            if ix.kind == "faiss":
+                D, I = ix.index.search(q_vec.reshape(1, -1), k)
+                return I[0], D[0]
+            # numpy cosine similarity (inner product on normalized vectors)
+            return ix.index.search(q_vec, k)
+
+    @trace.traced("vector.search")
+    def search(self, question: str, top_k: int = 6) -> List[Tuple[Dict[str, Any], float]]:
+        ix = self._load()
+        idxs, scores = self.search_ids(question, top_k, ix)
+        with trace.span("meta.fetch"):
+            return [(ix.metas[i], float(sc)) for i, sc in zip(idxs, scores) if 0 <= i < len(ix.metas)]
+
+    @trace.traced("vector.search_many")
+    def search_many(self, questions: List[str], top_k: int = 6,
+                    batch_size: int = 64) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """search() for a list: one batched encode and one index search for all questions."""
+        ix = self._load()
+        if not questions or not ix.built:
+            return [[] for _ in questions]
+        Q = self.embed_many(questions, batch_size, ix)
+        with trace.span("vector.index_search"):
+            if ix.kind == "faiss":
+                D, I = ix.index.search(Q, top_k)
+            else:
+                I, D = ix.index.search_many(Q, top_k)
+        with trace.span("meta.fetch"):
+            return [[(ix.metas[i], float(sc)) for i, sc in zip(ids, scores) if 0 <= i < len(ix.metas)]
+                    for ids, scores in zip(I, D)]
+
+
+_searcher = None
+
+
+def get_vector_searcher() -> VectorSearcher:
+    global _searcher
+    if _searcher is None:
+        _searcher = VectorSearcher()
+    return _searcher
+
+
+def search_vector(question: str, k: int = 6, searcher: VectorSearcher = None) -> Tuple[str, List[Dict[str, Any]]]:
     """
     Semantic vector search over the embedded corpus.
 
     Returns:
       stitched_context: str  -> concatenated top-k chunks separated by rules
-      citations: List[Dict]  -> [{title, source, offset, score}, ...]
+      citations: List[Dict]  -> [{title, source, offset, page, section, score}, ...]
     """
-    metas = _load_meta()
-    index, typ = _load_index()
-    if index is None or not metas:
+    searcher = searcher or get_vector_searcher()
+    if not searcher._ensure_loaded():
         return "Vector index not built yet. Click 'Build Vector Index' in the sidebar.", []
 
-    # Encode the query
-    model = SentenceTransformer(MODEL_NAME)
-    q_vec = model.encode([question], normalize_embeddings=True)[0].astype("float32")
-
-    # Search
-    if typ == "faiss":
-        D, I = index.search(q_vec.reshape(1, -1), k)
-        scores = D[0]
-        idxs = I[0]
-    else:
-        # numpy cosine similarity (inner product on normalized vectors)
-        X = index  # (N, D)
-        sims = X @ q_vec  # (N,)
-        idxs = np.argsort(-sims)[:k]
-        scores = sims[idxs]
-
     # Collect chunks + citations
     chunks: List[str] = []
     cites: List[Dict[str, Any]] = []
-    for idx, sc in zip(idxs, scores):
-        if idx < 0 or idx >= len(metas):
-            continue
-        m = metas[idx]
+    for m, sc in searcher.search(question, k):
         chunks.append(m.get("text", ""))
-        cites.append({
-            "title": m.get("title", ""),
-            "source": m.get("source", ""),
-            "offset": int(m.get("offset", 0)),
-            "score": float(sc),
-        })
+        cites.append(citation(m, sc))
 
     stitched = "\n\n---\n\n".join(chunks)
     return stitched, cites
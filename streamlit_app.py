@@ -1,26 +1,20 @@
 
 # streamlit_app.py (vector-enabled version)
 
-import os, re, json, datetime as dt
+import os, re, json, hashlib, datetime as dt
 from pathlib import Path
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-from pdfminer.high_level import extract_text as pdf_extract_text
-
-from rag.config import RAW_DIR, PROCESSED_DIR, DOCS_JSONL, INDEX_PATH
-from rag.parse import build_docs as parse_build_docs
-from rag.index import build_index as index_build_index
-from rag.query import answer as rag_answer
-from rag.llm import answer_with_fallback
-from rag.index_vector import build_vector_index, VECTOR_DIR, INDEX_PATH as VEC_INDEX_PATH
-from rag.vector_query import search_vector
-
-try:
-    from docx import Document as DocxDocument
-    HAS_DOCX = True
-except:
-    HAS_DOCX = False
+
+from rag.config import RAW_DIR, PROCESSED_DIR, DOCS_JSONL, INDEX_PATH, BM25_DIR, CONTEXT_BUDGET
+from rag.parse import parse_files
+from rag.bm25 import add_docs as bm25_add_docs, read_manifest
+from rag.query import get_keyword_searcher
+from rag.hybrid import answer as hybrid_answer
+from rag.llm import stream_with_fallback
+from rag.index_vector import VECTOR_DIR, INDEX_PATH as VEC_INDEX_PATH
+from rag.vector_query import get_vector_searcher
+from rag.server import get_client
+from rag import jobs, trace
 
 APP_TITLE = "AirPilot • Texas Title V Dashboard (EPA + TCEQ)"
 st.set_page_config(page_title=APP_TITLE, layout="wide")
@@ -36,26 +30,68 @@ def save_uploaded_file(up, dest):
     path.write_bytes(up.read())
     return path
 
+@st.cache_resource
+def keyword_searcher():
+    # survives reruns; reloads itself when the index file changes
+    return get_keyword_searcher()
+
+@st.cache_resource
+def vector_searcher():
+    # encoder, index and metadata stay loaded; reloads when model.txt or the index changes
+    return get_vector_searcher()
+
+def job_panel():
+    job = jobs.latest()
+    if job is None:
+        return
+    done, total = jobs.progress(job)
+    stage = f" - {job['stage']}" if job["stage"] else ""
+    st.progress(done / total, text=f"{job['job']} build: {job['state']}{stage}")
+    st.table([{"stage": s["name"], "state": s["state"], "seconds": s.get("seconds", "")} for s in job["stages"]])
+    if job["error"]:
+        st.error(job["error"])
+    if job["state"] in jobs.ACTIVE and st.button("Cancel build"):
+        jobs.cancel(job["id"])
+    seen = st.session_state.setdefault("jobs_seen", set())
+    if job["state"] == "done" and job["id"] not in seen:
+        seen.add(job["id"])
+        keyword_searcher.clear()  # a first BM25 build switches the keyword backend
+
+if hasattr(st, "fragment"):
+    job_panel = st.fragment(run_every=2)(job_panel)  # polls the status file without rerunning the page
+
+def retrieve(q, k=6, budget=0):
+    # through the shared query server when RAG_SERVER_URL is set, else in this process.
+    # budget > 0 packs the best sentences into that many tokens (rag.context)
+    client = get_client()
+    if client is not None:
+        return client.search(q, k=k, mode=mode.lower(), budget=budget)
+    return hybrid_answer(q, k=k, mode=mode.lower(), budget=budget, keyword=keyword_searcher(), vector=vector_searcher())
+
 ensure_dirs()
 st.title(APP_TITLE)
 
 with st.sidebar:
     st.subheader("Corpus Status")
     st.write(f"Docs: {'OK' if DOCS_JSONL.exists() else 'Missing'}")
-    st.write(f"BM25: {'OK' if INDEX_PATH.exists() else 'Missing'}")
+    bm25_segments = read_manifest(BM25_DIR)["segments"]
+    st.write(f"BM25: {f'OK ({len(bm25_segments)} segments)' if bm25_segments else 'Missing'}")
+    st.write(f"TF-IDF: {'OK' if INDEX_PATH.exists() else 'Missing'}")
     st.write(f"Vector dir: {'OK' if VECTOR_DIR.exists() else 'Missing'}")
     st.write(f"FAISS index: {'OK' if VEC_INDEX_PATH.exists() else 'Missing'}")
+    if get_client() is not None:
+        st.write(f"Query server: {'OK' if get_client().health() else 'Unreachable'}")
 
-    use_vec = st.checkbox("Use Vector Search (BGE)", value=True)
-
-    if st.button("Build Vector Index"):
-        n, msg = build_vector_index()
-        st.success(f"Indexed {n} chunks | {msg}")
+    mode = st.radio("Retrieval", ["Keyword", "Vector", "Hybrid"], index=2,
+                    help="Hybrid runs BM25 and vector search concurrently and fuses the rankings")
 
-    if st.button("Rebuild BM25 Index"):
-        parse_build_docs()
-        index_build_index()
-        st.success("BM25 rebuilt.")
+    # builds run in a worker process (rag.jobs); searches keep using the current indexes until it finishes
+    for label, name in (("Build Vector Index", "vector"), ("Rebuild BM25 Index", "keyword")):
+        if st.button(label):
+            job_id = jobs.start(name)
+            if jobs.status(job_id)["job"] != name:
+                st.warning(f"Another build is running ({job_id}); try again when it finishes.")
+    job_panel()
 
 tabs = st.tabs([
     "Chatbot",
@@ -67,22 +103,17 @@ with tabs[0]:
     st.subheader("Chatbot (RAG)")
     query = st.text_input("Ask:")
     if st.button("Send"):
-        if use_vec:
-            ctx, cites = search_vector(query, k=6)
-        else:
-            ctx, cites = rag_answer(query, k=6)
-        ans = answer_with_fallback(query, ctx)
-        st.write(ans)
+        # the question itself stays out of the trace log; the hash still groups repeats
+        with trace.span("chat.answer", query_sha=hashlib.sha256(query.encode("utf-8")).hexdigest()[:12]):
+            ctx, cites = retrieve(query, budget=CONTEXT_BUDGET)
+            st.write_stream(stream_with_fallback(query, ctx))  # token by token; cached answers appear at once
         st.write(cites)
 
 with tabs[1]:
     st.subheader("Search Corpus")
     q = st.text_input("Search:")
     if st.button("Go"):
-        if use_vec:
-            ctx, cites = search_vector(q, k=6)
-        else:
-            ctx, cites = rag_answer(q, k=6)
+        ctx, cites = retrieve(q)
         st.text_area("Results", ctx)
 
 with tabs[2]:
@@ -92,5 +123,24 @@ with tabs[2]:
         saved = []
         for f in uploaded:
             p = save_uploaded_file(f, RAW_DIR / "custom")
-            saved.append(p.name)
-        st.success(f"Saved: {saved}")
+            saved.append(p)
+        st.success(f"Saved: {[p.name for p in saved]}")
+        # append to the keyword index instead of a full rebuild; the searcher picks up the new manifest.
+        # Streamlit reruns this block on every interaction, so index each upload once.
+        done = st.session_state.setdefault("bm25_indexed", set())
+        fresh = [p for p, f in zip(saved, uploaded) if (f.name, f.size) not in done]
+        if fresh:
+            res = bm25_add_docs(parse_files(fresh))
+            done.update((f.name, f.size) for f in uploaded)
+            st.info(f"BM25: added {res['added']} chunks, replaced {res['deleted']} ({res['segments']} segments)")
+
+# rendered last, so it shows this script run's answer / rebuild
+if trace.enabled():
+    with st.sidebar:
+        run = trace.last_run()
+        if run is not None:
+            st.subheader("Last run")
+            st.caption(f"{run['run']} at {run['time']}: {run['ms']:.0f} ms")
+            st.table(trace.breakdown(run))
+            if run["errors"]:
+                st.warning("\n".join(run["errors"]))
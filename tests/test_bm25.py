@@ -0,0 +1,33 @@
+# tests/test_bm25.py
+import json
+
+import numpy as np
+
+from rag import bm25
+
+DOCS = [
+    {"title": "Deviation reports", "source": "a", "text": "Deviation reports are due semiannually with the permit certification."},
+    {"title": "Opacity", "source": "b", "text": "Visible emissions opacity shall not exceed twenty percent averaged over six minutes."},
+    {"title": "Fees", "source": "c", "text": "Annual emissions fees are assessed per ton of regulated pollutant."},
+    {"title": "Records", "source": "d", "text": "Records of deviation reports and emissions fees are kept for five years."},
+    {"title": "Flares", "source": "e", "text": "Flares shall be operated with a flame present at all times."},
+]
+
+
+def test_search_many_matches_search(tmp_path):
+    docs_path = tmp_path / "docs.jsonl"
+    docs_path.write_text("".join(json.dumps(d) + "\n" for d in DOCS), encoding="utf-8")
+    bm25.build_index(docs_path, tmp_path / "bm25")
+    bm25.add_docs([{"title": "Fees", "source": "c", "text": "Emissions fees are due by the end of August."}],
+                  tmp_path / "bm25", merge=False)  # a second segment and a tombstone
+    s = bm25.Bm25Searcher(tmp_path / "bm25")
+    qs = ["emissions fees", "deviation reports records", "flame", "nothing matches this", "emissions fees"]
+    for k in (1, 3):
+        many = s.search_many(qs, k)
+        for q, hits in zip(qs, many):
+            one = s.search(q, k)
+            assert [d["text"] for d, _ in hits] == [d["text"] for d, _ in one]
+            assert np.allclose([sc for _, sc in hits], [sc for _, sc in one], atol=1e-5)
+    assert s.search_many(["flame"], 3)[0][0][0]["source"] == "e"
+    blocked = s.index.search_many_ids(qs, 2, max_cells=1)  # one query per block
+    assert [ids.tolist() for ids, _ in blocked] == [ids.tolist() for ids, _ in s.index.search_many_ids(qs, 2)]
@@ -0,0 +1,22 @@
+# tests/test_fetch.py
+from rag.bench import serve_sites
+from rag.fetch import crawl, load_manifest
+
+
+def test_full_crawl_keeps_unvisited_entries_and_marks_same_body_unchanged(tmp_path):
+    (srv,) = serve_sites(1, 5, 0.0)
+    try:
+        base = f"http://127.0.0.1:{srv.server_address[1]}"
+        changed = crawl([f"{base}/0.html"], delay=0, outdir=tmp_path, allow=["127.0.0.1"])
+        before = load_manifest(tmp_path)
+        assert len(changed) == len(before) == 5
+
+        changed = crawl([f"{base}/0.html"], max_per_site=1, delay=0, outdir=tmp_path, allow=["127.0.0.1"],
+                        incremental=False)
+        after = load_manifest(tmp_path)
+        assert changed == [] and after.keys() == before.keys()
+        assert after[f"{base}/0.html"]["status"] == "unchanged"
+        assert after[f"{base}/0.html"]["http_status"] == 200  # downloaded again, not a 304
+        assert all(after[u] == before[u] for u in before if u != f"{base}/0.html")
+    finally:
+        srv.shutdown()
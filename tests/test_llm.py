@@ -0,0 +1,182 @@
+# tests/test_llm.py
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rag import llm
+
+CTX = "Section 122.146. The permit holder shall submit the annual compliance certification."
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    c = llm.AnswerCache(tmp_path / "answers.sqlite", ttl=3600, max_entries=3)
+    monkeypatch.setattr(llm, "_cache", c)
+    monkeypatch.setattr(llm, "_client", None)
+    monkeypatch.setattr(llm, "_client_key", None)
+    return c
+
+
+# --------------------------------------------------------------------------------------
+# Fallbacks
+# --------------------------------------------------------------------------------------
+def test_no_key_falls_back_to_extractive(cache, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    assert llm.get_client() is None
+    assert llm.synthesize_with_openai("q", CTX) is None
+    assert list(llm.stream_openai("q", CTX)) == []
+    assert llm.answer_with_fallback("q", CTX) == CTX
+    assert "".join(llm.stream_with_fallback("q", CTX)) == CTX
+
+
+def test_missing_openai_package_falls_back(cache, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "k")
+    monkeypatch.setitem(sys.modules, "openai", None)  # import raises ImportError
+    assert llm.get_client() is None
+    assert llm.answer_with_fallback("q", CTX) == CTX
+    assert "".join(llm.stream_with_fallback("q", CTX)) == CTX
+
+
+# --------------------------------------------------------------------------------------
+# Answer cache
+# --------------------------------------------------------------------------------------
+def test_cache_hit_and_context_key(cache):
+    assert cache.get("m", "q", CTX) is None
+    cache.put("m", "q", CTX, "answer")
+    assert cache.get("m", "q", CTX) == "answer"
+    assert cache.get("m", "q", CTX + " changed") is None
+    assert cache.get("other-model", "q", CTX) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cache_ttl_expiry(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, "time", lambda: now[0])
+    cache.put("m", "q", CTX, "answer")
+    now[0] += cache.ttl - 1
+    assert cache.get("m", "q", CTX) == "answer"
+    now[0] += 2
+    assert cache.get("m", "q", CTX) is None
+
+
+def test_cache_lru_eviction(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, "time", lambda: now[0])
+    for q in ("a", "b", "c"):
+        now[0] += 1
+        cache.put("m", q, CTX, q.upper())
+    now[0] += 1
+    assert cache.get("m", "a", CTX) == "A"  # now more recently used than b and c
+    now[0] += 1
+    cache.put("m", "d", CTX, "D")
+    assert len(cache) == 3
+    assert cache.get("m", "b", CTX) is None
+    assert [cache.get("m", q, CTX) for q in ("a", "c", "d")] == ["A", "C", "D"]
+
+
+def test_cache_disabled_with_zero_ttl(tmp_path):
+    c = llm.AnswerCache(tmp_path / "off.sqlite", ttl=0)
+    c.put("m", "q", CTX, "answer")
+    assert c.get("m", "q", CTX) is None
+
+
+# --------------------------------------------------------------------------------------
+# Against a local chat-completions stand-in
+# --------------------------------------------------------------------------------------
+WORDS = ["The", "certification", "is", "due", "annually", "within", "30", "days."]
+
+
+def _handler(calls: list, cut_after: int = 0):
+    """Streams WORDS; with `cut_after`, the connection drops after that many deltas."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            calls.append(req)
+            base = {"id": "cmpl-test", "created": 0, "model": req["model"]}
+            if not req.get("stream"):
+                body = json.dumps({**base, "object": "chat.completion", "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": " ".join(WORDS)},
+                     "finish_reason": "stop"}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, w in enumerate(WORDS):
+                if cut_after and i == cut_after:
+                    self.close_connection = True
+                    self.wfile.write(b"5\r\nda")  # a truncated chunk, then the socket closes
+                    return
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [
+                    {"index": 0, "delta": {"content": (" " if i else "") + w}, "finish_reason": None}]}
+                self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self._chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def standin(cache, monkeypatch):
+    pytest.importorskip("openai")
+    servers = []
+
+    def start(cut_after: int = 0) -> list:
+        calls = []
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), _handler(calls, cut_after))
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{srv.server_address[1]}/v1")
+        return calls
+
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+
+def test_completion_is_cached(standin, cache):
+    calls = standin()
+    assert llm.synthesize_with_openai("q", CTX) == " ".join(WORDS)
+    assert llm.synthesize_with_openai("q", CTX) == " ".join(WORDS)
+    assert len(calls) == 1 and cache.hits == 1
+
+
+def test_pooled_client_reused(standin):
+    standin()
+    assert llm.get_client() is llm.get_client()
+
+
+def test_stream_is_cached_when_complete(standin, cache):
+    calls = standin()
+    deltas = list(llm.stream_openai("q", CTX))
+    assert len(deltas) == len(WORDS) and "".join(deltas) == " ".join(WORDS)
+    assert list(llm.stream_openai("q", CTX)) == [" ".join(WORDS)]  # whole, from the cache
+    assert len(calls) == 1
+
+
+def test_partial_stream_is_not_cached(standin, cache):
+    calls = standin(cut_after=3)
+    deltas = list(llm.stream_openai("q", CTX))
+    assert "".join(deltas) == " ".join(WORDS[:3])
+    assert len(cache) == 0
+    list(llm.stream_openai("q", CTX))
+    assert len(calls) == 2  # asked again rather than served the truncated answer
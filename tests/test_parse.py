@@ -0,0 +1,73 @@
+# tests/test_parse.py
+import json
+import random
+import time
+
+import pytest
+
+from rag import parse
+from rag.chunking import chunk_pages, chunk_stream, chunk_text
+
+_real_extract = parse._extract
+_real_extract_all = parse._extract_all
+
+PAGE = "<html><head><title>{0}</title></head><body><article><h1>{0}</h1><p>{1}</p></article></body></html>"
+
+
+def _slow_extract(path):
+    # module level, so worker processes can unpickle it
+    if path.stem.endswith("slow"):
+        time.sleep(30)
+    return _real_extract(path)
+
+
+@pytest.fixture
+def raw(tmp_path, monkeypatch):
+    raw_dir, processed = tmp_path / "raw", tmp_path / "processed"
+    raw_dir.mkdir()
+    monkeypatch.setattr(parse, "RAW_DIR", raw_dir)
+    monkeypatch.setattr(parse, "PROCESSED_DIR", processed)
+    monkeypatch.setattr(parse, "PARSE_CACHE_DIR", processed / "parse_cache")
+    monkeypatch.setattr(parse, "QUARANTINE_PATH", processed / "quarantine.jsonl")
+    for name in ("a", "b-slow", "c", "d", "e", "f"):
+        body = f"Section {name}. The permit holder shall keep records of {name} for five years. " * 5
+        (raw_dir / f"{name}.html").write_text(PAGE.format(f"Rule {name}", body), encoding="utf-8")
+    return raw_dir
+
+
+def test_timeout_quarantines_file_later_files_still_parse_and_it_is_retried(raw, monkeypatch):
+    monkeypatch.setattr(parse, "_extract", _slow_extract)
+    monkeypatch.setattr(parse, "_extract_all", lambda todo, workers: _real_extract_all(todo, workers, timeout=1))
+    stats = {}
+    t0 = time.perf_counter()
+    out = parse.build_docs(workers=1, stats=stats)
+    assert time.perf_counter() - t0 < 20
+    recs = [json.loads(line) for line in open(out, encoding="utf-8")]
+    assert sorted({r["path"].rsplit("/", 1)[-1] for r in recs}) == ["a.html", "c.html", "d.html", "e.html", "f.html"]
+    (q,) = [json.loads(line) for line in parse.QUARANTINE_PATH.read_text(encoding="utf-8").splitlines()]
+    assert q["path"].endswith("b-slow.html") and "timed out" in q["reason"]
+    assert stats["quarantined"] == 1
+
+    # the timeout is not cached: once the file is quick again it is parsed
+    monkeypatch.setattr(parse, "_extract", _real_extract)
+    out = parse.build_docs(workers=1, stats=stats)
+    assert any(json.loads(line)["path"].endswith("b-slow.html") for line in open(out, encoding="utf-8"))
+    assert stats["quarantined"] == 0 and stats["cache_hits"] == 5
+
+
+RULE = ("§ 122.10 General definitions. (a) The owner or operator shall (1) keep records of each unit. "
+        "(i) For each emission unit. (A) Daily. PART 70 — State operating permit programs. 1.2.3 Scope "
+        "Applies to all sources. See paragraph (a) of this section; as follows (b) The operator shall certify. ")
+
+
+def test_chunks_do_not_depend_on_where_pages_are_cut():
+    text = RULE * 60 + "x" * 5000 + RULE * 10
+    whole = list(chunk_text(text))
+    rng = random.Random(0)
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 300)))
+        assert list(chunk_stream(text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)]))) == whole
+    pages = [(n, RULE * 3) for n in range(1, 40)]
+    recs = list(chunk_pages(iter(pages)))
+    assert [(o, s, c) for o, _, s, c in recs] == list(chunk_text(" ".join(t for _, t in pages)))
+    assert recs[0][1] == 1 and recs[-1][1] == 39
@@ -0,0 +1,102 @@
+# tests/test_vector_query.py
+import json
+
+import pytest
+
+from rag.config import ENCODE_POOL_MIN_CHUNKS
+from rag.index_vector import build_vector_index, pool_workers
+from rag.vector_query import VectorSearcher
+
+DOCS = [
+    {"title": "Deviation reports", "source": "a", "text": "Deviation reports are due semiannually with the permit certification."},
+    {"title": "Opacity", "source": "b", "text": "Visible emissions opacity shall not exceed twenty percent averaged over six minutes."},
+    {"title": "Fees", "source": "c", "text": "Annual emissions fees are assessed per ton of regulated pollutant."},
+]
+
+
+def _build(tmp_path, docs, model="hash", kind="numpy"):
+    docs_path = tmp_path / "docs.jsonl"
+    docs_path.write_text("".join(json.dumps(d) + "\n" for d in docs), encoding="utf-8")
+    n, msg = build_vector_index(docs_path=docs_path, vector_dir=tmp_path / "vector", model_name=model,
+                                cache_dir=tmp_path / "cache", workers=1, kind=kind)
+    assert n == len(docs), msg
+
+
+@pytest.fixture
+def searcher(tmp_path):
+    _build(tmp_path, DOCS)
+    return VectorSearcher(tmp_path / "vector", cache_size=2)
+
+
+def test_search(searcher):
+    (meta, score), *_ = searcher.search("opacity of visible emissions", top_k=2)
+    assert meta["source"] == "b" and score > 0
+    assert searcher.model_name == "hash"
+
+
+def test_no_index(tmp_path):
+    s = VectorSearcher(tmp_path / "missing")
+    assert s.search("anything") == [] and s.search_many(["a", "b"]) == [[], []]
+
+
+def test_reloads_when_index_changes(searcher, tmp_path):
+    searcher.search("fees")
+    index = searcher.index
+    _build(tmp_path, DOCS + [{"title": "Flares", "source": "d", "text": "Flares shall be operated with a flame present."}])
+    (meta, _), *_ = searcher.search("flame present at flares", top_k=1)
+    assert meta["source"] == "d"
+    assert searcher.index is not index
+
+
+def test_reloads_encoder_when_model_changes(searcher, tmp_path):
+    searcher.search("fees")
+    old = searcher.loaded
+    _build(tmp_path, DOCS, model="hash-64")
+    searcher.search("fees")
+    assert searcher.model_name == "hash-64" and searcher.encoder is not old.encoder
+    assert searcher.embed("fees").shape == (64,)
+    # a query that took the previous generation keeps its encoder, index and metadata together
+    ids, _ = searcher.search_ids("annual emissions fees", 1, old)
+    assert old.metas[ids[0]]["source"] == "c" and searcher.embed("fees", old).shape != (64,)
+
+
+def test_no_reload_without_change(searcher):
+    searcher.search("fees")
+    index, encoder = searcher.index, searcher.encoder
+    searcher.search("opacity")
+    assert searcher.index is index and searcher.encoder is encoder
+
+
+def test_query_cache_hits_and_lru_bound(searcher):
+    searcher.search("Annual  FEES")
+    searcher.search("annual fees")  # same question after normalization
+    assert (searcher.hits, searcher.misses) == (1, 1)
+    searcher.search("opacity")
+    searcher.search("deviation reports")  # evicts "annual fees", the least recently used
+    assert len(searcher._cache) == 2
+    searcher.search("annual fees")
+    assert (searcher.hits, searcher.misses) == (1, 4)
+    searcher.search("deviation reports")
+    assert searcher.hits == 2
+
+
+def test_search_many_matches_search(searcher):
+    qs = ["fees per ton", "opacity", "fees per ton"]
+    many = searcher.search_many(qs, top_k=3)
+    assert [[m["source"] for m, _ in hits] for hits in many] == \
+           [[m["source"] for m, _ in searcher.search(q, top_k=3)] for q in qs]
+    assert len(searcher._cache) <= 2
+
+
+def test_faiss_index(tmp_path):
+    pytest.importorskip("faiss")
+    _build(tmp_path, DOCS, kind="flat")
+    s = VectorSearcher(tmp_path / "vector")
+    (meta, _), *_ = s.search("annual emissions fees", top_k=1)
+    assert s.kind == "faiss" and meta["source"] == "c"
+
+
+def test_encode_pool_only_for_a_real_model_and_enough_chunks():
+    assert pool_workers("hash", 10 * ENCODE_POOL_MIN_CHUNKS, 4) == 1
+    assert pool_workers("BAAI/bge-base-en", ENCODE_POOL_MIN_CHUNKS - 1, 4) == 1
+    assert pool_workers("BAAI/bge-base-en", ENCODE_POOL_MIN_CHUNKS, 4) == 4